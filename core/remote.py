@@ -25,8 +25,10 @@ logger = logging.getLogger(__name__)
 
 from qtpy.QtCore import QObject
 from urllib.parse import urlparse
+import numpy as np
 import ssl
 from .util.models import DictTableModel, ListTableModel
+from .util import network
 import rpyc
 from rpyc.utils.server import ThreadedServer
 from rpyc.utils.authenticators import SSLAuthenticator
@@ -95,6 +97,24 @@ class RemoteObjectManager(QObject):
                         logger.error('Client requested a module that is not '
                                 'shared.')
                         return None
+
+            def exposed_open_array_transfer(self, array, compression=None):
+                """ Prepare the bulk transfer of a numpy array to the client, see
+                    core.util.network.netobtain.
+
+                  @param numpy.ndarray array: array owned by this side of the connection
+                  @param str compression: None or 'zlib'
+
+                  @return tuple: transfer description, see network.open_array_transfer
+                """
+                if not isinstance(array, np.ndarray):
+                    raise TypeError('Only numpy arrays can be sent by a bulk transfer.')
+                # serve the data on the interface the client is connected to
+                bind_host = ''
+                if hasattr(self, '_conn'):
+                    bind_host = self._conn._channel.stream.sock.getsockname()[0]
+                return network.open_array_transfer(array, compression, bind_host=bind_host)
+
         return RemoteModuleService
 
     def createServer(self, hostname, port, certfile=None, keyfile=None):
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains an append-only buffer for long recordings that moves to a memory-mapped
+file once it grows too large.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import os
+import tempfile
+import threading
+import numpy as np
+
+
+class AppendBuffer:
+    """ Append-only buffer for rows with a fixed number of columns (e.g. time and counts).
+
+    Rows are written into preallocated chunks of chunk_rows rows. Once the chunks would exceed
+    spill_bytes, all rows are moved into a temporary memory-mapped file. A full file is not
+    resized but copied into a new file of twice the size, so the memory usage stays bounded
+    however long the recording runs and the views handed out keep mapping the old file. Rows
+    are never modified after they have been appended, so these views stay valid.
+    """
+
+    def __init__(self, columns, chunk_rows=2**16, spill_bytes=256 * 2**20, spill_dir=None,
+                 dtype=float):
+        """
+        @param int columns: number of columns of each row
+        @param int chunk_rows: number of rows allocated at once
+        @param int spill_bytes: max. size of the chunks in memory. None to never use a file.
+        @param str spill_dir: directory of the temporary file, None for the system default
+        @param dtype: numpy data type of the rows
+        """
+        self._columns = int(columns)
+        self._chunk_rows = max(int(chunk_rows), 1)
+        self._spill_bytes = spill_bytes
+        self._spill_dir = spill_dir
+        self._dtype = np.dtype(dtype)
+        self._lock = threading.Lock()
+        self._chunks = list()
+        self._rows = 0
+        self._memmap = None
+        self.filename = None
+        # files of earlier memory maps, deleted once no view maps them any more
+        self._stale_files = list()
+
+    def __len__(self):
+        return self._rows
+
+    @property
+    def columns(self):
+        return self._columns
+
+    @property
+    def spilled(self):
+        """ True if the rows are stored in a memory-mapped file. """
+        return self._memmap is not None
+
+    def append(self, rows, timestamp=None):
+        """ Append rows to the buffer.
+
+        @param numpy.ndarray rows: 2D array (number of rows, columns) or 1D array for a single
+                                   row. If timestamp is given, the rows miss the first column.
+        @param float timestamp: optional, value written into the first column of all rows
+        """
+        rows = np.asarray(rows)
+        if rows.ndim == 1:
+            rows = rows[np.newaxis, :]
+        first_column = 0 if timestamp is None else 1
+        if rows.shape[1] != self._columns - first_column:
+            raise ValueError('Rows with {0:d} columns do not fit into a buffer of {1:d} columns.'
+                             ''.format(rows.shape[1] + first_column, self._columns))
+        with self._lock:
+            written = 0
+            while written < rows.shape[0]:
+                block, offset, free_rows = self._writable_block()
+                number_of_rows = min(free_rows, rows.shape[0] - written)
+                target = block[offset:offset + number_of_rows]
+                if timestamp is not None:
+                    target[:, 0] = timestamp
+                target[:, first_column:] = rows[written:written + number_of_rows]
+                written += number_of_rows
+                self._rows += number_of_rows
+
+    def get_data(self):
+        """ Get all rows appended so far.
+
+        @return numpy.ndarray: read-only 2D array (rows, columns). A view into the file if the
+                               buffer has been spilled, a copy otherwise.
+        """
+        with self._lock:
+            if self._memmap is not None:
+                return _read_only(self._memmap[:self._rows])
+            if len(self._chunks) == 0:
+                return np.empty((0, self._columns), dtype=self._dtype)
+            return _read_only(np.concatenate(self._chunks)[:self._rows])
+
+    def latest(self, number_of_rows):
+        """ Get the last rows appended. The cost does not depend on the length of the buffer.
+
+        @param int number_of_rows: max. number of rows to return
+
+        @return numpy.ndarray: read-only 2D array (rows, columns), oldest row first
+        """
+        with self._lock:
+            number_of_rows = min(max(int(number_of_rows), 0), self._rows)
+            start = self._rows - number_of_rows
+            if self._memmap is not None:
+                return _read_only(self._memmap[start:self._rows])
+            if number_of_rows == 0:
+                return np.empty((0, self._columns), dtype=self._dtype)
+            first_chunk, first_offset = divmod(start, self._chunk_rows)
+            last_chunk, last_offset = divmod(self._rows - 1, self._chunk_rows)
+            if first_chunk == last_chunk:
+                return _read_only(self._chunks[first_chunk][first_offset:last_offset + 1])
+            parts = [self._chunks[first_chunk][first_offset:]]
+            parts.extend(self._chunks[first_chunk + 1:last_chunk])
+            parts.append(self._chunks[last_chunk][:last_offset + 1])
+            return _read_only(np.concatenate(parts))
+
+    def clear(self):
+        """ Remove all rows and delete the temporary file.
+        """
+        with self._lock:
+            self._chunks = list()
+            self._rows = 0
+            self._memmap = None
+            if self.filename is not None:
+                self._stale_files.append(self.filename)
+                self.filename = None
+            self._remove_stale_files()
+
+    def _writable_block(self):
+        """ Get the array to write the next rows into.
+
+        @return numpy.ndarray, int, int: the chunk or memory map, the row to start writing at
+                                         and the number of free rows in it
+        """
+        if self._memmap is not None:
+            if self._rows >= self._memmap.shape[0]:
+                self._grow_file(2 * self._memmap.shape[0])
+            return self._memmap, self._rows, self._memmap.shape[0] - self._rows
+
+        chunk_index, offset = divmod(self._rows, self._chunk_rows)
+        if chunk_index == len(self._chunks):
+            chunk_bytes = self._chunk_rows * self._columns * self._dtype.itemsize
+            if (self._spill_bytes is not None
+                    and (len(self._chunks) + 1) * chunk_bytes > self._spill_bytes):
+                self._spill()
+                return self._writable_block()
+            self._chunks.append(np.empty((self._chunk_rows, self._columns), dtype=self._dtype))
+        return self._chunks[chunk_index], offset, self._chunk_rows - offset
+
+    def _spill(self):
+        """ Move all rows from the chunks into a temporary memory-mapped file.
+        """
+        self._grow_file(2 * max(self._rows, self._chunk_rows))
+        for index, chunk in enumerate(self._chunks):
+            start = index * self._chunk_rows
+            self._memmap[start:start + self._chunk_rows] = chunk
+        self._chunks = list()
+
+    def _grow_file(self, number_of_rows):
+        """ Map a new file of number_of_rows rows and copy the rows of the current file into it.
+
+        A mapped file cannot be extended on Windows, and the views handed out still map the
+        current file, so it is left as it is and deleted once it is no longer mapped.
+
+        @param int number_of_rows: capacity of the new file in rows
+        """
+        file_handle, filename = tempfile.mkstemp(prefix='qudi_buffer_', suffix='.dat',
+                                                 dir=self._spill_dir)
+        os.close(file_handle)
+        memmap = np.memmap(filename, dtype=self._dtype, mode='w+',
+                           shape=(number_of_rows, self._columns))
+        if self._memmap is not None:
+            memmap[:self._rows] = self._memmap[:self._rows]
+            self._stale_files.append(self.filename)
+        self._memmap = memmap
+        self.filename = filename
+        self._remove_stale_files()
+
+    def _remove_stale_files(self):
+        """ Delete the files of earlier memory maps which no view maps any more.
+        """
+        remaining = list()
+        for filename in self._stale_files:
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # the file is still mapped by a view somebody holds (Windows)
+                remaining.append(filename)
+        self._stale_files = remaining
+
+
+def _read_only(array):
+    """ Read-only view of an array.
+
+    @param numpy.ndarray array: the array to view
+
+    @return numpy.ndarray: view sharing the memory of array
+    """
+    view = array.view()
+    view.flags.writeable = False
+    return view
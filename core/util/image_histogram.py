@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains an incrementally updated histogram of image values for fast percentiles.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import numpy as np
+
+
+class ImageHistogram:
+    """ Histogram of the non-zero values of an image which follows changes of single rows.
+
+    Zeros are left out since they mark pixels which were not scanned yet. Replacing a few rows
+    only histograms these rows, so percentiles for the colour scale of a growing scan image do
+    not need a pass over the whole image. The percentiles are interpolated within the bins, so
+    they are accurate to a fraction of the value range divided by the number of bins. The bin
+    range has some headroom and is only rebuilt from the full image if a new value falls
+    outside of it.
+    """
+
+    def __init__(self, bins=4096, headroom=0.1):
+        """
+        @param int bins: number of histogram bins
+        @param float headroom: fraction of the value range added on both sides of the bin range
+        """
+        self._bins = int(bins)
+        self._headroom = headroom
+        self._counts = np.zeros(self._bins, dtype=np.int64)
+        self._low = 0.0
+        self._high = 1.0
+
+    @property
+    def count(self):
+        """ Number of non-zero values in the histogram. """
+        return int(self._counts.sum())
+
+    def reset(self, image):
+        """ Histogram all values of an image from scratch.
+
+        @param numpy.ndarray image: the image
+        """
+        values = self._values(image)
+        self._counts[:] = 0
+        if values.size == 0:
+            return
+        low, high = values.min(), values.max()
+        margin = (high - low) * self._headroom
+        if margin == 0:
+            margin = max(abs(high), 1.0) * self._headroom
+        self._low = low - margin
+        self._high = high + margin
+        self._counts += self._histogram(values)
+
+    def replace(self, old_values, new_values, image):
+        """ Replace values of the image, e.g. the rows of a new scan line.
+
+        @param numpy.ndarray old_values: the values before the change
+        @param numpy.ndarray new_values: the values after the change
+        @param numpy.ndarray image: the whole image after the change, only used if the bin range
+                                    has to be rebuilt
+        """
+        new_values = self._values(new_values)
+        if new_values.size > 0 and (new_values.min() < self._low
+                                    or new_values.max() > self._high):
+            self.reset(image)
+            return
+        self._counts -= self._histogram(self._values(old_values))
+        self._counts += self._histogram(new_values)
+
+    def percentile(self, percentile):
+        """ Estimate a percentile of the non-zero values, like numpy.percentile.
+
+        @param float percentile: percentile between 0 and 100
+
+        @return float: the estimated value, None if the histogram is empty
+        """
+        cumulative = np.cumsum(self._counts)
+        total = cumulative[-1]
+        if total == 0:
+            return None
+        target = np.clip(percentile, 0, 100) / 100 * total
+        index = min(int(np.searchsorted(cumulative, target)), self._bins - 1)
+        below = cumulative[index - 1] if index > 0 else 0
+        in_bin = self._counts[index]
+        fraction = (target - below) / in_bin if in_bin > 0 else 0.0
+        bin_width = (self._high - self._low) / self._bins
+        return float(self._low + (index + fraction) * bin_width)
+
+    @staticmethod
+    def _values(data):
+        data = np.ravel(data)
+        return data[np.isfinite(data) & (data != 0)]
+
+    def _histogram(self, values):
+        indices = ((values - self._low) * (self._bins / (self._high - self._low))).astype(np.int64)
+        np.clip(indices, 0, self._bins - 1, out=indices)
+        return np.bincount(indices, minlength=self._bins)
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the completion tracking of stage movements for hardware without callbacks.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import threading
+import time
+import weakref
+from concurrent import futures
+
+
+class MotionWatcher:
+    """ Polls the position of a stage in a background thread until a movement is finished.
+
+    watch() returns a concurrent.futures.Future, which resolves with the final position. The
+    polling interval adapts to the movement: from the speed between the last two polls it
+    estimates when the target will be reached and sleeps about half of that time, within
+    min_interval and max_interval. One watcher serializes the polling of its device.
+
+    A movement is finished once the stage stands still within the tolerance of the target.
+    The stage stands still if it moved less than the still tolerance since the last poll, so
+    encoder noise does not count as movement, and if the optional is_moving callable, e.g.
+    based on get_status, does not report a movement. A stage which stands still for stall_time
+    without reaching the target is reported with its current position as well, the caller
+    compares it to the target.
+    """
+
+    def __init__(self, device, min_interval=0.01, max_interval=1.0, stall_time=10.0):
+        """
+        @param device: hardware with get_pos(param_list) returning a dict of positions
+        @param float min_interval: shortest time between two polls in s
+        @param float max_interval: longest time between two polls in s
+        @param float stall_time: time in s after which a stage standing still away from the
+                                 target counts as finished
+        """
+        self._device = device
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.stall_time = stall_time
+        self._executor = futures.ThreadPoolExecutor(max_workers=1)
+        self._lock = threading.Lock()
+        self._aborted = threading.Event()
+
+    def watch(self, target, tolerance=None, still_tolerance=None, is_moving=None, timeout=None):
+        """ Watch the movement to a target position. A pending watch is aborted.
+
+        @param dict target: axis labels and target positions of the moving axes
+        @param dict tolerance: optional, allowed deviation from the target per axis. By default
+                               3% of the distance of the farthest axis at the start of the
+                               watch, like MagnetLogic._check_position_reached_loop, but at
+                               least the pos_step of the axis constraints.
+        @param dict still_tolerance: optional, movement per axis between two polls which still
+                                     counts as standing still. 10% of the tolerance by default.
+        @param callable is_moving: optional, returns True while the hardware reports a movement
+        @param float timeout: optional, time in s after which the future fails with a
+                              TimeoutError if the stage did not finish
+
+        @return concurrent.futures.Future: resolves with the dict of final positions
+        """
+        # every watch has its own abort event, so a poll of the previous watch which is busy
+        # in get_pos still sees its abort
+        with self._lock:
+            self._aborted.set()
+            self._aborted = aborted = threading.Event()
+        return self._executor.submit(self._poll, dict(target), tolerance, still_tolerance,
+                                     is_moving, timeout, aborted)
+
+    def abort(self):
+        """ Resolve the pending watch with the current position. """
+        with self._lock:
+            self._aborted.set()
+
+    def shutdown(self):
+        self.abort()
+        self._executor.shutdown(wait=False)
+
+    def _poll(self, target, tolerance, still_tolerance, is_moving, timeout, aborted):
+        axes = list(target)
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        start = self._device.get_pos(axes)
+        if tolerance is None:
+            distance = max(abs(target[axis] - start[axis]) for axis in axes)
+            resolution = self._resolution(axes)
+            tolerance = {axis: max(0.03 * distance, resolution[axis]) for axis in axes}
+        if still_tolerance is None:
+            still_tolerance = {axis: 0.1 * tolerance[axis] for axis in axes}
+
+        previous = start
+        previous_time = time.perf_counter()
+        still_since = previous_time
+        interval = self.min_interval
+        while not aborted.wait(interval):
+            position = self._device.get_pos(axes)
+            now = time.perf_counter()
+            moved = max(abs(position[axis] - previous[axis]) for axis in axes)
+            standing = all(abs(position[axis] - previous[axis]) <= still_tolerance[axis]
+                           for axis in axes)
+            if standing and is_moving is not None:
+                standing = not is_moving()
+            remaining = max(abs(target[axis] - position[axis]) - tolerance[axis] for axis in axes)
+            if not standing:
+                still_since = now
+            elif remaining <= 0 or now - still_since >= self.stall_time:
+                return position
+            if deadline is not None and now >= deadline:
+                raise TimeoutError('The stage did not reach {0} within {1:.1f} s, last position '
+                                   '{2}.'.format(target, timeout, position))
+
+            # sleep about half of the expected remaining movement time
+            if not standing and moved > 0 and remaining > 0:
+                interval = 0.5 * remaining * (now - previous_time) / moved
+            else:
+                interval = 2 * interval
+            interval = min(max(interval, self.min_interval), self.max_interval)
+            previous = position
+            previous_time = now
+        return self._device.get_pos(axes)
+
+    def _resolution(self, axes):
+        """ pos_step of the axes from the constraints of the device, 0 if not available. """
+        try:
+            constraints = self._device.get_constraints()
+            return {axis: float(constraints[axis].get('pos_step', 0)) for axis in axes}
+        except Exception:
+            return {axis: 0.0 for axis in axes}
+
+
+def status_is_moving(device, axes):
+    """ is_moving callable for MotionWatcher.watch from the get_status of a stage.
+
+    A status of 1 or -1 counts as moving, like in MagnetLogic._check_is_moving. Other codes
+    and a failing get_status count as standing still, the position decides then.
+
+    @param device: hardware with get_status(param_list)
+    @param list axes: labels of the moving axes
+
+    @return callable: returns True while one of the axes reports a movement
+    """
+    def is_moving():
+        try:
+            status = device.get_status(list(axes))
+            return any(status.get(axis) in (1, -1) for axis in axes)
+        except Exception:
+            return False
+    return is_moving
+
+
+_watchers = weakref.WeakKeyDictionary()
+_watchers_lock = threading.Lock()
+
+
+class AsyncMoveMixin:
+    """ Default move_abs_async of the stage interfaces, based on move_abs, get_pos and
+    get_status.
+    """
+
+    def move_abs_async(self, param_dict, timeout=None):
+        """ Moves stage to absolute position and reports when the target is reached.
+
+        @param dict param_dict: dictionary like for move_abs, {'axis_label': <the-abs-pos-value>}
+        @param float timeout: optional, time in s after which the future fails with a
+                              TimeoutError
+
+        @return concurrent.futures.Future: resolves with a dict of the positions of the moved
+                                           axes once the stage stopped at the target
+
+        This default implementation polls the position in a background thread, see
+        MotionWatcher. Hardware with a completion callback or event should override it and
+        resolve the future from there.
+        """
+        watcher = get_motion_watcher(self)
+        # a new movement finishes the watch of the previous one
+        watcher.abort()
+        self.move_abs(param_dict)
+        return watcher.watch(param_dict, is_moving=status_is_moving(self, list(param_dict)),
+                             timeout=timeout)
+
+
+def get_motion_watcher(device):
+    """ The MotionWatcher of a device, created on first use.
+
+    @param device: hardware with get_pos(param_list)
+
+    @return MotionWatcher: the watcher of this device
+    """
+    with _watchers_lock:
+        if device not in _watchers:
+            _watchers[device] = MotionWatcher(device)
+        return _watchers[device]
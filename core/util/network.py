@@ -19,13 +19,159 @@ Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
 top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
 """
 
+import logging
+import os
+import socket
+import ssl
+import threading
+import weakref
+import zlib
+import numpy as np
 import rpyc.core.netref
 import rpyc.utils.classic
 
-def netobtain(obj):
-    """
+logger = logging.getLogger(__name__)
+
+# arrays smaller than this are sent within the rpyc reply
+BULK_TRANSFER_MIN_BYTES = 2**16
+# seconds the sending side waits for the receiver to pick up a bulk transfer
+BULK_TRANSFER_TIMEOUT = 10
+
+
+def netobtain(obj, compression=None):
+    """ Get a local copy of obj if it is a rpyc remote object.
+
+    Numpy arrays are sent as raw data through a separate socket instead of being pickled
+    through the rpyc connection. This needs a server providing open_array_transfer (see
+    core.remote). Everything else, and arrays if the bulk transfer fails, is copied with
+    rpyc.utils.classic.obtain.
+
+    @param obj: object to obtain
+    @param str compression: optional, 'zlib' to compress arrays sent through a socket
+
+    @return: obj itself if it is local, a copy otherwise
     """
     if isinstance(obj, rpyc.core.netref.BaseNetref):
+        try:
+            # the netref class carries the name of the remote class in every rpyc version,
+            # the server checks the type again
+            if type(obj).__name__ == 'ndarray':
+                return _obtain_array(obj, compression)
+        except Exception:
+            logger.debug('Bulk transfer of a remote array failed, falling back to rpyc.',
+                         exc_info=True)
         return rpyc.utils.classic.obtain(obj)
     else:
         return obj
+
+
+def open_array_transfer(array, compression=None, bind_host=''):
+    """ Prepare sending an array to the remote side of a rpyc connection. Called on the side
+    owning the array.
+
+    @param numpy.ndarray array: the array to send
+    @param str compression: None or 'zlib'
+    @param str bind_host: address to serve the socket transfer on, all interfaces by default
+
+    @return tuple: (kind, header, data). kind is 'inline' (data is the raw bytes) or 'socket'
+                   (data is (port, token) of the socket serving the data once). header is
+                   (dtype string, shape) plus (compression, number of bytes) for 'socket'.
+    """
+    array = np.ascontiguousarray(array)
+    header = (array.dtype.str, tuple(array.shape))
+    if array.nbytes < BULK_TRANSFER_MIN_BYTES or array.dtype.hasobject:
+        return 'inline', header, array.tobytes()
+
+    payload = array.reshape(-1).view(np.uint8)
+    if compression == 'zlib':
+        payload = zlib.compress(payload, 1)
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind((bind_host, 0))
+    listener.listen(1)
+    listener.settimeout(BULK_TRANSFER_TIMEOUT)
+    token = os.urandom(16)
+    thread = threading.Thread(target=_serve_payload, args=(listener, token, payload),
+                              name='qudi-array-transfer', daemon=True)
+    thread.start()
+    return 'socket', header + (compression, len(payload)), (listener.getsockname()[1], token)
+
+
+def _serve_payload(listener, token, payload):
+    """ Send the payload to the first client presenting the token.
+
+    @param socket.socket listener: listening socket, closed afterwards
+    @param bytes token: random bytes the client has to send first
+    @param payload: bytes-like object to send
+    """
+    try:
+        connection, address = listener.accept()
+        with connection:
+            connection.settimeout(BULK_TRANSFER_TIMEOUT)
+            if _receive_exactly(connection, len(token)) == token:
+                connection.sendall(payload)
+    except Exception:
+        logger.debug('Serving a bulk array transfer failed.', exc_info=True)
+    finally:
+        listener.close()
+
+
+def _obtain_array(remote_array, compression):
+    """ Copy a remote numpy array through the bulk transfer of the remote server.
+
+    @param remote_array: rpyc netref of the array
+    @param str compression: None or 'zlib'
+
+    @return numpy.ndarray: local copy
+    """
+    connection = object.__getattribute__(remote_array, '____conn__')
+    if isinstance(connection, weakref.ref):
+        connection = connection()
+    sock = connection._channel.stream.sock
+    # an encrypted connection must not be bypassed by a plain socket
+    if isinstance(sock, ssl.SSLSocket):
+        raise RuntimeError('No bulk transfer over encrypted connections.')
+
+    kind, header, data = connection.root.open_array_transfer(remote_array, compression)
+    dtype, shape = np.dtype(header[0]), tuple(header[1])
+    if kind == 'inline':
+        return np.frombuffer(data, dtype=dtype).reshape(shape).copy()
+
+    compression, payload_size = header[2], header[3]
+    port, token = data
+    array = np.empty(shape, dtype=dtype)
+    with socket.create_connection((sock.getpeername()[0], port), timeout=BULK_TRANSFER_TIMEOUT) as channel:
+        channel.sendall(bytes(token))
+        if compression == 'zlib':
+            payload = _receive_exactly(channel, payload_size)
+            array.reshape(-1).view(np.uint8)[:] = np.frombuffer(zlib.decompress(payload),
+                                                                 dtype=np.uint8)
+        else:
+            _receive_into(channel, memoryview(array.reshape(-1).view(np.uint8)))
+    return array
+
+
+def _receive_exactly(channel, size):
+    """ Receive exactly size bytes from a socket.
+
+    @param socket.socket channel: connected socket
+    @param int size: number of bytes
+
+    @return bytearray: the received bytes
+    """
+    buffer = bytearray(size)
+    _receive_into(channel, memoryview(buffer))
+    return buffer
+
+
+def _receive_into(channel, buffer):
+    """ Fill a buffer from a socket.
+
+    @param socket.socket channel: connected socket
+    @param memoryview buffer: writable buffer
+    """
+    received = 0
+    while received < len(buffer):
+        count = channel.recv_into(buffer[received:])
+        if count == 0:
+            raise ConnectionError('Bulk array transfer closed early.')
+        received += count
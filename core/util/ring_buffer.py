@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains a fixed-capacity circular buffer for multi-channel traces and streaming
+filters working on blocks of new samples.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import threading
+import numpy as np
+
+
+class RingBuffer:
+    """ Circular buffer holding the latest samples of a trace with several channels.
+
+    New samples overwrite the oldest ones in place, so appending does not allocate or move the
+    stored data. The buffer starts filled with fill_value, just like a trace initialized with
+    numpy.zeros. The chronologically ordered trace is only assembled on request and kept until
+    the next write, so several readers (e.g. the curves of a GUI) share one copy.
+    """
+
+    def __init__(self, channels, capacity, dtype=float, fill_value=0):
+        """
+        @param int channels: number of channels (rows) of the trace
+        @param int capacity: number of samples per channel kept in the buffer
+        @param dtype: numpy data type of the samples
+        @param fill_value: initial value of all samples
+        """
+        self._data = np.full((int(channels), int(capacity)), fill_value, dtype=dtype)
+        self._lock = threading.Lock()
+        # index of the oldest sample which is also the position of the next write
+        self._head = 0
+        self._ordered = None
+        self.samples_written = 0
+
+    @property
+    def channels(self):
+        return self._data.shape[0]
+
+    @property
+    def capacity(self):
+        return self._data.shape[1]
+
+    @property
+    def dtype(self):
+        return self._data.dtype
+
+    def clear(self, fill_value=0):
+        """ Reset all samples to fill_value.
+
+        @param fill_value: new value of all samples
+        """
+        with self._lock:
+            self._data[...] = fill_value
+            self._head = 0
+            self._ordered = None
+            self.samples_written = 0
+
+    def append(self, samples):
+        """ Append new samples. If more samples than the capacity are given, only the latest ones
+        are kept.
+
+        @param numpy.ndarray samples: 2D array (channels, number of samples) or 1D array with one
+                                      sample per channel
+        """
+        samples = np.asarray(samples)
+        if samples.ndim == 1:
+            samples = samples[:, np.newaxis]
+        with self._lock:
+            self.samples_written += samples.shape[1]
+            self._write(samples, advance=True)
+
+    def set_latest(self, samples):
+        """ Overwrite the latest samples without advancing the buffer.
+
+        @param numpy.ndarray samples: 2D array (channels, number of samples) or 1D array with one
+                                      sample per channel
+        """
+        samples = np.asarray(samples)
+        if samples.ndim == 1:
+            samples = samples[:, np.newaxis]
+        with self._lock:
+            self._write(samples, advance=False)
+
+    def latest(self, number_of_samples):
+        """ Get the latest samples in chronological order, including initial fill values if less
+        samples have been written so far.
+
+        @param int number_of_samples: number of samples per channel (max. capacity)
+
+        @return numpy.ndarray: 2D array (channels, number_of_samples), oldest sample first
+        """
+        with self._lock:
+            return self._latest(int(number_of_samples))
+
+    def get_ordered(self):
+        """ Get the whole trace in chronological order.
+
+        The returned array is read-only and shared by all callers until the next write to the
+        buffer.
+
+        @return numpy.ndarray: 2D array (channels, capacity), oldest sample first
+        """
+        with self._lock:
+            if self._ordered is None:
+                if self._head == 0:
+                    ordered = self._data.copy()
+                else:
+                    ordered = np.concatenate((self._data[:, self._head:],
+                                              self._data[:, :self._head]), axis=1)
+                ordered.flags.writeable = False
+                self._ordered = ordered
+            return self._ordered
+
+    def _write(self, samples, advance):
+        capacity = self.capacity
+        if samples.shape[1] > capacity:
+            samples = samples[:, -capacity:]
+        number_of_samples = samples.shape[1]
+        if number_of_samples == 0:
+            return
+        start = self._head if advance else (self._head - number_of_samples) % capacity
+        first_part = min(number_of_samples, capacity - start)
+        self._data[:, start:start + first_part] = samples[:, :first_part]
+        self._data[:, :number_of_samples - first_part] = samples[:, first_part:]
+        if advance:
+            self._head = (self._head + number_of_samples) % capacity
+        self._ordered = None
+
+    def _latest(self, number_of_samples):
+        number_of_samples = min(max(number_of_samples, 0), self.capacity)
+        start = (self._head - number_of_samples) % self.capacity
+        if start + number_of_samples <= self.capacity:
+            return self._data[:, start:start + number_of_samples].copy()
+        return np.concatenate((self._data[:, start:], self._data[:, :self._head]), axis=1)
+
+
+def running_filter_values(history, samples, window_length, method='median', max_length=None):
+    """ Smoothed values for the latest samples of a trace, computed only for the new samples.
+
+    The smoothed value of a sample is the median (or mean) of the window_length samples up to
+    and including the sample int(window_length / 2) later, i.e. a centered running filter. The
+    latest int(window_length / 2) samples have no complete window yet and get the value of the
+    newest window.
+
+    @param numpy.ndarray history: 2D array (channels, window_length - 1) with the samples of the
+                                  trace preceding the new samples
+    @param numpy.ndarray samples: 2D array (channels, number of samples) of new samples
+    @param int window_length: number of samples in the filter window
+    @param str method: 'median' or 'mean'
+    @param int max_length: optional, max. number of smoothed values to return (e.g. the capacity
+                           of the trace)
+
+    @return numpy.ndarray: 2D array (channels, number of samples + int(window_length / 2)) of
+                           smoothed values for the latest samples of the trace
+    """
+    half_window = int(window_length) // 2
+    window_length = max(min(int(window_length), history.shape[1] + 1), 1)
+    # number of windows to evaluate, one per new sample that is still part of the output
+    number_of_windows = samples.shape[1]
+    if max_length is not None:
+        number_of_windows = min(number_of_windows, max_length)
+    values = np.concatenate((history, samples), axis=1)
+    values = values[:, values.shape[1] - number_of_windows - window_length + 1:].astype(float)
+    if method == 'mean':
+        cumulative = np.cumsum(np.pad(values, ((0, 0), (1, 0)), mode='constant'), axis=1)
+        filtered = (cumulative[:, window_length:] - cumulative[:, :-window_length]) / window_length
+    else:
+        windows = np.lib.stride_tricks.as_strided(
+            values, shape=(values.shape[0], number_of_windows, window_length),
+            strides=(values.strides[0], values.strides[1], values.strides[1]), writeable=False)
+        filtered = np.median(windows, axis=2)
+    padding = np.repeat(filtered[:, -1:], half_window, axis=1)
+    smoothed = np.concatenate((filtered, padding), axis=1)
+    if max_length is not None:
+        smoothed = smoothed[:, -max_length:]
+    return smoothed
@@ -26,6 +26,7 @@ import pyqtgraph as pg
 import time
 
 from core.module import Connector, ConfigOption, StatusVar
+from core.util.image_histogram import ImageHistogram
 from gui.guibase import GUIBase
 from gui.guiutils import ColorBar
 from gui.colordefs import ColorScaleInferno
@@ -201,6 +202,8 @@ class ConfocalGui(GUIBase):
     image_x_padding = ConfigOption('image_x_padding', 0.02)
     image_y_padding = ConfigOption('image_y_padding', 0.02)
     image_z_padding = ConfigOption('image_z_padding', 0.02)
+    # maximal number of redraws per second of the xy and depth image while scanning
+    max_frame_rate = ConfigOption('max_frame_rate', 20)
 
     # status var
     adjust_cursor_roi = StatusVar(default=True)
@@ -267,6 +270,31 @@ class ConfocalGui(GUIBase):
         self.xy_image = pg.ImageItem(image=raw_data_xy, axisOrder='row-major')
         self.depth_image = pg.ImageItem(image=raw_data_depth, axisOrder='row-major')
 
+        # While scanning, only the new lines are copied into the displayed images and into the
+        # histograms for the centile colour scale. The logic image the displayed image was
+        # taken from and the number of lines scanned at that time tell which lines are new.
+        self._xy_source = None
+        self._xy_source_channel = None
+        self._xy_lines_shown = 0
+        self._xy_histogram = ImageHistogram()
+        self._xy_histogram.reset(raw_data_xy)
+        self._depth_source = None
+        self._depth_source_channel = None
+        self._depth_lines_shown = 0
+        self._depth_histogram = ImageHistogram()
+        self._depth_histogram.reset(raw_data_depth)
+
+        # The image updates of the logic are collected and drawn at most max_frame_rate times
+        # per second.
+        self._xy_redraw_timer = QtCore.QTimer()
+        self._xy_redraw_timer.setSingleShot(True)
+        self._xy_redraw_timer.setInterval(int(1000 / self.max_frame_rate))
+        self._xy_redraw_timer.timeout.connect(self._redraw_xy_image)
+        self._depth_redraw_timer = QtCore.QTimer()
+        self._depth_redraw_timer.setSingleShot(True)
+        self._depth_redraw_timer.setInterval(int(1000 / self.max_frame_rate))
+        self._depth_redraw_timer.timeout.connect(self._redraw_depth_image)
+
         # Hide tilt correction window
         self._mw.tilt_correction_dockWidget.hide()
 
@@ -617,10 +645,10 @@ class ConfocalGui(GUIBase):
 
         # Connect the emitted signal of an image change from the logic with
         # a refresh of the GUI picture:
-        self._scanning_logic.signal_xy_image_updated.connect(self.refresh_xy_image)
+        self._scanning_logic.signal_xy_image_updated.connect(self.schedule_xy_image_redraw)
         self._scanning_logic.signal_xy_image_updated.connect(self.refresh_scan_line)
         self._scanning_logic.signal_depth_image_updated.connect(self.refresh_scan_line)
-        self._scanning_logic.signal_depth_image_updated.connect(self.refresh_depth_image)
+        self._scanning_logic.signal_depth_image_updated.connect(self.schedule_depth_image_redraw)
         self._optimizer_logic.sigImageUpdated.connect(self.refresh_refocus_image)
         self._scanning_logic.sigImageXYInitialized.connect(self.adjust_xy_window)
         self._scanning_logic.sigImageDepthInitialized.connect(self.adjust_depth_window)
@@ -776,6 +804,8 @@ class ConfocalGui(GUIBase):
 
         @return int: error code (0:OK, -1:error)
         """
+        self._xy_redraw_timer.stop()
+        self._depth_redraw_timer.stop()
         self._mw.close()
         return 0
 
@@ -833,21 +863,19 @@ class ConfocalGui(GUIBase):
         """ Determines the cb_min and cb_max values for the xy scan image
         """
         # If "Manual" is checked, or the image data is empty (all zeros), then take manual cb range.
-        if self._mw.xy_cb_manual_RadioButton.isChecked() or np.max(self.xy_image.image) == 0.0:
+        if self._mw.xy_cb_manual_RadioButton.isChecked() or self._xy_histogram.count == 0:
             cb_min = self._mw.xy_cb_min_DoubleSpinBox.value()
             cb_max = self._mw.xy_cb_max_DoubleSpinBox.value()
 
         # Otherwise, calculate cb range from percentiles.
         else:
-            # Exclude any zeros (which are typically due to unfinished scan)
-            xy_image_nonzero = self.xy_image.image[np.nonzero(self.xy_image.image)]
-
+            # The histogram excludes any zeros (which are typically due to unfinished scan)
             # Read centile range
             low_centile = self._mw.xy_cb_low_percentile_DoubleSpinBox.value()
             high_centile = self._mw.xy_cb_high_percentile_DoubleSpinBox.value()
 
-            cb_min = np.percentile(xy_image_nonzero, low_centile)
-            cb_max = np.percentile(xy_image_nonzero, high_centile)
+            cb_min = self._xy_histogram.percentile(low_centile)
+            cb_max = self._xy_histogram.percentile(high_centile)
 
         cb_range = [cb_min, cb_max]
 
@@ -857,21 +885,19 @@ class ConfocalGui(GUIBase):
         """ Determines the cb_min and cb_max values for the xy scan image
         """
         # If "Manual" is checked, or the image data is empty (all zeros), then take manual cb range.
-        if self._mw.depth_cb_manual_RadioButton.isChecked() or np.max(self.depth_image.image) == 0.0:
+        if self._mw.depth_cb_manual_RadioButton.isChecked() or self._depth_histogram.count == 0:
             cb_min = self._mw.depth_cb_min_DoubleSpinBox.value()
             cb_max = self._mw.depth_cb_max_DoubleSpinBox.value()
 
         # Otherwise, calculate cb range from percentiles.
         else:
-            # Exclude any zeros (which are typically due to unfinished scan)
-            depth_image_nonzero = self.depth_image.image[np.nonzero(self.depth_image.image)]
-
+            # The histogram excludes any zeros (which are typically due to unfinished scan)
             # Read centile range
             low_centile = self._mw.depth_cb_low_percentile_DoubleSpinBox.value()
             high_centile = self._mw.depth_cb_high_percentile_DoubleSpinBox.value()
 
-            cb_min = np.percentile(depth_image_nonzero, low_centile)
-            cb_max = np.percentile(depth_image_nonzero, high_centile)
+            cb_min = self._depth_histogram.percentile(low_centile)
+            cb_max = self._depth_histogram.percentile(high_centile)
 
         cb_range = [cb_min, cb_max]
         return cb_range
@@ -1558,14 +1584,21 @@ class ConfocalGui(GUIBase):
         self.refresh_depth_image()
 
     def refresh_xy_image(self):
-        """ Update the current XY image from the logic.
+        """ Update the whole current XY image from the logic.
 
-        Everytime the scanner is scanning a line in xy the
-        image is rebuild and updated in the GUI.
+        Lines scanned in xy are drawn by _redraw_xy_image instead.
         """
+        self._xy_redraw_timer.stop()
         self.xy_image.getViewBox().updateAutoRange()
 
-        xy_image_data = self._scanning_logic.xy_image[:, :, 3 + self.xy_channel]
+        self._xy_source = self._scanning_logic.xy_image
+        self._xy_source_channel = self.xy_channel
+        if self._scanning_logic._zscan:
+            self._xy_lines_shown = self._scanning_logic._xy_line_pos
+        else:
+            self._xy_lines_shown = self._scanning_logic._scan_counter
+        xy_image_data = np.array(self._xy_source[:, :, 3 + self.xy_channel])
+        self._xy_histogram.reset(xy_image_data)
 
         cb_range = self.get_xy_cb_range()
 
@@ -1578,15 +1611,22 @@ class ConfocalGui(GUIBase):
             self.enable_scan_actions()
 
     def refresh_depth_image(self):
-        """ Update the current Depth image from the logic.
+        """ Update the whole current Depth image from the logic.
 
-        Everytime the scanner is scanning a line in depth the
-        image is rebuild and updated in the GUI.
+        Lines scanned in depth are drawn by _redraw_depth_image instead.
         """
-
+        self._depth_redraw_timer.stop()
         self.depth_image.getViewBox().enableAutoRange()
 
-        depth_image_data = self._scanning_logic.depth_image[:, :, 3 + self.depth_channel]
+        self._depth_source = self._scanning_logic.depth_image
+        self._depth_source_channel = self.depth_channel
+        if self._scanning_logic._zscan:
+            self._depth_lines_shown = self._scanning_logic._scan_counter
+        else:
+            self._depth_lines_shown = self._scanning_logic._depth_line_pos
+        depth_image_data = np.array(self._depth_source[:, :, 3 + self.depth_channel])
+        self._depth_histogram.reset(depth_image_data)
+
         cb_range = self.get_depth_cb_range()
 
         # Now update image with new color scale, and update colorbar
@@ -1597,6 +1637,97 @@ class ConfocalGui(GUIBase):
         if self._scanning_logic.module_state() != 'locked':
             self.enable_scan_actions()
 
+    def schedule_xy_image_redraw(self):
+        """ Draw the changes of the XY image with the next frame. """
+        if not self._xy_redraw_timer.isActive():
+            self._xy_redraw_timer.start()
+
+    def schedule_depth_image_redraw(self):
+        """ Draw the changes of the Depth image with the next frame. """
+        if not self._depth_redraw_timer.isActive():
+            self._depth_redraw_timer.start()
+
+    def _new_scan_lines(self, lines_shown, number_of_lines):
+        """ Indices of the lines scanned since lines_shown lines were scanned.
+
+        @param int lines_shown: scan counter of the logic at the last redraw
+        @param int number_of_lines: number of lines of the image
+
+        @return tuple(numpy.ndarray, int): line indices and the current scan counter
+        """
+        scan_counter = self._scanning_logic._scan_counter
+        if scan_counter >= lines_shown:
+            lines = np.arange(lines_shown, scan_counter)
+        else:
+            # a permanent scan started again at the top
+            lines = np.concatenate(
+                (np.arange(lines_shown, number_of_lines), np.arange(0, scan_counter)))
+        return lines, scan_counter
+
+    def _redraw_xy_image(self):
+        """ Copy the new lines of the XY image from the logic and redraw it. """
+        source = self._scanning_logic.xy_image
+        # a new or restored image, or another channel: draw everything
+        if (source is not self._xy_source
+                or self.xy_channel != self._xy_source_channel
+                or self.xy_image.image is None
+                or self.xy_image.image.shape != source.shape[:2]):
+            self.refresh_xy_image()
+            return
+
+        # the scan counter only belongs to this image during xy scans
+        if not self._scanning_logic._zscan:
+            lines, self._xy_lines_shown = self._new_scan_lines(
+                self._xy_lines_shown, source.shape[0])
+            if lines.size > 0:
+                xy_image_data = self.xy_image.image
+                new_data = source[lines, :, 3 + self.xy_channel]
+                old_data = xy_image_data[lines]
+                xy_image_data[lines] = new_data
+                # the histogram may be rebuilt from the whole image including the new lines
+                self._xy_histogram.replace(old_data, new_data, xy_image_data)
+
+        cb_range = self.get_xy_cb_range()
+        self.xy_image.setImage(image=self.xy_image.image, autoLevels=False,
+                               levels=(cb_range[0], cb_range[1]))
+        self.refresh_xy_colorbar()
+
+        # Unlock state widget if scan is finished
+        if self._scanning_logic.module_state() != 'locked':
+            self.enable_scan_actions()
+
+    def _redraw_depth_image(self):
+        """ Copy the new lines of the Depth image from the logic and redraw it. """
+        source = self._scanning_logic.depth_image
+        # a new or restored image, or another channel: draw everything
+        if (source is not self._depth_source
+                or self.depth_channel != self._depth_source_channel
+                or self.depth_image.image is None
+                or self.depth_image.image.shape != source.shape[:2]):
+            self.refresh_depth_image()
+            return
+
+        # the scan counter only belongs to this image during depth scans
+        if self._scanning_logic._zscan:
+            lines, self._depth_lines_shown = self._new_scan_lines(
+                self._depth_lines_shown, source.shape[0])
+            if lines.size > 0:
+                depth_image_data = self.depth_image.image
+                new_data = source[lines, :, 3 + self.depth_channel]
+                old_data = depth_image_data[lines]
+                depth_image_data[lines] = new_data
+                # the histogram may be rebuilt from the whole image including the new lines
+                self._depth_histogram.replace(old_data, new_data, depth_image_data)
+
+        cb_range = self.get_depth_cb_range()
+        self.depth_image.setImage(image=self.depth_image.image, autoLevels=False,
+                                  levels=(cb_range[0], cb_range[1]))
+        self.refresh_depth_colorbar()
+
+        # Unlock state widget if scan is finished
+        if self._scanning_logic.module_state() != 'locked':
+            self.enable_scan_actions()
+
     def refresh_refocus_image(self):
         """Refreshes the xy image, the crosshair and the colorbar. """
         ##########
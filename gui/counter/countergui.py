@@ -196,18 +196,18 @@ class CounterGui(GUIBase):
         """
 
         if self._counting_logic.module_state() == 'locked':
-            self._mw.count_value_Label.setText(
-                '{0:,.0f}'.format(self._counting_logic.countdata_smoothed[0, -1]))
+            # the ordered traces are assembled from the circular buffers of the logic on access
+            countdata = self._counting_logic.countdata
+            countdata_smoothed = self._counting_logic.countdata_smoothed
+            self._mw.count_value_Label.setText('{0:,.0f}'.format(countdata_smoothed[0, -1]))
 
             x_vals = (
                 np.arange(0, self._counting_logic.get_count_length())
                 / self._counting_logic.get_count_frequency())
 
             for i, ch in enumerate(self._counting_logic.get_channels()):
-                self.curves[2 * i].setData(y=self._counting_logic.countdata[i], x=x_vals)
-                self.curves[2 * i + 1].setData(y=self._counting_logic.countdata_smoothed[i],
-                                               x=x_vals
-                                               )
+                self.curves[2 * i].setData(y=countdata[i], x=x_vals)
+                self.curves[2 * i + 1].setData(y=countdata_smoothed[i], x=x_vals)
 
         if self._counting_logic.get_saving_state():
             self._mw.record_counts_Action.setText('Save')
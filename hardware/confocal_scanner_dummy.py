@@ -39,6 +39,10 @@ class ConfocalScannerDummy(Base, ConfocalScannerInterface):
 
     # config
     _clock_frequency = ConfigOption('clock_frequency', 100, missing='warn')
+    # wait for the duration of a line like the real scanner, False for load tests
+    _simulate_line_time = ConfigOption('simulate_line_time', True)
+    # emitters further away than this many sigma do not contribute to a pixel
+    _emitter_cutoff_sigma = ConfigOption('emitter_cutoff_sigma', 5)
 
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
@@ -114,6 +118,76 @@ class ConfocalScannerDummy(Base, ConfocalScannerInterface):
         # offset
         self._points_z[:, 3] = 0
 
+        self._init_emitter_field()
+
+    def _init_emitter_field(self):
+        """ Precompute the coefficients of the emitter spots and sort the emitters by their
+        y position, so the emitters close to a scan line are found by a binary search.
+        """
+        order = np.argsort(self._points[:, 2])
+        amplitude, x_zero, y_zero, sigma_x, sigma_y, theta, offset = self._points[order].T
+        amplitude_z, z_zero, sigma_z, offset_z = self._points_z[order].T
+
+        self._emitter_y = y_zero
+        self._emitter_x = x_zero
+        self._emitter_z = z_zero
+        # coefficients of the exponent of the rotated 2D gaussian, see twoD_gaussian_function
+        self._emitter_a = np.cos(theta)**2 / (2 * sigma_x**2) + np.sin(theta)**2 / (2 * sigma_y**2)
+        self._emitter_b = -np.sin(2 * theta) / (4 * sigma_x**2) + np.sin(2 * theta) / (4 * sigma_y**2)
+        self._emitter_c = np.sin(theta)**2 / (2 * sigma_x**2) + np.cos(theta)**2 / (2 * sigma_y**2)
+        self._emitter_amplitude = amplitude
+        self._emitter_offset = offset
+        self._emitter_amplitude_z = amplitude_z
+        self._emitter_exponent_z = 1 / (2 * sigma_z**2)
+        self._emitter_offset_z = offset_z
+
+        # the spot of an emitter is within this distance in x and y and in z
+        self._emitter_radius = self._emitter_cutoff_sigma * np.maximum(np.abs(sigma_x),
+                                                                      np.abs(sigma_y))
+        self._emitter_radius_z = self._emitter_cutoff_sigma * np.abs(sigma_z)
+        self._max_emitter_radius = self._emitter_radius.max()
+
+    def _emitter_counts(self, x_data, y_data, z_data):
+        """ The fluorescence of all emitters at the given positions.
+
+        Only the emitters within emitter_cutoff_sigma of the bounding box of the positions are
+        evaluated, all of them at once for all positions.
+
+        @param numpy.ndarray x_data: x positions
+        @param numpy.ndarray y_data: y positions
+        @param numpy.ndarray z_data: z positions
+
+        @return numpy.ndarray: counts per second at each position
+        """
+        # emitters close to the positions in y (sorted), then in x and z
+        first, last = np.searchsorted(
+            self._emitter_y, (y_data.min() - self._max_emitter_radius,
+                              y_data.max() + self._max_emitter_radius))
+        candidates = np.arange(first, last)
+        radius = self._emitter_radius[candidates]
+        radius_z = self._emitter_radius_z[candidates]
+        close = ((self._emitter_x[candidates] + radius >= x_data.min())
+                 & (self._emitter_x[candidates] - radius <= x_data.max())
+                 & (self._emitter_y[candidates] + radius >= y_data.min())
+                 & (self._emitter_y[candidates] - radius <= y_data.max())
+                 & (self._emitter_z[candidates] + radius_z >= z_data.min())
+                 & (self._emitter_z[candidates] - radius_z <= z_data.max()))
+        emitters = candidates[close]
+        if emitters.size == 0:
+            return np.zeros(x_data.size)
+
+        # (emitters, positions)
+        dx = x_data[np.newaxis, :] - self._emitter_x[emitters, np.newaxis]
+        dy = y_data[np.newaxis, :] - self._emitter_y[emitters, np.newaxis]
+        dz = z_data[np.newaxis, :] - self._emitter_z[emitters, np.newaxis]
+        spot = self._emitter_offset[emitters, np.newaxis] + self._emitter_amplitude[
+            emitters, np.newaxis] * np.exp(-(self._emitter_a[emitters, np.newaxis] * dx**2
+                                             + 2 * self._emitter_b[emitters, np.newaxis] * dx * dy
+                                             + self._emitter_c[emitters, np.newaxis] * dy**2))
+        spot_z = self._emitter_offset_z[emitters, np.newaxis] + self._emitter_amplitude_z[
+            emitters, np.newaxis] * np.exp(-dz**2 * self._emitter_exponent_z[emitters, np.newaxis])
+        return np.sum(spot * spot_z, axis=0)
+
     def on_deactivate(self):
         """ Deactivate properly the confocal scanner dummy.
         """
@@ -311,18 +385,14 @@ class ConfocalScannerDummy(Base, ConfocalScannerInterface):
             self._set_up_line(np.shape(line_path)[1])
 
         count_data = np.random.uniform(0, 2e4, self._line_length)
-        z_data = line_path[2, :]
-
-        #TODO: Change the gaussian function here to the one from fitlogic and delete the local modules to calculate
-        #the gaussian functions
-        x_data = np.array(line_path[0, :])
-        y_data = np.array(line_path[1, :])
-        for i in range(self._num_points):
-            count_data += self.twoD_gaussian_function((x_data, y_data), *(self._points[i])
-                ) * self.gaussian_function(np.array(z_data), *(self._points_z[i]))
-
-        time.sleep(self._line_length * 1. / self._clock_frequency)
-        time.sleep(self._line_length * 1. / self._clock_frequency)
+
+        x_data = np.asarray(line_path[0, :], dtype=float)
+        y_data = np.asarray(line_path[1, :], dtype=float)
+        z_data = np.asarray(line_path[2, :], dtype=float)
+        count_data += self._emitter_counts(x_data, y_data, z_data)
+
+        if self._simulate_line_time:
+            time.sleep(2 * self._line_length / self._clock_frequency)
 
         # update the scanner position instance variable
         self._current_position = list(line_path[:, -1])
@@ -159,6 +159,7 @@ class NICard(Base, SlowCounterInterface, ConfocalScannerInterface, ODMRCounterIn
         """
         # the tasks used on that hardware device:
         self._counter_daq_tasks = []
+        self._counter_buffer_length = 1000
         self._clock_daq_task = None
         self._scanner_clock_daq_task = None
         self._scanner_ao_task = None
@@ -384,6 +385,7 @@ class NICard(Base, SlowCounterInterface, ConfocalScannerInterface, ODMRCounterIn
         constraints.min_count_frequency = 1e-3
         constraints.max_count_frequency = 10e9
         constraints.counting_mode = [CountingMode.CONTINUOUS]
+        constraints.read_available_samples = True
         return constraints
 
     def set_up_clock(self, clock_frequency=None, clock_channel=None, scanner=False, idle=False):
@@ -528,6 +530,7 @@ class NICard(Base, SlowCounterInterface, ConfocalScannerInterface, ODMRCounterIn
         if len(self._counter_daq_tasks) > 0:
             self.log.error('Another counter is already running, close this one first.')
             return -1
+        self._counter_buffer_length = max(1000, int(np.ceil(self._clock_frequency)))
 
         if counter_channels is not None:
             my_counter_channels = counter_channels
@@ -609,8 +612,9 @@ class NICard(Base, SlowCounterInterface, ConfocalScannerInterface, ODMRCounterIn
                     task,
                     # Sample Mode: Acquire or generate samples until you stop the task.
                     daq.DAQmx_Val_ContSamps,
-                    # buffer length which stores  temporarily the number of generated samples
-                    1000)
+                    # buffer length which stores  temporarily the number of generated samples,
+                    # at least one second of samples for reading all available samples
+                    self._counter_buffer_length)
 
                 # Set the Read point Relative To an operation.
                 # Specifies the point in the buffer at which to begin a read operation.
@@ -661,13 +665,16 @@ class NICard(Base, SlowCounterInterface, ConfocalScannerInterface, ODMRCounterIn
         """
         return self._counter_channels
 
-    def get_counter(self, samples=None):
+    def get_counter(self, samples=None, read_available_samples=False):
         """ Returns the current counts per second of the counter.
 
         @param int samples: if defined, number of samples to read in one go.
                             How many samples are read per readout cycle. The
                             readout frequency was defined in the counter setup.
                             That sets also the length of the readout array.
+        @param bool read_available_samples: if True, do not wait for samples but
+                                            return all samples acquired since the
+                                            last read, at most samples.
 
         @return float [samples]: array with entries as photon counts per second
         """
@@ -682,6 +689,15 @@ class NICard(Base, SlowCounterInterface, ConfocalScannerInterface, ODMRCounterIn
         else:
             samples = int(samples)
         try:
+            if read_available_samples:
+                # all channels share the clock, so the first one tells how many samples are there
+                available_samples = daq.uInt32()
+                daq.DAQmxGetReadAvailSampPerChan(self._counter_daq_tasks[0],
+                                                 daq.byref(available_samples))
+                samples = min(samples, available_samples.value, self._counter_buffer_length)
+                if samples == 0:
+                    return np.empty((len(self._counter_daq_tasks), 0), dtype=np.float64)
+
             # count data will be written here in the NumPy array of length samples
             count_data = np.empty((len(self._counter_daq_tasks), samples), dtype=np.uint32)
 
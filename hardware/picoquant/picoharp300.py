@@ -32,6 +32,8 @@ from interface.slow_counter_interface import SlowCounterInterface
 from interface.slow_counter_interface import SlowCounterConstraints
 from interface.slow_counter_interface import CountingMode
 from interface.fast_counter_interface import FastCounterInterface
+from hardware.picoquant.tttr_decoder import TTTRHistogrammer, T2_RESOLUTION
+from hardware.picoquant.tttr_acquisition import TTTRAcquisition
 
 # =============================================================================
 # Wrapper around the PHLib.DLL. The current file is based on the header files
@@ -98,9 +100,9 @@ class PicoHarp300(Base, SlowCounterInterface, FastCounterInterface):
 
     _deviceID = ConfigOption('deviceID', 0, missing='warn')
     _mode = ConfigOption('mode', 0, missing='warn')
+    # number of FIFO read buffers queued for decoding in TTTR mode
+    _fifo_buffers = ConfigOption('fifo_buffers', 16)
 
-    sigReadoutPicoharp = QtCore.Signal()
-    sigAnalyzeData = QtCore.Signal(object, object)
     sigStart = QtCore.Signal()
 
     def __init__(self, config, **kwargs):
@@ -120,8 +122,10 @@ class PicoHarp300(Base, SlowCounterInterface, FastCounterInterface):
         self._dll = ctypes.cdll.LoadLibrary('phlib64')
 
         # Just some default values:
-        self._bin_width_ns = 3000
-        self._record_length_ns = 100 *1e9
+        self._bin_width_s = 2e-9
+        self._record_length_s = 3e-6
+        self._number_of_gates = 0
+        self._acquisition = None
 
         self._photon_source2 = None #for compatibility reasons with second APD
         self._count_channel = 0
@@ -141,22 +145,16 @@ class PicoHarp300(Base, SlowCounterInterface, FastCounterInterface):
         # One need still to include this in the config.
         self.set_input_CFD(1,10,7)
 
-        # the signal has one argument of type object, which should allow
-        # anything to pass through:
-
         self.sigStart.connect(self.start_measure)
-        self.sigReadoutPicoharp.connect(self.get_fresh_data_loop, QtCore.Qt.QueuedConnection) # ,QtCore.Qt.QueuedConnection
-        self.sigAnalyzeData.connect(self.analyze_received_data, QtCore.Qt.QueuedConnection)
-        self.result = []
 
 
     def on_deactivate(self):
         """ Deactivates and disconnects the device.
         """
-
+        if self._acquisition is not None:
+            self._acquisition.stop()
         self.close_connection()
-        self.sigReadoutPicoharp.disconnect()
-        self.sigAnalyzeData.disconnect()
+        self.sigStart.disconnect()
 
     def _create_errorcode(self):
         """ Create a dictionary with the errorcode for the device.
@@ -684,11 +682,12 @@ class PicoHarp300(Base, SlowCounterInterface, FastCounterInterface):
     # To check whether you can use the TTTR mode (must be purchased in
     # addition) you can call PH_GetFeatures to check.
 
-    def tttr_read_fifo(self):#, num_counts):
+    def tttr_read_fifo(self, buffer=None):
         """ Read out the buffer of the FIFO.
 
-        @param int num_counts: number of TTTR records to be fetched. Maximal
-                               TTREADMAX
+        @param numpy.ndarray buffer: optional, preallocated uint32 array of
+                                     length TTREADMAX to read the records into.
+                                     A new array is created if not given.
 
         @return tuple (buffer, actual_num_counts):
                     buffer = data array where the TTTR data are stored.
@@ -729,7 +728,8 @@ class PicoHarp300(Base, SlowCounterInterface, FastCounterInterface):
 
         num_counts = self.TTREADMAX
 
-        buffer = np.zeros((num_counts,), dtype=np.uint32)
+        if buffer is None:
+            buffer = np.zeros((num_counts,), dtype=np.uint32)
 
         actual_num_counts = ctypes.c_int32()
 
@@ -1051,29 +1051,41 @@ class PicoHarp300(Base, SlowCounterInterface, FastCounterInterface):
 
     #FIXME: The interface connection to the fast counter must be established!
 
-    def configure(self, bin_width_ns, record_length_ns, number_of_gates = 0):
-        """
-        Configuration of the fast counter.
-        bin_width_ns: Length of a single time bin in the time trace histogram
-                      in nanoseconds.
-        record_length_ns: Total length of the timetrace/each single gate in
-                          nanoseconds.
-        number_of_gates: Number of gates in the pulse sequence. Ignore for
-                         ungated counter.
+    def configure(self, bin_width_s, record_length_s, number_of_gates=0):
+        """ Configuration of the fast counter.
+
+        @param float bin_width_s: Length of a single time bin in the time trace histogram in
+                                  seconds.
+        @param float record_length_s: Total length of the timetrace/each single gate in seconds.
+        @param int number_of_gates: optional, number of gates in the pulse sequence. Ignore for
+                                    not gated counter. Gates are only possible in T3 mode.
+
+        @return tuple(binwidth_s, record_length_s, number_of_gates): the actually set values
+
+        The TTTR records read from the FIFO are histogrammed relative to the sync pulse (T3) or
+        to the last event on the sync channel (T2). If the module is not configured for T3 mode,
+        T2 mode is used.
         """
-#        self.initialize(mode=3)
-        self._bin_width_ns = bin_width_ns
-        self._record_length_ns = record_length_ns
-        self._number_of_gates = number_of_gates
+        if self._mode == self.MODE_T3:
+            self.initialize(self.MODE_T3)
+            resolution_s = self.get_resolution() * 1e-12
+        else:
+            self.initialize(self.MODE_T2)
+            resolution_s = T2_RESOLUTION
+            number_of_gates = 0
 
-        #FIXME: actualle only an unsigned array will be needed. Change that later.
-#        self.data_trace = np.zeros(number_of_gates, dtype=np.int64 )
-        self.data_trace = [0]*number_of_gates
-        self.count = 0
+        number_of_bins = max(int(round(record_length_s / bin_width_s)), 1)
+        self._bin_width_s = bin_width_s
+        self._record_length_s = number_of_bins * bin_width_s
+        self._number_of_gates = number_of_gates
 
-        self.result = []
-        self.initialize(2)
-        return
+        if self._acquisition is not None:
+            self._acquisition.stop()
+        histogrammer = TTTRHistogrammer(self._mode, resolution_s, bin_width_s, number_of_bins,
+                                        number_of_gates)
+        self._acquisition = TTTRAcquisition(self._read_fifo_records, histogrammer,
+                                            self.TTREADMAX, self._fifo_buffers)
+        return self._bin_width_s, self._record_length_s, self._number_of_gates
 
     def get_status(self):
         """
@@ -1099,16 +1111,18 @@ class PicoHarp300(Base, SlowCounterInterface, FastCounterInterface):
         """
         Pauses the current measurement if the fast counter is in running state.
         """
-
-        self.stop_measure()
-        self.meas_run = False
+        if self._acquisition is not None:
+            self._acquisition.stop()
+        self.stop_device()
 
     def continue_measure(self):
         """
         Continues the current measurement if the fast counter is in pause state.
         """
         self.meas_run = True
-        self.start(self._record_length_ns/1e6)
+        self.start(self.ACQTMAX)
+        if self._acquisition is not None:
+            self._acquisition.start()
 
     def is_gated(self):
         """
@@ -1121,8 +1135,7 @@ class PicoHarp300(Base, SlowCounterInterface, FastCounterInterface):
         """
         returns the width of a single timebin in the timetrace in seconds
         """
-        #FIXME: Must be implemented
-        return 2e-9
+        return self._bin_width_s
 
     def get_data_trace(self):
         """
@@ -1134,168 +1147,79 @@ class PicoHarp300(Base, SlowCounterInterface, FastCounterInterface):
             returnarray[timebin_index].
           - If the counter is gated it will return a 2D-numpy-array with
             returnarray[gate_index, timebin_index]
-        """
 
+        The histogram is filled by the background FIFO readout, this call only
+        collects the counts decoded so far and never waits for the readout.
+        """
+        if self._acquisition is None:
+            return np.zeros(max(int(round(self._record_length_s / self._bin_width_s)), 1),
+                            dtype=np.int64)
+        return self._acquisition.get_histogram()
 
-        return self.data_trace
+    def get_acquisition_statistics(self):
+        """ Get the counters of the background FIFO readout.
 
+        @return dict: see TTTRAcquisition.get_statistics, empty if not configured
 
+        A non-zero 'records_lost' means the decoding could not keep up and the
+        histogram is missing counts. Many 'full_reads' mean the FIFO is read at
+        its limit.
+        """
+        if self._acquisition is None:
+            return dict()
+        return self._acquisition.get_statistics()
 
     # =========================================================================
-    #  Test routine for continuous readout
+    #  Background FIFO readout
     # =========================================================================
 
-
     def start_measure(self):
         """
         Starts the fast counter.
-        """
-        self.lock()
 
+        The FIFO is read by a dedicated reader thread into a ring of buffers,
+        which are decoded into the histogram by a separate worker thread (see
+        hardware/picoquant/tttr_acquisition.py).
+        """
+        if self._acquisition is None:
+            self.log.error('PicoHarp: Configure the fast counter before starting it.')
+            return -1
+        if self._acquisition.is_running:
+            return 0
+        self.module_state.lock()
+        self._acquisition.reset()
         self.meas_run = True
 
-        # start the device:
-        self.start(int(self._record_length_ns/1e6))
-
-        self.sigReadoutPicoharp.emit()
+        # start the device and let it run until the measurement is stopped:
+        self.start(self.ACQTMAX)
+        self._acquisition.start()
+        return 0
 
     def stop_measure(self):
-        """ By setting the Flag, the measurement should stop.  """
-        self.meas_run = False
-
-
-    def get_fresh_data_loop(self):
-        """ This method will be run infinitely until the measurement stops. """
-
-        # for testing one can also take another array:
-        buffer, actual_counts = self.tttr_read_fifo()
-#        buffer, actual_counts = [1,2,3,4,5,6,7,8,9], 9
-
-        # This analysis signel should be analyzed in a queued thread:
-        self.sigAnalyzeData.emit(buffer[0:actual_counts-1], actual_counts)
-
-        if not self.meas_run:
-            with self.threadlock:
-                self.unlock()
-                self.stop_device
-                return
-
-        print('get new data.')
-        # get the next data:
-        self.sigReadoutPicoharp.emit()
-
-
-
-    def analyze_received_data(self, arr_data, actual_counts):
-        """ Analyze the actual data obtained from the TTTR mode of the device.
-
-        @param arr_data: numpy uint32 array with length 'actual_counts'.
-        @param actual_counts: int, number of read out events from the buffer.
-
-        Write the obtained arr_data to the predefined array data_trace,
-        initialized in the configure method.
-
-        The received array contains 32bit words. The bit assignment starts from
-        the MSB (most significant bit), which is here displayed as the most
-        left bit.
-
-        For T2 (initialized device with mode=2):
-        ----------------------------------------
-
-        [ 4 bit for channel-number |28 bit for time-tag] = [32 bit word]
-
-        channel-number: 4 marker, which serve for the different channels.
-                            0001 = marker 1
-                            0010 = marker 2
-                            0011 = marker 3
-                            0100 = marker 4
-
-                        The channel code 15 (all bits ones, 1111) marks a
-                        special record. Special records can be overflows or
-                        external markers. To differentiate this, the lower 4
-                        bits of timetag must be checked:
-                            - If they are all zero, the record marks an
-                              overflow.
-                            - If they are >=1 the individual bits are external
-                              markers.
-
-                        Overflow period: 210698240
-
-                        the first bit is the overflow bit. It will be set if
-                        the time-tag reached 2^28:
-
-                            0000 = overflow
-
-                        Afterwards both overflow marker and time-tag
-                        will be reseted. This overflow should be detected and
-                        the time axis should be adjusted accordingly.
-
-        time-tag: The resolution is fixed to 4ps. Within the time of
-                  4ps*2^28 = 1.073741824 ms
-                  another photon event should occur so that the time axis can
-                  be computed properly.
-
-        For T3 (initialized device with mode=3):
-        ----------------------------------------
-
-        [ 4 bit for channel-number | 12 bit for start-stop-time | 16 bit for sync counter] = [32 bit word]
-
-        channel-number: 4 marker, which serve for the different channels.
-                            0001 = marker 1
-                            0010 = marker 2
-                            0011 = marker 3
-                            0100 = marker 4
-
-                        the first bit is the overflow bit. It will be set if
-                        the sync-counter reached 65536 events:
-
-                            1000 = overflow
-
-                        Afterwards both, overflow marker and sync-counter
-                        will be reseted. This overflow should be detected and
-                        the time axis should be adjusted accordingly.
-
-        start-stop-time: time between to consecutive sync pulses. Maximal time
-                         between two sync pulses is therefore limited to
-                             2^12 * Res
-                         where Res is the Resolution
-                             Res = {4,8,16,32,54,128,256,512} (in ps)
-                         For largest Resolution of 512ps you have 2097.152 ns.
-        sync-counter: can hold up to 2^16 = 65536 events. It that number is
-                      reached overflow will be set. That means all 4 bits in
-                      the channel-number are set to high (i.e. 1).
+        """ Stop the device and the FIFO readout. All records read so far are
+        still decoded into the histogram.
         """
+        if self._acquisition is not None:
+            self._acquisition.stop()
+            if self._acquisition.error is not None:
+                self.log.error('PicoHarp: FIFO readout stopped with an error: {0}'
+                               ''.format(self._acquisition.error))
+            statistics = self._acquisition.get_statistics()
+            if statistics['records_lost'] > 0:
+                self.log.warning('PicoHarp: {0:d} of {1:d} TTTR records were lost since the '
+                                 'decoding could not keep up with the FIFO readout.'
+                                 ''.format(statistics['records_lost'],
+                                           statistics['records_read']))
+        self.stop_device()
+        if self.module_state() == 'locked':
+            self.module_state.unlock()
+        return 0
 
-        # at first just a simple test
-        time.sleep(0.2)
-
-        self.data_trace[self.count] = actual_counts
-        self.count += 1
-
-        if self.count > self._number_of_gates-1:
-            self.count = 0
-
-        if actual_counts == self.TTREADMAX:
-            self.log.warning('Overflow!')
-
-        print('Data analyzed.')
-
-#        self.result = []
-#        for entry in arr_data[0:actual_counts-1]:
-#
-#            # apply three bitmasks to extract the relavent numbers:
-#            overflow = entry & (2**(32-1) )
-#            marker_ch = entry & (2**(32-2)  + 2**(32-3) + 2**(32-4))
-#            time_tag = entry & (2**32 -1 - 2**(32-1) + 2**(32-2) + 2**(32-3) + 2**(32-4))
-
-
-
-
-
-
-
-
-
-
+    def _read_fifo_records(self, buffer):
+        """ Read function for the background FIFO readout.
 
+        @param numpy.ndarray buffer: uint32 array of length TTREADMAX
 
+        @return int: number of records written to the buffer
+        """
+        return self.tttr_read_fifo(buffer)[1]
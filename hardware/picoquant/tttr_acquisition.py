@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the background FIFO readout of the PicoHarp300 in TTTR mode.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import logging
+import queue
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# seconds the reader waits after a FIFO read returned no records
+EMPTY_READ_WAIT = 0.001
+
+
+class TTTRAcquisition:
+    """ Reads the FIFO in a dedicated thread and decodes the records in a second one.
+
+    The reader thread drains the FIFO into a ring of preallocated buffers and hands the filled
+    buffers over to the decode thread, which feeds them into a TTTRHistogrammer. If the decoder
+    falls behind and no free buffer is left, the reader keeps draining the FIFO into a scratch
+    buffer and counts the records as lost, so the device FIFO itself never overruns.
+
+    Neither thread depends on the Qt event loop. The accumulated histogram is collected with
+    get_histogram, which only swaps the double-buffered histogram of the histogrammer.
+    """
+
+    def __init__(self, read_function, histogrammer, buffer_size, number_of_buffers=16):
+        """
+        @param callable read_function: read_function(buffer) fills the uint32 buffer with FIFO
+                                       records and returns the number of records read
+        @param TTTRHistogrammer histogrammer: histogrammer the records are decoded into
+        @param int buffer_size: number of records per buffer (max. records per FIFO read)
+        @param int number_of_buffers: number of buffers in the ring
+        """
+        self._read_function = read_function
+        self._histogrammer = histogrammer
+        self._buffers = np.zeros((number_of_buffers, buffer_size), dtype=np.uint32)
+        self._scratch_buffer = np.zeros(buffer_size, dtype=np.uint32)
+        self._free_buffers = queue.Queue()
+        self._filled_buffers = queue.Queue()
+
+        self._stop_request = threading.Event()
+        self._reader_thread = None
+        self._decoder_thread = None
+        self._error = None
+
+        self._total_histogram = histogrammer.create_histogram()
+        self._spare_histogram = histogrammer.create_histogram()
+        self._total_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Clear the histogram and all counters. Must not be called while running. """
+        self._free_buffers = queue.Queue()
+        for index in range(self._buffers.shape[0]):
+            self._free_buffers.put(index)
+        self._filled_buffers = queue.Queue()
+        self._histogrammer.reset()
+        with self._total_lock:
+            self._total_histogram[...] = 0
+        self.records_read = 0
+        self.records_lost = 0
+        self.full_reads = 0
+        self.max_buffers_in_use = 0
+
+    @property
+    def is_running(self):
+        return self._reader_thread is not None and self._reader_thread.is_alive()
+
+    @property
+    def error(self):
+        """ The exception that stopped one of the threads, None if everything went fine. """
+        return self._error
+
+    def start(self):
+        """ Start the reader and the decode thread. The histogram is accumulated further. """
+        if self.is_running:
+            return
+        if self._decoder_thread is not None and self._decoder_thread.is_alive():
+            logger.warning('The decoder thread of the last acquisition is still running, the '
+                           'acquisition is not started.')
+            return
+        self._stop_request.clear()
+        self._error = None
+        self._decoder_thread = threading.Thread(target=self._decode_loop,
+                                                name='PicoHarpTTTRDecoder', daemon=True)
+        self._reader_thread = threading.Thread(target=self._read_loop,
+                                               name='PicoHarpTTTRReader', daemon=True)
+        self._decoder_thread.start()
+        self._reader_thread.start()
+
+    def stop(self, timeout=2.0):
+        """ Stop reading the FIFO and wait until all buffers read so far are decoded.
+
+        @param float timeout: max. time in seconds to wait for each thread
+        """
+        self._stop_request.set()
+        if self._reader_thread is not None:
+            self._reader_thread.join(timeout)
+            if self._reader_thread.is_alive():
+                # keep the handle, so start() does not run a second reader on the device
+                logger.warning('The TTTR reader thread did not stop within {0} s.'
+                               ''.format(timeout))
+            else:
+                self._reader_thread = None
+        if self._decoder_thread is not None:
+            self._decoder_thread.join(timeout)
+            if self._decoder_thread.is_alive():
+                logger.warning('The TTTR decoder thread did not stop within {0} s.'
+                               ''.format(timeout))
+            else:
+                self._decoder_thread = None
+
+    def get_histogram(self):
+        """ Get the histogram accumulated since the last reset.
+
+        @return numpy.ndarray: int64 histogram, 1D (bins) or 2D (gates, bins)
+        """
+        with self._total_lock:
+            new_counts = self._histogrammer.swap_histogram(self._spare_histogram)
+            self._total_histogram += new_counts
+            new_counts[...] = 0
+            self._spare_histogram = new_counts
+            return self._total_histogram.copy()
+
+    def get_statistics(self):
+        """ Get the counters of the readout and the decoding.
+
+        @return dict: number of records read, lost (no free buffer), decoded, photons histogrammed
+                      and out of the histogram range, time tag overflows, markers, FIFO reads that
+                      returned a full buffer, and the current and max. number of buffers waiting
+                      for the decoder.
+        """
+        statistics = dict()
+        statistics['records_read'] = self.records_read
+        statistics['records_lost'] = self.records_lost
+        statistics['records_decoded'] = self._histogrammer.record_count
+        statistics['photons'] = self._histogrammer.photon_count
+        statistics['out_of_range'] = self._histogrammer.out_of_range_count
+        statistics['overflows'] = self._histogrammer.overflow_count
+        statistics['markers'] = self._histogrammer.marker_count
+        statistics['full_reads'] = self.full_reads
+        statistics['buffers_in_use'] = self._filled_buffers.qsize()
+        statistics['max_buffers_in_use'] = self.max_buffers_in_use
+        return statistics
+
+    def _read_loop(self):
+        """ Drain the FIFO into the buffer ring until a stop is requested. """
+        buffer_size = self._buffers.shape[1]
+        try:
+            while not self._stop_request.is_set():
+                try:
+                    index = self._free_buffers.get_nowait()
+                    buffer = self._buffers[index]
+                except queue.Empty:
+                    index = None
+                    buffer = self._scratch_buffer
+
+                number_of_records = self._read_function(buffer)
+                self.records_read += number_of_records
+                if number_of_records >= buffer_size:
+                    self.full_reads += 1
+
+                if index is None:
+                    self.records_lost += number_of_records
+                elif number_of_records > 0:
+                    self._filled_buffers.put((index, number_of_records))
+                    self.max_buffers_in_use = max(self.max_buffers_in_use,
+                                                  self._filled_buffers.qsize())
+                else:
+                    self._free_buffers.put(index)
+
+                if number_of_records == 0:
+                    # the FIFO is empty, do not spin on it
+                    self._stop_request.wait(EMPTY_READ_WAIT)
+        except Exception as e:
+            self._error = e
+            self._stop_request.set()
+
+    def _decode_loop(self):
+        """ Decode filled buffers until a stop is requested and all buffers are processed. """
+        try:
+            while True:
+                try:
+                    index, number_of_records = self._filled_buffers.get(timeout=0.05)
+                except queue.Empty:
+                    # the reader puts no more buffers once it has finished
+                    reader_done = (self._reader_thread is None
+                                   or not self._reader_thread.is_alive())
+                    if (self._stop_request.is_set() and reader_done
+                            and self._filled_buffers.empty()):
+                        break
+                    continue
+                self._histogrammer.process(self._buffers[index, :number_of_records])
+                self._free_buffers.put(index)
+        except Exception as e:
+            self._error = e
+            self._stop_request.set()
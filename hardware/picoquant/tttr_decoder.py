@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains a vectorized decoder and histogrammer for the TTTR records of the PicoHarp300.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import threading
+import numpy as np
+
+# PicoHarp T2 format, starting from the MSB:
+#       channel:     4 bit
+#       time tag:   28 bit (4 ps resolution)
+# PicoHarp T3 format, starting from the MSB:
+#       channel:     4 bit
+#       dtime:      12 bit (start-stop time in units of the resolution)
+#       nsync:      16 bit (sync counter)
+# The channel code 15 marks a special record. It is an overflow if the marker bits (lower 4 bits
+# of the time tag in T2, dtime in T3) are zero, otherwise the set bits are external markers.
+SPECIAL_CHANNEL = 15
+T2_WRAPAROUND = 210698240
+T2_RESOLUTION = 4e-12
+T3_WRAPAROUND = 65536
+T3_DTIME_RANGE = 4096
+
+MODE_T2 = 2
+MODE_T3 = 3
+
+
+def decode_t2_records(records, overflow_count=0):
+    """ Decode a buffer of T2 records in one go.
+
+    @param numpy.ndarray records: 1D array of uint32 T2 records
+    @param int overflow_count: number of overflows seen in all previous buffers
+
+    @return dict, int: decoded record fields as arrays of the same length as records (keys:
+                       'channel', 'time', 'markers', 'is_overflow', 'is_marker') and the
+                       overflow count to pass on to the next call. 'time' is the absolute time tag
+                       in units of T2_RESOLUTION.
+    """
+    records = np.asarray(records, dtype=np.uint32)
+    channel = (records >> 28).astype(np.int8)
+    time_tag = (records & 0x0FFFFFFF).astype(np.int64)
+    special = channel == SPECIAL_CHANNEL
+    markers = np.where(special, time_tag & 0xF, 0)
+    is_overflow = special & (markers == 0)
+
+    overflows = np.cumsum(is_overflow) + overflow_count
+    decoded = dict()
+    decoded['channel'] = channel
+    decoded['time'] = time_tag + T2_WRAPAROUND * overflows
+    decoded['markers'] = markers
+    decoded['is_overflow'] = is_overflow
+    decoded['is_marker'] = special & (markers != 0)
+    if overflows.size > 0:
+        overflow_count = int(overflows[-1])
+    return decoded, overflow_count
+
+
+def decode_t3_records(records, overflow_count=0):
+    """ Decode a buffer of T3 records in one go.
+
+    @param numpy.ndarray records: 1D array of uint32 T3 records
+    @param int overflow_count: number of overflows seen in all previous buffers
+
+    @return dict, int: decoded record fields as arrays of the same length as records (keys:
+                       'channel', 'dtime', 'nsync', 'markers', 'is_overflow', 'is_marker') and the
+                       overflow count to pass on to the next call. 'nsync' is the absolute number
+                       of the sync pulse the record belongs to.
+    """
+    records = np.asarray(records, dtype=np.uint32)
+    channel = (records >> 28).astype(np.int8)
+    dtime = ((records >> 16) & 0x0FFF).astype(np.int64)
+    nsync = (records & 0xFFFF).astype(np.int64)
+    special = channel == SPECIAL_CHANNEL
+    is_overflow = special & (dtime == 0)
+
+    overflows = np.cumsum(is_overflow) + overflow_count
+    decoded = dict()
+    decoded['channel'] = channel
+    decoded['dtime'] = dtime
+    decoded['nsync'] = nsync + T3_WRAPAROUND * overflows
+    decoded['markers'] = np.where(special, dtime & 0xF, 0)
+    decoded['is_overflow'] = is_overflow
+    decoded['is_marker'] = special & (dtime != 0)
+    if overflows.size > 0:
+        overflow_count = int(overflows[-1])
+    return decoded, overflow_count
+
+
+class TTTRHistogrammer:
+    """ Accumulates the TTTR records read from the FIFO into a time histogram.
+
+    T3 mode: photons are binned according to their start-stop time (dtime) relative to the sync
+             pulse. In gated mode the sync pulses are counted off as gates, starting at the last
+             external marker (or the start of the measurement).
+    T2 mode: photons are binned according to their delay to the last event on the sync channel.
+             Only the ungated histogram is supported.
+
+    The overflow and reference state is carried across calls of process, so the FIFO buffers can
+    be fed in as they are read. The histogram is double-buffered: swap_histogram hands out the
+    counts accumulated since the last swap without blocking the decoding for longer than the
+    exchange of two array references.
+    """
+
+    def __init__(self, mode, resolution_s, bin_width_s, number_of_bins, number_of_gates=0,
+                 sync_channel=0):
+        """
+        @param int mode: TTTR mode of the device (MODE_T2 or MODE_T3)
+        @param float resolution_s: time resolution of a record in seconds (dtime unit in T3)
+        @param float bin_width_s: width of a histogram bin in seconds
+        @param int number_of_bins: number of bins of the histogram (per gate)
+        @param int number_of_gates: number of gates, 0 for an ungated (1D) histogram
+        @param int sync_channel: channel of the sync events in T2 mode
+        """
+        if mode not in (MODE_T2, MODE_T3):
+            raise ValueError('TTTR mode must be {0} (T2) or {1} (T3), not {2}.'
+                             ''.format(MODE_T2, MODE_T3, mode))
+        if mode == MODE_T2 and number_of_gates > 0:
+            raise ValueError('Gated histograms are only supported in T3 mode.')
+        self.mode = mode
+        self.resolution_s = resolution_s
+        self.bin_width_s = bin_width_s
+        self.number_of_bins = max(int(number_of_bins), 1)
+        self.number_of_gates = max(int(number_of_gates), 0)
+        self.sync_channel = sync_channel
+        self._histogram_lock = threading.Lock()
+
+        # Use integer division if the bin width is a multiple of the record resolution
+        self._bin_factor = bin_width_s / resolution_s
+        self._integer_binning = abs(self._bin_factor - round(self._bin_factor)) < 1e-9
+        if self._integer_binning:
+            self._bin_factor = max(int(round(self._bin_factor)), 1)
+        self.reset()
+
+    def reset(self):
+        """ Clear the histogram, the statistics and the carried decoder state. """
+        with self._histogram_lock:
+            self._histogram = self.create_histogram()
+        self._overflow_count = 0
+        # absolute sync number of the last marker (T3) or time of the last sync event (T2)
+        self._reference = 0 if self.mode == MODE_T3 else -1
+        self.record_count = 0
+        self.photon_count = 0
+        self.marker_count = 0
+        self.out_of_range_count = 0
+
+    @property
+    def overflow_count(self):
+        return self._overflow_count
+
+    def create_histogram(self):
+        """ Create an empty histogram array of the configured shape.
+
+        @return numpy.ndarray: int64 zeros, 1D (bins) or 2D (gates, bins)
+        """
+        if self.number_of_gates > 0:
+            return np.zeros((self.number_of_gates, self.number_of_bins), dtype=np.int64)
+        return np.zeros(self.number_of_bins, dtype=np.int64)
+
+    def get_histogram(self):
+        """ Get a copy of the accumulated histogram.
+
+        @return numpy.ndarray: int64 histogram, 1D (bins) or 2D (gates, bins)
+        """
+        with self._histogram_lock:
+            return self._histogram.copy()
+
+    def swap_histogram(self, empty_histogram):
+        """ Replace the histogram by an empty one and return the filled one.
+
+        @param numpy.ndarray empty_histogram: zeroed array as returned by create_histogram
+
+        @return numpy.ndarray: the histogram accumulated since the last swap or reset
+        """
+        with self._histogram_lock:
+            histogram = self._histogram
+            self._histogram = empty_histogram
+        return histogram
+
+    def process(self, records):
+        """ Decode a buffer of TTTR records and add the photons to the histogram.
+
+        @param numpy.ndarray records: 1D array of uint32 records as read from the FIFO
+
+        @return int: number of photons added to the histogram
+        """
+        records = np.asarray(records, dtype=np.uint32)
+        if records.size == 0:
+            return 0
+        if self.mode == MODE_T3:
+            decoded, self._overflow_count = decode_t3_records(records, self._overflow_count)
+            photons = ~(decoded['is_overflow'] | decoded['is_marker'])
+            delays = decoded['dtime']
+            if self.number_of_gates > 0:
+                references = self._carry_reference(decoded['is_marker'], decoded['nsync'])
+                gates = (decoded['nsync'] - references) % self.number_of_gates
+        else:
+            decoded, self._overflow_count = decode_t2_records(records, self._overflow_count)
+            is_event = decoded['channel'] != SPECIAL_CHANNEL
+            is_sync = is_event & (decoded['channel'] == self.sync_channel)
+            references = self._carry_reference(is_sync, decoded['time'])
+            photons = is_event & ~is_sync & (references >= 0)
+            delays = decoded['time'] - references
+
+        self.record_count += records.size
+        self.marker_count += int(np.count_nonzero(decoded['is_marker']))
+
+        if self._integer_binning:
+            bins = delays[photons] // self._bin_factor
+        else:
+            bins = (delays[photons] / self._bin_factor).astype(np.int64)
+        in_range = bins < self.number_of_bins
+        if self.number_of_gates > 0:
+            bins = gates[photons] * self.number_of_bins + bins
+        bins = bins[in_range]
+
+        self.out_of_range_count += int(in_range.size - bins.size)
+        self.photon_count += bins.size
+        counts = np.bincount(bins, minlength=self.number_of_bins * max(self.number_of_gates, 1))
+        with self._histogram_lock:
+            self._histogram += counts.reshape(self._histogram.shape)
+        return bins.size
+
+    def _carry_reference(self, is_reference, values):
+        """ For each record get the value of the most recent reference record, including the ones
+        of previous buffers.
+
+        @param numpy.ndarray is_reference: bool array marking the reference records
+        @param numpy.ndarray values: monotonic int64 array with the values of all records
+
+        @return numpy.ndarray: value of the last reference record at or before each record
+        """
+        references = np.where(is_reference, values, -1)
+        references[0] = max(references[0], self._reference)
+        references = np.maximum.accumulate(references)
+        self._reference = int(references[-1])
+        return references
+
+
+def generate_t3_records(number_of_syncs, photons_per_sync=0.1, pulse_window=(100, 1100),
+                        background_fraction=0.1, marker_period=0, channel=1, seed=None):
+    """ Generate synthetic T3 records as the PicoHarp would write them into its FIFO.
+
+    Photons arrive at random sync pulses with a start-stop time either uniformly inside
+    pulse_window (laser pulse) or anywhere in the dtime range (background). Overflow records are
+    inserted whenever the sync counter wraps around.
+
+    @param int number_of_syncs: number of sync pulses to simulate
+    @param float photons_per_sync: mean number of detected photons per sync pulse
+    @param tuple pulse_window: (start, stop) of the laser pulse in units of the resolution
+    @param float background_fraction: fraction of photons distributed over the whole dtime range
+    @param int marker_period: insert a marker (bit 0) every marker_period syncs, 0 for no markers
+    @param int channel: detector channel of the photon records
+    @param int seed: seed for the random number generator
+
+    @return numpy.ndarray: 1D array of uint32 T3 records
+    """
+    rng = np.random.RandomState(seed)
+    number_of_photons = rng.poisson(photons_per_sync * number_of_syncs)
+    photon_sync = np.sort(rng.randint(0, number_of_syncs, number_of_photons)).astype(np.int64)
+    dtime = rng.randint(pulse_window[0], pulse_window[1], number_of_photons)
+    background = rng.random_sample(number_of_photons) < background_fraction
+    dtime[background] = rng.randint(0, T3_DTIME_RANGE, np.count_nonzero(background))
+
+    overflow_sync = np.arange(T3_WRAPAROUND, number_of_syncs, T3_WRAPAROUND, dtype=np.int64)
+    if marker_period > 0:
+        marker_sync = np.arange(0, number_of_syncs, marker_period, dtype=np.int64)
+    else:
+        marker_sync = np.zeros(0, dtype=np.int64)
+
+    records = np.concatenate((
+        (channel << 28) | (dtime.astype(np.int64) << 16) | (photon_sync & 0xFFFF),
+        np.full(overflow_sync.size, SPECIAL_CHANNEL << 28, dtype=np.int64),
+        (SPECIAL_CHANNEL << 28) | (1 << 16) | (marker_sync & 0xFFFF)))
+    # sort by sync: overflows come before the records of their sync, markers before the photons
+    keys = np.concatenate((photon_sync.astype(float), overflow_sync - 0.5, marker_sync - 0.25))
+    order = np.argsort(keys, kind='mergesort')
+    return records[order].astype(np.uint32)
+
+
+def generate_t2_records(number_of_syncs, sync_period=250000, photons_per_sync=0.1,
+                        pulse_window=(25000, 225000), sync_channel=0, channel=1, seed=None):
+    """ Generate synthetic T2 records as the PicoHarp would write them into its FIFO.
+
+    Every sync pulse creates an event on sync_channel, photons arrive uniformly inside
+    pulse_window after a random sync pulse. Overflow records are inserted whenever the time tag
+    wraps around.
+
+    @param int number_of_syncs: number of sync pulses to simulate
+    @param int sync_period: time between two sync pulses in units of T2_RESOLUTION
+    @param float photons_per_sync: mean number of detected photons per sync pulse
+    @param tuple pulse_window: (start, stop) of the photon delay in units of T2_RESOLUTION
+    @param int sync_channel: channel of the sync events
+    @param int channel: detector channel of the photon records
+    @param int seed: seed for the random number generator
+
+    @return numpy.ndarray: 1D array of uint32 T2 records
+    """
+    rng = np.random.RandomState(seed)
+    sync_time = np.arange(number_of_syncs, dtype=np.int64) * sync_period
+    number_of_photons = rng.poisson(photons_per_sync * number_of_syncs)
+    photon_time = (sync_time[rng.randint(0, number_of_syncs, number_of_photons)]
+                   + rng.randint(pulse_window[0], pulse_window[1], number_of_photons))
+    last_time = max(photon_time.max() if photon_time.size else sync_time[-1], sync_time[-1])
+    overflow_time = np.arange(T2_WRAPAROUND, last_time + 1, T2_WRAPAROUND, dtype=np.int64)
+
+    records = np.concatenate((
+        (sync_channel << 28) | (sync_time % T2_WRAPAROUND),
+        (channel << 28) | (photon_time % T2_WRAPAROUND),
+        np.full(overflow_time.size, SPECIAL_CHANNEL << 28, dtype=np.int64)))
+    keys = np.concatenate((sync_time.astype(float), photon_time.astype(float),
+                           overflow_time - 0.5))
+    order = np.argsort(keys, kind='mergesort')
+    return records[order].astype(np.uint32)
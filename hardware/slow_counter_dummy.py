@@ -73,6 +73,7 @@ class SlowCounterDummy(Base, SlowCounterInterface):
         self.current_dec_time = self.life_time_bright
         self.curr_state_b = True
         self.total_time = 0.0
+        self._last_read_time = time.time()
 
     def on_deactivate(self):
         """ Deinitialisation performed during deactivation of the module.
@@ -88,6 +89,7 @@ class SlowCounterDummy(Base, SlowCounterInterface):
             CountingMode.CONTINUOUS,
             CountingMode.GATED,
             CountingMode.FINITE_GATED]
+        constraints.read_available_samples = True
 
         return constraints
 
@@ -122,15 +124,31 @@ class SlowCounterDummy(Base, SlowCounterInterface):
 
         self.log.warning('slowcounterdummy>set_up_counter')
         time.sleep(0.1)
+        # start of the simulated acquisition for reading the available samples
+        self._last_read_time = time.time()
         return 0
 
-    def get_counter(self, samples=None):
+    def get_counter(self, samples=None, read_available_samples=False):
         """ Returns the current counts per second of the counter.
 
         @param int samples: if defined, number of samples to read in one go
+        @param bool read_available_samples: if True, do not wait but return the samples
+                                            acquired at the clock frequency since the last
+                                            read, at most samples.
 
         @return float: the photon counts per second
         """
+        if samples is None:
+            samples = int(self._samples_number)
+        if read_available_samples:
+            samples = min(int((time.time() - self._last_read_time) * self._clock_frequency),
+                          int(samples))
+            self._last_read_time += samples / self._clock_frequency
+            return np.array(
+                [self._simulate_counts(samples) + i * self.mean_signal
+                    for i, ch in enumerate(self.get_counter_channels())]
+                ).reshape(len(self.get_counter_channels()), samples)
+
         count_data = np.array(
             [self._simulate_counts(samples) + i * self.mean_signal
                 for i, ch in enumerate(self.get_counter_channels())]
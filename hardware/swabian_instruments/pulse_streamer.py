@@ -31,6 +31,7 @@ from interface.pulser_interface import PulserInterface, PulserConstraints
 from collections import OrderedDict
 
 import grpc
+import numpy as np
 import os
 import hardware.swabian_instruments.pulse_streamer_pb2 as pulse_streamer_pb2
 import dill
@@ -215,13 +216,13 @@ class PulseStreamer(Base, PulserInterface):
                            '"load_asset" call ignored.'.format(asset_name))
             return -1
 
-        # get samples from file
+        # get pulses from file
         filepath = os.path.join(self.host_waveform_directory, asset_name + '.pstream')
-        pulse_sequence_raw = dill.load(open(filepath, 'rb'))
+        pulse_sequence_raw = self._load_pstream_file(filepath)
 
         pulse_sequence = []
-        for pulse in pulse_sequence_raw:
-            pulse_sequence.append(pulse_streamer_pb2.PulseMessage(ticks=pulse[0], digi=pulse[1], ao0=0, ao1=1))
+        for ticks, digi in pulse_sequence_raw:
+            pulse_sequence.append(pulse_streamer_pb2.PulseMessage(ticks=int(ticks), digi=int(digi), ao0=0, ao1=1))
 
         blank_pulse = pulse_streamer_pb2.PulseMessage(ticks=0, digi=0, ao0=0, ao1=0)
         laser_on = pulse_streamer_pb2.PulseMessage(ticks=0, digi=self._convert_to_bitmask([self._laser_channel]), ao0=0, ao1=0)
@@ -233,6 +234,21 @@ class PulseStreamer(Base, PulserInterface):
         self.current_loaded_asset = asset_name
         return 0
 
+    def _load_pstream_file(self, filepath):
+        """ Read the pulses from a pstream-file.
+
+        @param str filepath: full path of the pstream-file
+
+        @return list: (ticks, bitmask) of each pulse
+        """
+        try:
+            pulses = np.load(filepath, allow_pickle=False)
+            return list(zip(pulses['ticks'], pulses['digi']))
+        except ValueError:
+            # files written by former versions are pickled lists of [ticks, bitmask]
+            with open(filepath, 'rb') as pstream_file:
+                return dill.load(pstream_file)
+
     def clear_all(self):
         """ Clears all loaded waveforms from the pulse generators RAM.
 
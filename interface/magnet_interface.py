@@ -22,9 +22,10 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 
 import abc
 from core.util.interfaces import InterfaceMetaclass
+from core.util.motion import AsyncMoveMixin
 
 
-class MagnetInterface(metaclass=InterfaceMetaclass):
+class MagnetInterface(AsyncMoveMixin, metaclass=InterfaceMetaclass):
     """ This is the Interface class to define the controls for the devices
         controlling the magnetic field.
     """
@@ -22,9 +22,10 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 
 import abc
 from core.util.interfaces import InterfaceMetaclass
+from core.util.motion import AsyncMoveMixin
 
 
-class MotorInterface(metaclass=InterfaceMetaclass):
+class MotorInterface(AsyncMoveMixin, metaclass=InterfaceMetaclass):
     """ This is the Interface class to define the controls for the simple
         step motor device. The actual hardware implementation might have a
         different amount of axis. Implement each single axis as 'private'
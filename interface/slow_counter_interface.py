@@ -127,4 +127,7 @@ class SlowCounterConstraints:
         self.max_count_frequency = 5e5
         # add CountingMode enums to this list in instances
         self.counting_mode = []
+        # True if get_counter(samples, read_available_samples=True) is supported. It returns all
+        # samples acquired since the last read (at most samples), without waiting.
+        self.read_available_samples = False
 
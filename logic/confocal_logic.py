@@ -24,6 +24,8 @@ from collections import OrderedDict
 from copy import copy
 import time
 import datetime
+import os
+import uuid
 import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
@@ -103,6 +105,82 @@ class ConfocalHistoryEntry(QtCore.QObject):
         self.tilt_reference_x = 0
         self.tilt_reference_y = 0
 
+        # The images are shared read-only with the neighbouring history entries if they did not
+        # change in between (copy-on-write). They are identified by a key, which names their
+        # side file, and images kept in a side file are only loaded when they are accessed.
+        self._xy_image = None
+        self._depth_image = None
+        self.xy_image_key = None
+        self.depth_image_key = None
+        self._xy_image_file = None
+        self._depth_image_file = None
+        # image versions of the confocal logic at the time of the snapshot
+        self.xy_image_version = None
+        self.depth_image_version = None
+
+    @property
+    def xy_image(self):
+        if self._xy_image is None:
+            self._xy_image = self._load_image(self._xy_image_file)
+        return self._xy_image
+
+    @xy_image.setter
+    def xy_image(self, image):
+        self._xy_image = self._read_only(image)
+        self._xy_image_file = None
+        self.xy_image_key = uuid.uuid4().hex
+
+    @property
+    def depth_image(self):
+        if self._depth_image is None:
+            self._depth_image = self._load_image(self._depth_image_file)
+        return self._depth_image
+
+    @depth_image.setter
+    def depth_image(self, image):
+        self._depth_image = self._read_only(image)
+        self._depth_image_file = None
+        self.depth_image_key = uuid.uuid4().hex
+
+    @staticmethod
+    def _read_only(image):
+        image = np.asarray(image)
+        image.setflags(write=False)
+        return image
+
+    @staticmethod
+    def _load_image(filename):
+        """ Load an image from its side file.
+
+        @param str filename: path of the compressed numpy file, None if there is no image
+
+        @return numpy.ndarray: the read-only image
+        """
+        # restore() relies on an AttributeError for missing images
+        if filename is None:
+            raise AttributeError('History entry has no image.')
+        try:
+            with np.load(filename) as archive:
+                image = archive['image']
+        except (OSError, KeyError, ValueError) as e:
+            raise AttributeError('Image file {0} could not be loaded: {1}'.format(filename, e))
+        image.setflags(write=False)
+        return image
+
+    def _share_or_copy(self, attribute, image, version, previous):
+        """ Take over the image of the previous history entry if it did not change since then,
+        copy it otherwise.
+        """
+        if (previous is not None
+                and version is not None
+                and getattr(previous, attribute + '_version') == version):
+            setattr(self, '_' + attribute, getattr(previous, '_' + attribute))
+            setattr(self, '_' + attribute + '_file', getattr(previous, '_' + attribute + '_file'))
+            setattr(self, attribute + '_key', getattr(previous, attribute + '_key'))
+        else:
+            setattr(self, attribute, np.copy(image))
+        setattr(self, attribute + '_version', version)
+
     def restore(self, confocal):
         """ Write data back into confocal logic and pull all the necessary strings """
         confocal._current_x = self.current_x
@@ -146,8 +224,13 @@ class ConfocalHistoryEntry(QtCore.QObject):
             self.depth_image = np.copy(confocal.depth_image)
         confocal._zscan = False
 
-    def snapshot(self, confocal):
-        """ Extract all necessary data from a confocal logic and keep it for later use """
+    def snapshot(self, confocal, previous=None):
+        """ Extract all necessary data from a confocal logic and keep it for later use
+
+        @param ConfocalLogic confocal: the logic to take the snapshot from
+        @param ConfocalHistoryEntry previous: optional, the last history entry. Its images are
+                                              shared if they did not change in the meantime.
+        """
         self.current_x = confocal._current_x
         self.current_y = confocal._current_y
         self.current_z = confocal._current_z
@@ -172,11 +255,21 @@ class ConfocalHistoryEntry(QtCore.QObject):
         self.point1 = np.copy(confocal.point1)
         self.point2 = np.copy(confocal.point2)
         self.point3 = np.copy(confocal.point3)
-        self.xy_image = np.copy(confocal.xy_image)
-        self.depth_image = np.copy(confocal.depth_image)
+        self._share_or_copy('xy_image', confocal.xy_image, confocal._xy_image_version, previous)
+        self._share_or_copy(
+            'depth_image', confocal.depth_image, confocal._depth_image_version, previous)
+
+    def serialize(self, image_dir=None):
+        """ Give out a dictionary that can be saved via the usual means
+
+        @param str image_dir: optional, directory for the image side files. Images are written
+                              to compressed numpy files named after their key there and only
+                              the file names go into the dictionary. Files which already exist
+                              are not written again. Without a directory the images are
+                              included in the dictionary.
 
-    def serialize(self):
-        """ Give out a dictionary that can be saved via the usual means """
+        @return dict: the serialized history entry
+        """
         serialized = dict()
         serialized['focus_position'] = [self.current_x, self.current_y, self.current_z, self.current_a]
         serialized['x_range'] = list(self.image_x_range)
@@ -197,12 +290,32 @@ class ConfocalHistoryEntry(QtCore.QObject):
         serialized['tilt_point3'] = list(self.point3)
         serialized['tilt_reference'] = [self.tilt_reference_x, self.tilt_reference_y]
         serialized['tilt_slope'] = [self.tilt_slope_x, self.tilt_slope_y]
-        serialized['xy_image'] = self.xy_image
-        serialized['depth_image'] = self.depth_image
+        for attribute in ('xy_image', 'depth_image'):
+            key = getattr(self, attribute + '_key')
+            if key is None:
+                continue
+            if image_dir is None:
+                serialized[attribute] = getattr(self, attribute)
+                continue
+            filename = '{0}.npz'.format(key)
+            path = os.path.join(image_dir, filename)
+            if not os.path.isfile(path):
+                try:
+                    image = getattr(self, attribute)
+                except AttributeError:
+                    # the side file of a restored entry went missing
+                    continue
+                np.savez_compressed(path, image=image)
+            serialized[attribute] = filename
         return serialized
 
-    def deserialize(self, serialized):
-        """ Restore Confocal history object from a dict """
+    def deserialize(self, serialized, image_dir=None):
+        """ Restore Confocal history object from a dict
+
+        @param dict serialized: the serialized history entry
+        @param str image_dir: optional, directory of the image side files. Images given as file
+                              names are loaded from there when they are accessed first.
+        """
         if 'focus_position' in serialized and len(serialized['focus_position']) == 4:
             self.current_x = serialized['focus_position'][0]
             self.current_y = serialized['focus_position'][1]
@@ -236,14 +349,16 @@ class ConfocalHistoryEntry(QtCore.QObject):
             self.point2 = np.array(serialized['tilt_point2'])
         if 'tilt_point3' in serialized and len(serialized['tilt_point3']) == 3:
             self.point3 = np.array(serialized['tilt_point3'])
-        if 'xy_image' in serialized:
-            if isinstance(serialized['xy_image'], np.ndarray):
-                self.xy_image = serialized['xy_image']
-            else:
-                raise OldConfigFileError()
-        if 'depth_image' in serialized:
-            if isinstance(serialized['depth_image'], np.ndarray):
-                self.depth_image = serialized['depth_image'].copy()
+        for attribute in ('xy_image', 'depth_image'):
+            if attribute not in serialized:
+                continue
+            image = serialized[attribute]
+            if isinstance(image, np.ndarray):
+                setattr(self, attribute, image.copy())
+            elif isinstance(image, str) and image_dir is not None:
+                setattr(self, '_' + attribute, None)
+                setattr(self, '_' + attribute + '_file', os.path.join(image_dir, image))
+                setattr(self, attribute + '_key', os.path.splitext(image)[0])
             else:
                 raise OldConfigFileError()
 
@@ -259,6 +374,12 @@ class ConfocalLogic(GenericLogic):
     confocalscanner1 = Connector(interface='ConfocalScannerInterface')
     savelogic = Connector(interface='SaveLogic')
 
+    # config options
+    # number of lines (each followed by its return line) scanned in one hardware task. 1 scans
+    # line and return line separately, a value >= the number of image lines scans whole frames.
+    # With more than one line per task the pixel clock also runs during the return lines.
+    _scan_lines_per_task = ConfigOption('scan_lines_per_task', 1)
+
     # status vars
     _clock_frequency = StatusVar('clock_frequency', 500)
     return_slowness = StatusVar(default=50)
@@ -297,6 +418,11 @@ class ConfocalLogic(GenericLogic):
         self.depth_scan_dir_is_xz = True
         self.depth_img_is_xz = True
         self.permanent_scan = False
+        # scanner paths of all image lines, each followed by its return line
+        self._scan_paths = None
+        # counted up on every change of the images, history entries share unchanged images
+        self._xy_image_version = 0
+        self._depth_image_version = 0
 
     def on_activate(self):
         """ Initialisation performed during activation of the module.
@@ -309,13 +435,18 @@ class ConfocalLogic(GenericLogic):
         self.y_range = self._scanning_device.get_position_range()[1]
         self.z_range = self._scanning_device.get_position_range()[2]
 
+        # the history images are kept in compressed files next to the status file
+        self._history_dir = os.path.join(
+            self._manager.getStatusDir(), 'confocal_history_{0}'.format(self._name))
+        os.makedirs(self._history_dir, exist_ok=True)
+
         # restore here ...
         self.history = []
         for i in reversed(range(1, self.max_history_length)):
             try:
                 new_history_item = ConfocalHistoryEntry(self)
                 new_history_item.deserialize(
-                    self._statusVariables['history_{0}'.format(i)])
+                    self._statusVariables['history_{0}'.format(i)], self._history_dir)
                 self.history.append(new_history_item)
             except KeyError:
                 pass
@@ -327,7 +458,7 @@ class ConfocalLogic(GenericLogic):
                         'Restoring history {0} failed.'.format(i))
         try:
             new_state = ConfocalHistoryEntry(self)
-            new_state.deserialize(self._statusVariables['history_0'])
+            new_state.deserialize(self._statusVariables['history_0'], self._history_dir)
             new_state.restore(self)
         except:
             new_state = ConfocalHistoryEntry(self)
@@ -350,12 +481,24 @@ class ConfocalLogic(GenericLogic):
         @return int: error code (0:OK, -1:error)
         """
         closing_state = ConfocalHistoryEntry(self)
-        closing_state.snapshot(self)
+        closing_state.snapshot(self, self.history[-1] if self.history else None)
         self.history.append(closing_state)
         histindex = 0
         for state in reversed(self.history):
-            self._statusVariables['history_{0}'.format(histindex)] = state.serialize()
+            self._statusVariables['history_{0}'.format(histindex)] = state.serialize(
+                self._history_dir)
             histindex += 1
+        # remove the image files no history entry refers to anymore
+        used_files = set()
+        for state in self.history:
+            used_files.add('{0}.npz'.format(state.xy_image_key))
+            used_files.add('{0}.npz'.format(state.depth_image_key))
+        for filename in os.listdir(self._history_dir):
+            if filename.endswith('.npz') and filename not in used_files:
+                try:
+                    os.remove(os.path.join(self._history_dir, filename))
+                except OSError:
+                    self.log.warning('Could not remove old history image {0}.'.format(filename))
         return 0
 
     def switch_hardware(self, to_on=False):
@@ -530,6 +673,7 @@ class ConfocalLogic(GenericLogic):
                 self._return_YL = np.linspace(self._YL[-1], self._YL[0], self.return_slowness)
                 self._return_AL = np.zeros(self._return_YL.shape)
 
+            self._depth_image_version += 1
             self.sigImageDepthInitialized.emit()
 
         # xy scan is in xy plane
@@ -552,6 +696,7 @@ class ConfocalLogic(GenericLogic):
             self.xy_image[:, :, 2] = self._current_z * np.ones(
                 (len(self._image_vert_axis), len(self._X)))
 
+            self._xy_image_version += 1
             self.sigImageXYInitialized.emit()
         return 0
 
@@ -567,6 +712,7 @@ class ConfocalLogic(GenericLogic):
             self._scanning_device.module_state.unlock()
             self.module_state.unlock()
             return -1
+        self._init_scan_paths()
 
         clock_status = self._scanning_device.set_up_scanner_clock(
             clock_frequency=self._clock_frequency)
@@ -596,6 +742,7 @@ class ConfocalLogic(GenericLogic):
         """
         self.module_state.lock()
         self._scanning_device.module_state.lock()
+        self._init_scan_paths()
 
         clock_status = self._scanning_device.set_up_scanner_clock(
             clock_frequency=self._clock_frequency)
@@ -722,7 +869,7 @@ class ConfocalLogic(GenericLogic):
                     self._xy_line_pos = self._scan_counter
                 # add new history entry
                 new_history = ConfocalHistoryEntry(self)
-                new_history.snapshot(self)
+                new_history.snapshot(self, self.history[-1] if self.history else None)
                 self.history.append(new_history)
                 if len(self.history) > self.max_history_length:
                     self.history.pop(0)
@@ -753,78 +900,52 @@ class ConfocalLogic(GenericLogic):
                     self.signal_scan_lines_next.emit()
                     return
 
-            # adjust z of line in image to current z before building the line
-            if not self._zscan:
-                z_shape = image[self._scan_counter, :, 2].shape
-                image[self._scan_counter, :, 2] = self._current_z * np.ones(z_shape)
-
-            # make a line in the scan, _scan_counter says which one it is
-            lsx = image[self._scan_counter, :, 0]
-            lsy = image[self._scan_counter, :, 1]
-            lsz = image[self._scan_counter, :, 2]
-            if n_ch <= 3:
-                line = np.vstack([lsx, lsy, lsz][0:n_ch])
-            else:
-                line = np.vstack(
-                    [lsx, lsy, lsz, np.ones(lsx.shape) * self._current_a])
-
-            # scan the line in the scan
-            line_counts = self._scanning_device.scan_line(line, pixel_clock=True)
-            if np.any(line_counts == -1):
-                self.stopRequested = True
-                self.signal_scan_lines_next.emit()
-                return
-
-            # make a line to go to the starting position of the next scan line
-            if self.depth_img_is_xz or not self._zscan:
-                if n_ch <= 3:
-                    return_line = np.vstack([
-                        self._return_XL,
-                        image[self._scan_counter, 0, 1] * np.ones(self._return_XL.shape),
-                        image[self._scan_counter, 0, 2] * np.ones(self._return_XL.shape)
-                    ][0:n_ch])
-                else:
-                    return_line = np.vstack([
-                            self._return_XL,
-                            image[self._scan_counter, 0, 1] * np.ones(self._return_XL.shape),
-                            image[self._scan_counter, 0, 2] * np.ones(self._return_XL.shape),
-                            np.ones(self._return_XL.shape) * self._current_a
-                        ])
+            # the lines scanned in this task, _scan_counter says which one is the first
+            first_line = self._scan_counter
+            last_line = min(first_line + max(int(self._scan_lines_per_task), 1),
+                            np.size(self._image_vert_axis))
+            self._update_scan_paths(first_line, last_line)
+            line_length = image.shape[1]
+
+            if last_line - first_line == 1:
+                # scan the line and return the scanner to the start of next line, the counts
+                # of the return line are thrown away
+                line_counts = self._scanning_device.scan_line(
+                    self._scan_paths[first_line, :, :line_length], pixel_clock=True)
+                if np.any(line_counts == -1):
+                    self.stopRequested = True
+                    self.signal_scan_lines_next.emit()
+                    return
+                return_line_counts = self._scanning_device.scan_line(
+                    self._scan_paths[first_line, :, line_length:])
+                if np.any(return_line_counts == -1):
+                    self.stopRequested = True
+                    self.signal_scan_lines_next.emit()
+                    return
+                line_counts = np.reshape(line_counts, (1, line_length, s_ch))
             else:
-                if n_ch <= 3:
-                    return_line = np.vstack([
-                            image[self._scan_counter, 0, 1] * np.ones(self._return_YL.shape),
-                            self._return_YL,
-                            image[self._scan_counter, 0, 2] * np.ones(self._return_YL.shape)
-                        ][0:n_ch])
-                else:
-                    return_line = np.vstack([
-                            image[self._scan_counter, 0, 1] * np.ones(self._return_YL.shape),
-                            self._return_YL,
-                            image[self._scan_counter, 0, 2] * np.ones(self._return_YL.shape),
-                            np.ones(self._return_YL.shape) * self._current_a
-                        ])
-
-            # return the scanner to the start of next line, counts are thrown away
-            return_line_counts = self._scanning_device.scan_line(return_line)
-            if np.any(return_line_counts == -1):
-                self.stopRequested = True
-                self.signal_scan_lines_next.emit()
-                return
+                # scan all lines with their return lines as one continuous path
+                paths = self._scan_paths[first_line:last_line]
+                frame_path = paths.transpose(1, 0, 2).reshape(n_ch, -1)
+                frame_counts = self._scanning_device.scan_line(frame_path, pixel_clock=True)
+                if np.any(frame_counts == -1):
+                    self.stopRequested = True
+                    self.signal_scan_lines_next.emit()
+                    return
+                line_counts = np.reshape(
+                    frame_counts, (last_line - first_line, paths.shape[2], s_ch))[:, :line_length]
 
-            # update image with counts from the line we just scanned
+            # update image with counts from the lines we just scanned
+            image[first_line:last_line, :, 3:3 + s_ch] = line_counts
             if self._zscan:
-                if self.depth_img_is_xz:
-                    self.depth_image[self._scan_counter, :, 3:3 + s_ch] = line_counts
-                else:
-                    self.depth_image[self._scan_counter, :, 3:3 + s_ch] = line_counts
+                self._depth_image_version += 1
                 self.signal_depth_image_updated.emit()
             else:
-                self.xy_image[self._scan_counter, :, 3:3 + s_ch] = line_counts
+                self._xy_image_version += 1
                 self.signal_xy_image_updated.emit()
 
             # next line in scan
-            self._scan_counter += 1
+            self._scan_counter = last_line
 
             # stop scanning when last line scan was performed and makes scan not continuable
             if self._scan_counter >= np.size(self._image_vert_axis):
@@ -843,6 +964,46 @@ class ConfocalLogic(GenericLogic):
             self.stop_scanning()
             self.signal_scan_lines_next.emit()
 
+    def _init_scan_paths(self):
+        """ Build the scanner paths of all lines of the current image at once, so no path has to
+        be assembled while the scanner is waiting.
+
+        Each path is the scan line followed by the return line to the start of the next line.
+        """
+        image = self.depth_image if self._zscan else self.xy_image
+        n_ch = len(self.get_scanner_axes())
+        number_of_lines, line_length = image.shape[0], image.shape[1]
+        return_length = self.return_slowness
+
+        paths = np.empty((number_of_lines, 4, line_length + return_length))
+        # scan lines
+        paths[:, :3, :line_length] = image[:, :, :3].transpose(0, 2, 1)
+        # return lines from the end to the start of the line
+        start = image[:, -1, :3]
+        end = image[:, 0, :3]
+        paths[:, :3, line_length:] = (start[..., None]
+                                      + (end - start)[..., None] * np.linspace(0, 1, return_length))
+        paths[:, 3, :] = self._current_a
+        self._scan_paths = paths[:, :n_ch]
+        return
+
+    def _update_scan_paths(self, first_line, last_line):
+        """ Move the paths of the given lines to the current z (xy scan) and a position.
+
+        @param int first_line: index of the first line
+        @param int last_line: index after the last line
+        """
+        n_ch = self._scan_paths.shape[1]
+        if not self._zscan:
+            # adjust z of the lines in the image to the current z
+            self.xy_image[first_line:last_line, :, 2] = self._current_z
+            self._xy_image_version += 1
+            if n_ch > 2:
+                self._scan_paths[first_line:last_line, 2, :] = self._current_z
+        if n_ch > 3:
+            self._scan_paths[first_line:last_line, 3, :] = self._current_a
+        return
+
     def save_xy_data(self, colorscale_range=None, percentile_range=None):
         """ Save the current confocal xy data to file.
 
@@ -25,10 +25,12 @@ import numpy as np
 import time
 import matplotlib.pyplot as plt
 
-from core.module import Connector, StatusVar
+from core.module import Connector, ConfigOption, StatusVar
 from logic.generic_logic import GenericLogic
 from interface.slow_counter_interface import CountingMode
 from core.util.mutex import Mutex
+from core.util.append_buffer import AppendBuffer
+from core.util.ring_buffer import RingBuffer, running_filter_values
 
 
 class CounterLogic(GenericLogic):
@@ -62,6 +64,20 @@ class CounterLogic(GenericLogic):
     counter1 = Connector(interface='SlowCounterInterface')
     savelogic = Connector(interface='SaveLogic')
 
+    # config options
+    # filter of the smoothed count trace, 'median' or 'mean'
+    _smooth_method = ConfigOption('smooth_method', 'median')
+    # rows of the save buffer allocated at once and the max. memory used before the recorded
+    # data is moved to a temporary memory-mapped file (in spill_dir or the system temp dir)
+    _save_buffer_chunk_rows = ConfigOption('save_buffer_chunk_rows', 2**16)
+    _save_buffer_spill_bytes = ConfigOption('save_buffer_spill_bytes', 256 * 2**20)
+    _save_buffer_spill_dir = ConfigOption('save_buffer_spill_dir', None)
+    # read all samples acquired since the last read at once instead of counting_samples samples
+    # per loop cycle (if the hardware supports it)
+    _batched_readout = ConfigOption('batched_readout', False)
+    # max. number of sigCounterUpdated emissions (GUI updates) per second
+    _gui_frame_rate = ConfigOption('gui_frame_rate', 30)
+
     # status vars
     _count_length = StatusVar('count_length', 300)
     _smooth_window_length = StatusVar('smooth_window_length', 10)
@@ -98,6 +114,17 @@ class CounterLogic(GenericLogic):
         self._counting_mode = CountingMode['CONTINUOUS']
 
         self._saving = False
+
+        # count traces in circular buffers and the counter channels of the hardware
+        self._count_trace = None
+        self._smoothed_trace = None
+        self._channels = None
+        # rows (time, counts of each channel) recorded while saving
+        self._save_buffer = None
+        # batched readout: samples not yet averaged into a trace point and the timing
+        self._use_batched_readout = False
+        self._pending_samples = None
+        self._next_read_time = 0
         return
 
     def on_activate(self):
@@ -115,17 +142,23 @@ class CounterLogic(GenericLogic):
         number_of_detectors = constraints.max_detectors
 
         # initialize data arrays
-        self.countdata = np.zeros([len(self.get_channels()), self._count_length])
-        self.countdata_smoothed = np.zeros([len(self.get_channels()), self._count_length])
+        self._channels = None
+        self._init_count_traces()
         self.rawdata = np.zeros([len(self.get_channels()), self._counting_samples])
         self._already_counted_samples = 0  # For gated counting
-        self._data_to_save = []
+        self._save_buffer = self._create_save_buffer()
 
         # Flag to stop the loop
         self.stopRequested = False
 
         self._saving_start_time = time.time()
 
+        # updates of the GUI are collected and emitted once per frame
+        self._update_timer = QtCore.QTimer()
+        self._update_timer.setSingleShot(True)
+        self._update_timer.setInterval(int(1000 / self._gui_frame_rate))
+        self._update_timer.timeout.connect(self.sigCounterUpdated.emit)
+
         # connect signals
         self.sigCountDataNext.connect(self.count_loop_body, QtCore.Qt.QueuedConnection)
         return
@@ -141,6 +174,60 @@ class CounterLogic(GenericLogic):
             self._stopCount_wait()
 
         self.sigCountDataNext.disconnect()
+        self._update_timer.stop()
+        self._update_timer.timeout.disconnect()
+        self._save_buffer.clear()
+        return
+
+    @property
+    def countdata(self):
+        """ The count trace of all channels in chronological order.
+
+        @return numpy.ndarray: read-only 2D array (channels, count_length)
+        """
+        return self._count_trace.get_ordered()
+
+    @property
+    def countdata_smoothed(self):
+        """ The smoothed count trace of all channels in chronological order.
+
+        @return numpy.ndarray: read-only 2D array (channels, count_length)
+        """
+        return self._smoothed_trace.get_ordered()
+
+    def _init_count_traces(self):
+        """ Create empty circular buffers for the raw and the smoothed count trace.
+        """
+        channels = len(self.get_channels())
+        self._count_trace = RingBuffer(channels, self._count_length)
+        self._smoothed_trace = RingBuffer(channels, self._count_length)
+        return
+
+    def _append_count_samples(self, samples, smooth=True):
+        """ Append new samples to the count trace and update the smoothed trace.
+
+        Only the smoothed values affected by the new samples are computed, see
+        core.util.ring_buffer.running_filter_values.
+
+        @param numpy.ndarray samples: 2D array (channels, number of samples) or 1D array with one
+                                      sample per channel
+        @param bool smooth: update the smoothed trace as well
+        """
+        samples = np.asarray(samples, dtype=float)
+        if samples.ndim == 1:
+            samples = samples[:, np.newaxis]
+        if samples.shape[1] == 0:
+            return
+        if smooth:
+            # the samples preceding the new ones within the filter window
+            window_length = min(self._smooth_window_length, self._count_length)
+            history = self._count_trace.latest(window_length - 1)
+        self._count_trace.append(samples)
+        if smooth:
+            smoothed = running_filter_values(history, samples, self._smooth_window_length,
+                                             self._smooth_method, self._count_length)
+            self._smoothed_trace.append(smoothed[:, -samples.shape[1]:])
+            self._smoothed_trace.set_latest(smoothed)
         return
 
     def get_hardware_constraints(self):
@@ -266,8 +353,14 @@ class CounterLogic(GenericLogic):
         @return bool: saving state
         """
         if not resume:
-            self._data_to_save = []
+            self._save_buffer.clear()
+            self._save_buffer = self._create_save_buffer()
             self._saving_start_time = time.time()
+        elif self._save_buffer.columns != self._get_save_columns():
+            self.log.warning('Counting mode or channels changed. Can not resume saving, the data '
+                             'recorded so far is discarded.')
+            self._save_buffer.clear()
+            self._save_buffer = self._create_save_buffer()
 
         self._saving = True
 
@@ -310,16 +403,61 @@ class CounterLogic(GenericLogic):
             for i, detector in enumerate(self.get_channels()):
                 header = header + ',Signal{0} (counts/s)'.format(i)
 
-            data = {header: self._data_to_save}
+            saved_data = self._save_buffer.get_data()
+            data = {header: saved_data}
             filepath = self._save_logic.get_path_for_module(module_name='Counter')
 
-            fig = self.draw_figure(data=np.array(self._data_to_save))
+            fig = self.draw_figure(data=saved_data)
             self._save_logic.save_data(data, filepath=filepath, parameters=parameters,
                                        filelabel=filelabel, plotfig=fig, delimiter='\t')
             self.log.info('Counter Trace saved to:\n{0}'.format(filepath))
 
         self.sigSavingStatusChanged.emit(self._saving)
-        return self._data_to_save, parameters
+        return self._save_buffer.get_data(), parameters
+
+    def get_saved_data(self):
+        """ Returns all data recorded since saving was started.
+
+        @return numpy.ndarray: read-only 2D array, one row (time, counts of each channel) per
+                               sample. Memory-mapped if the recording has become large.
+        """
+        return self._save_buffer.get_data()
+
+    def get_latest_saved_data(self, number_of_rows):
+        """ Returns the last rows recorded since saving was started. The time needed does not
+        depend on the length of the recording.
+
+        @param int number_of_rows: max. number of rows to return
+
+        @return numpy.ndarray: read-only 2D array, one row (time, counts of each channel) per
+                               sample
+        """
+        return self._save_buffer.latest(number_of_rows)
+
+    def get_saved_data_length(self):
+        """ Returns the number of rows recorded since saving was started.
+
+        @return int: number of rows
+        """
+        return len(self._save_buffer)
+
+    def _get_save_columns(self):
+        """ Number of columns of the saved data in the current counting mode.
+
+        @return int: number of columns (time and counts)
+        """
+        if self._counting_mode == CountingMode['GATED']:
+            return 2
+        return len(self.get_channels()) + 1
+
+    def _create_save_buffer(self):
+        """ Create an empty buffer for the data to save.
+
+        @return AppendBuffer: buffer for rows of time and counts
+        """
+        return AppendBuffer(self._get_save_columns(), chunk_rows=self._save_buffer_chunk_rows,
+                            spill_bytes=self._save_buffer_spill_bytes,
+                            spill_dir=self._save_buffer_spill_dir)
 
     def draw_figure(self, data):
         """ Draw figure to save with data file.
@@ -423,11 +561,19 @@ class CounterLogic(GenericLogic):
                 self.sigCountStatusChanged.emit(False)
                 return -1
 
-            # initialising the data arrays
+            # initialising the data arrays (and ask the hardware for its channels again)
+            self._channels = None
             self.rawdata = np.zeros([len(self.get_channels()), self._counting_samples])
-            self.countdata = np.zeros([len(self.get_channels()), self._count_length])
-            self.countdata_smoothed = np.zeros([len(self.get_channels()), self._count_length])
-            self._sampling_data = np.empty([len(self.get_channels()), self._counting_samples])
+            self._init_count_traces()
+            self._pending_samples = np.empty((len(self.get_channels()), 0))
+
+            self._use_batched_readout = self._batched_readout
+            if self._batched_readout and not constraints.read_available_samples:
+                self.log.warning('The counter hardware can not read all available samples. '
+                                 'Falling back to reading {0:d} samples per loop cycle.'
+                                 ''.format(self._counting_samples))
+                self._use_batched_readout = False
+            self._next_read_time = time.time()
 
             # the sample index for gated counting
             self._already_counted_samples = 0
@@ -450,8 +596,18 @@ class CounterLogic(GenericLogic):
 
         It runs repeatedly in the logic module event loop by being connected
         to sigCountContinuousNext and emitting sigCountContinuousNext through a queued connection.
+
+        With batched readout, the hardware is read once per GUI frame and returns all samples
+        acquired since the last read, which are processed as one block.
         """
         if self.module_state() == 'locked':
+            if self._use_batched_readout:
+                # wait for the samples of one frame to come in
+                wait_time = self._next_read_time - time.time()
+                if wait_time > 0:
+                    time.sleep(wait_time)
+                self._next_read_time = time.time() + 1 / self._gui_frame_rate
+
             with self.threadlock:
                 # check for aborts of the thread in break if necessary
                 if self.stopRequested:
@@ -467,8 +623,15 @@ class CounterLogic(GenericLogic):
                     return
 
                 # read the current counter value
-                self.rawdata = self._counting_device.get_counter(samples=self._counting_samples)
-                if self.rawdata[0, 0] < 0:
+                if self._use_batched_readout:
+                    # up to one second of samples, the rest is picked up by the next read
+                    max_samples = max(int(np.ceil(self._count_frequency)), self._counting_samples)
+                    self.rawdata = self._counting_device.get_counter(
+                        samples=max_samples, read_available_samples=True)
+                else:
+                    self.rawdata = self._counting_device.get_counter(
+                        samples=self._counting_samples)
+                if self.rawdata.size > 0 and self.rawdata[0, 0] < 0:
                     self.log.error('The counting went wrong, killing the counter.')
                     self.stopRequested = True
                 else:
@@ -482,10 +645,56 @@ class CounterLogic(GenericLogic):
                         self.log.error('No valid counting mode set! Can not process counter data.')
 
             # call this again from event loop
-            self.sigCounterUpdated.emit()
+            self._emit_counter_updated()
             self.sigCountDataNext.emit()
         return
 
+    def _emit_counter_updated(self):
+        """ Emit sigCounterUpdated with the next frame, at most gui_frame_rate times per second.
+
+        All updates within one frame are coalesced into one emission at its end, so the last
+        samples before a pause reach the GUI as well.
+        """
+        if not self._update_timer.isActive():
+            self._update_timer.start()
+        return
+
+    def _average_samples(self):
+        """ Group the raw samples into trace points of counting_samples samples each.
+
+        Samples left over from a batched read are kept and completed by the next read.
+
+        @return numpy.ndarray, numpy.ndarray: raw samples used (channels, points * counting_samples)
+                                              and the averaged trace points (channels, points)
+        """
+        samples = np.asarray(self.rawdata, dtype=float)
+        if self._pending_samples.shape[1] > 0:
+            samples = np.concatenate((self._pending_samples, samples), axis=1)
+        number_of_points = samples.shape[1] // self._counting_samples
+        used_samples = number_of_points * self._counting_samples
+        self._pending_samples = samples[:, used_samples:]
+        samples = samples[:, :used_samples]
+        new_counts = samples.reshape(
+            samples.shape[0], number_of_points, self._counting_samples).mean(axis=2)
+        return samples, new_counts
+
+    def _save_samples(self, rows):
+        """ Append rows of counts to the save buffer together with their time stamps.
+
+        In batched readout the rows get the times they were acquired at, otherwise all rows of a
+        read get the time of the read.
+
+        @param numpy.ndarray rows: 2D array (samples, channels to save)
+        """
+        timestamp = time.time() - self._saving_start_time
+        if self._use_batched_readout:
+            # the last row is the latest sample, the rows are one clock period apart
+            times = timestamp - np.arange(rows.shape[0] - 1, -1, -1) / self._count_frequency
+            self._save_buffer.append(np.column_stack((times, rows)))
+        else:
+            self._save_buffer.append(rows, timestamp=timestamp)
+        return
+
     def save_current_count_trace(self, name_tag=''):
         """ The currently displayed counttrace will be saved.
 
@@ -508,9 +717,7 @@ class CounterLogic(GenericLogic):
         else:
             filelabel = 'snapshot_count_trace_' + name_tag
 
-        stop_time = self._count_length / self._count_frequency
-        time_step_size = stop_time / len(self.countdata)
-        x_axis = np.arange(0, stop_time, time_step_size)
+        x_axis = np.arange(self._count_length) / self._count_frequency
 
         # prepare the data in a dict or in an OrderedDict:
         data = OrderedDict()
@@ -519,8 +726,9 @@ class CounterLogic(GenericLogic):
         savearr[0] = x_axis
         datastr = 'Time (s)'
 
+        countdata = self.countdata
         for i, ch in enumerate(chans):
-            savearr[i+1] = self.countdata[i]
+            savearr[i+1] = countdata[i]
             datastr += ',Signal {0} (counts/s)'.format(i)
 
         data[datastr] = savearr.transpose()
@@ -541,50 +749,27 @@ class CounterLogic(GenericLogic):
         return data, filepath, parameters, filelabel
 
     def get_channels(self):
-        """ Shortcut for hardware get_counter_channels.
+        """ Shortcut for hardware get_counter_channels. The channels are only requested from the
+        hardware once per counter start.
 
             @return list(str): return list of active counter channel names
         """
-        return self._counting_device.get_counter_channels()
+        if self._channels is None:
+            self._channels = list(self._counting_device.get_counter_channels())
+        return list(self._channels)
 
     def _process_data_continous(self):
         """
         Processes the raw data from the counting device
         @return:
         """
-        for i, ch in enumerate(self.get_channels()):
-            # remember the new count data in circular array
-            self.countdata[i, 0] = np.average(self.rawdata[i])
-        # move the array to the left to make space for the new data
-        self.countdata = np.roll(self.countdata, -1, axis=1)
-        # also move the smoothing array
-        self.countdata_smoothed = np.roll(self.countdata_smoothed, -1, axis=1)
-        # calculate the median and save it
-        window = -int(self._smooth_window_length / 2) - 1
-        for i, ch in enumerate(self.get_channels()):
-            self.countdata_smoothed[i, window:] = np.median(self.countdata[i,
-                                                            -self._smooth_window_length:])
-
-        # save the data if necessary
+        # the average of the oversampled counts is the new point of the count trace
+        samples, new_counts = self._average_samples()
+        self._append_count_samples(new_counts)
+
+        # save the data if necessary, one row (timestamp, counts) per sample
         if self._saving:
-             # if oversampling is necessary
-            if self._counting_samples > 1:
-                chans = self.get_channels()
-                self._sampling_data = np.empty([len(chans) + 1, self._counting_samples])
-                self._sampling_data[0, :] = time.time() - self._saving_start_time
-                for i, ch in enumerate(chans):
-                    self._sampling_data[i+1, 0] = self.rawdata[i]
-
-                self._data_to_save.extend(list(self._sampling_data))
-            # if we don't want to use oversampling
-            else:
-                # append tuple to data stream (timestamp, average counts)
-                chans = self.get_channels()
-                newdata = np.empty((len(chans) + 1, ))
-                newdata[0] = time.time() - self._saving_start_time
-                for i, ch in enumerate(chans):
-                    newdata[i+1] = self.countdata[i, -1]
-                self._data_to_save.append(newdata)
+            self._save_samples(samples.transpose())
         return
 
     def _process_data_gated(self):
@@ -592,29 +777,13 @@ class CounterLogic(GenericLogic):
         Processes the raw data from the counting device
         @return:
         """
-        # remember the new count data in circular array
-        self.countdata[0] = np.average(self.rawdata[0])
-        # move the array to the left to make space for the new data
-        self.countdata = np.roll(self.countdata, -1)
-        # also move the smoothing array
-        self.countdata_smoothed = np.roll(self.countdata_smoothed, -1)
-        # calculate the median and save it
-        self.countdata_smoothed[-int(self._smooth_window_length / 2) - 1:] = np.median(
-            self.countdata[-self._smooth_window_length:])
-
-        # save the data if necessary
+        # remember the averaged counts of each gate readout in the circular trace
+        samples, new_counts = self._average_samples()
+        self._append_count_samples(new_counts)
+
+        # save the data if necessary, one row (timestamp, counts of the first channel) per sample
         if self._saving:
-            # if oversampling is necessary
-            if self._counting_samples > 1:
-                self._sampling_data = np.empty((self._counting_samples, 2))
-                self._sampling_data[:, 0] = time.time() - self._saving_start_time
-                self._sampling_data[:, 1] = self.rawdata[0]
-                self._data_to_save.extend(list(self._sampling_data))
-            # if we don't want to use oversampling
-            else:
-                # append tuple to data stream (timestamp, average counts)
-                self._data_to_save.append(np.array((time.time() - self._saving_start_time,
-                                                    self.countdata[-1])))
+            self._save_samples(samples[:1].transpose())
         return
 
     def _process_data_finite_gated(self):
@@ -622,19 +791,14 @@ class CounterLogic(GenericLogic):
         Processes the raw data from the counting device
         @return:
         """
-        if self._already_counted_samples+len(self.rawdata[0]) >= len(self.countdata):
-            needed_counts = len(self.countdata) - self._already_counted_samples
-            self.countdata[0:needed_counts] = self.rawdata[0][0:needed_counts]
-            self.countdata = np.roll(self.countdata, -needed_counts)
+        # append the samples until the trace is filled once
+        needed_counts = self._count_length - self._already_counted_samples
+        new_counts = self.rawdata[:, :needed_counts]
+        self._append_count_samples(new_counts, smooth=False)
+        self._already_counted_samples += new_counts.shape[1]
+        if self._already_counted_samples >= self._count_length:
             self._already_counted_samples = 0
             self.stopRequested = True
-        else:
-            # replace the first part of the array with the new data:
-            self.countdata[0:len(self.rawdata[0])] = self.rawdata[0]
-            # roll the array by the amount of data it had been inserted:
-            self.countdata = np.roll(self.countdata, -len(self.rawdata[0]))
-            # increment the index counter:
-            self._already_counted_samples += len(self.rawdata[0])
         return
 
     def _stopCount_wait(self, timeout=5.0):
@@ -20,12 +20,15 @@ Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
 top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
 """
 
+import copy
 import importlib
 import inspect
+import logging
 import lmfit
+import multiprocessing
 from qtpy import QtCore
 import numpy as np
-from os import listdir
+from os import cpu_count, listdir
 from os.path import isfile, join
 from collections import OrderedDict
 from distutils.version import LooseVersion
@@ -34,6 +37,7 @@ from logic.generic_logic import GenericLogic
 from core.util.modules import get_main_dir
 from core.util.mutex import Mutex
 from core.config import load, save
+from core.module import ConfigOption
 
 
 class FitLogic(GenericLogic):
@@ -54,18 +58,17 @@ class FitLogic(GenericLogic):
     _modclass = 'fitlogic'
     _modtype = 'logic'
 
+    # number of processes for batch fits, None for the number of CPUs
+    _batch_fit_processes = ConfigOption('batch_fit_processes', None)
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         # locking for thread safety
         self.lock = Mutex()
+        # process pool for batch fits, started on first use
+        self._batch_fit_pool = None
 
-        filenames = []
-        # for path in directories:
-        path = join(get_main_dir(), 'logic', 'fitmethods')
-        for f in listdir(path):
-            if isfile(join(path, f)):
-                if f[-3:] == '.py':
-                    filenames.append(f[:-3])
+        filenames = _fit_method_files()
 
         # A dictionary contianing all fit methods and their estimators.
         self.fit_list = OrderedDict()
@@ -157,7 +160,73 @@ class FitLogic(GenericLogic):
 
     def on_deactivate(self):
         """ """
-        pass
+        if self._batch_fit_pool is not None:
+            self._batch_fit_pool.terminate()
+            self._batch_fit_pool = None
+
+    def batch_fit(self, x_data, y_data, fit_function, estimator='generic', units=None,
+                  add_params=None, warm_start=False):
+        """ Fit each row of a stack of datasets in a pool of processes.
+
+        @param numpy.ndarray x_data: 1D x axis shared by all rows or 2D array with one x axis per row
+        @param numpy.ndarray y_data: 2D array, one dataset per row
+        @param str fit_function: name of the fit, e.g. 'lorentzian' for make_lorentzian_fit
+        @param str estimator: name of the estimator, 'generic' or e.g. 'dip'
+        @param list units: optional, units passed to the fit
+        @param Parameters or dict add_params: optional, parameters used instead of the estimated
+                                              ones for every row
+        @param bool warm_start: start each fit from the result of the previous row (the rows
+                                are then fitted in contiguous blocks, one per process)
+
+        @return generator: yields (row index, lmfit.Parameters, dict) as the fits finish. The
+                           Parameters hold the best fit values, evaluate them with the model of
+                           fit_list['1d'][fit_function]['make_model']. The dict contains
+                           'success', 'message', 'chisqr', 'redchi' and 'result_str_dict' of the
+                           fit. The model itself is not returned since it cannot be pickled.
+        """
+        y_data = np.asarray(y_data)
+        x_data = np.asarray(x_data)
+        if x_data.ndim == 1:
+            x_data = np.broadcast_to(x_data, y_data.shape)
+        if x_data.shape != y_data.shape:
+            self.log.error('x_data with shape {0} does not fit to y_data with shape {1}.'
+                           ''.format(x_data.shape, y_data.shape))
+            return
+        if fit_function not in self.fit_list['1d'] or \
+                estimator not in self.fit_list['1d'][fit_function]:
+            self.log.error('Fit "{0}" with estimator "{1}" not found in FitLogic.'
+                           ''.format(fit_function, estimator))
+            return
+
+        processes = self._batch_fit_processes
+        if processes is None:
+            processes = cpu_count() or 1
+        number_of_rows = y_data.shape[0]
+        if warm_start:
+            # neighbouring rows stay in the same block
+            number_of_blocks = min(processes, number_of_rows)
+        else:
+            # several blocks per process to keep all processes busy until the end
+            number_of_blocks = min(4 * processes, number_of_rows)
+        blocks = [block for block in np.array_split(np.arange(number_of_rows), number_of_blocks)
+                  if block.size > 0]
+        tasks = [(fit_function, estimator, block, x_data[block], y_data[block], units,
+                  add_params, warm_start) for block in blocks]
+
+        if processes <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                for row, params, info in _batch_fit_block(task):
+                    yield row, params, info
+            return
+
+        with self.lock:
+            if self._batch_fit_pool is None:
+                # spawn, so no Qt state is copied into the worker processes
+                self._batch_fit_pool = multiprocessing.get_context('spawn').Pool(processes)
+            pool = self._batch_fit_pool
+        for block_results in pool.imap_unordered(_batch_fit_block, tasks):
+            for row, params, info in block_results:
+                yield row, params, info
 
     def validate_load_fits(self, fits):
         """ Take fit names and estimators from a dict and check if they are valid.
@@ -434,3 +503,123 @@ class FitContainer(QtCore.QObject):
         self.sigFitUpdated.emit()
 
         return fit_x, fit_y, result
+
+
+def _fit_method_files():
+    """ Names of all modules in logic/fitmethods.
+
+    @return list: module names without the .py ending
+    """
+    filenames = []
+    path = join(get_main_dir(), 'logic', 'fitmethods')
+    for f in listdir(path):
+        if isfile(join(path, f)):
+            if f[-3:] == '.py':
+                filenames.append(f[:-3])
+    return filenames
+
+
+class _BatchFitter:
+    """ Carries the fit methods of FitLogic inside a batch fit worker process.
+
+    The fit methods only need a logger and each other, so they are bound to this lightweight
+    object instead of a full qudi module. The models of the top-level make_*_model calls are
+    built once per process and reused with a fresh copy of their parameters.
+    """
+
+    def __init__(self):
+        self.log = logging.getLogger('logic.fit_logic.batch_fit')
+        self._model_cache = dict()
+        self._model_depth = 0
+        for files in _fit_method_files():
+            mod = importlib.import_module('logic.fitmethods.{0}'.format(files))
+            for method in dir(mod):
+                ref = getattr(mod, method)
+                if callable(ref) and (inspect.ismethod(ref) or inspect.isfunction(ref)):
+                    if method.startswith('make_') and method.endswith('_model'):
+                        setattr(self, method, self._cached_model(method, ref))
+                    else:
+                        setattr(self, method, ref.__get__(self))
+
+    def _cached_model(self, name, make_model):
+        """ Wrap a make_*_model function so its top-level result is only built once. """
+        def wrapper(*args, **kwargs):
+            # composite models are built from the component models, only cache the outermost
+            if self._model_depth > 0:
+                return make_model(self, *args, **kwargs)
+            key = (name, args, tuple(sorted(kwargs.items())))
+            if key not in self._model_cache:
+                self._model_depth += 1
+                try:
+                    self._model_cache[key] = make_model(self, *args, **kwargs)
+                finally:
+                    self._model_depth -= 1
+            model, params = self._model_cache[key]
+            return model, copy.deepcopy(params)
+        return wrapper
+
+
+# one _BatchFitter per worker process, created on the first task
+_batch_fitter = None
+
+
+def _batch_fit_block(task):
+    """ Fit a contiguous block of rows, runs in a batch fit worker process.
+
+    @param tuple task: (fit_function, estimator, rows, x_data, y_data, units, add_params,
+                       warm_start) as put together by FitLogic.batch_fit
+
+    @return list: (row index, lmfit.Parameters, dict) for every row of the block
+    """
+    global _batch_fitter
+    if _batch_fitter is None:
+        _batch_fitter = _BatchFitter()
+    fit_function, estimator, rows, x_block, y_block, units, add_params, warm_start = task
+
+    make_fit = getattr(_batch_fitter, 'make_{0}_fit'.format(fit_function))
+    if estimator == 'generic':
+        estimate = getattr(_batch_fitter, 'estimate_{0}'.format(fit_function))
+    else:
+        estimate = getattr(_batch_fitter, 'estimate_{0}_{1}'.format(fit_function, estimator))
+
+    results = []
+    previous_params = None
+    for row, x_axis, data in zip(rows, x_block, y_block):
+        fit_params = add_params
+        if warm_start and previous_params is not None:
+            fit_params = _warm_start_params(previous_params, add_params)
+        result = make_fit(x_axis=np.array(x_axis), data=np.array(data), estimator=estimate,
+                          units=units, add_params=fit_params)
+        if result.success:
+            previous_params = result.params
+        info = {'success': result.success,
+                'message': result.message,
+                'chisqr': result.chisqr,
+                'redchi': result.redchi,
+                'result_str_dict': getattr(result, 'result_str_dict', OrderedDict())}
+        results.append((int(row), result.params, info))
+    return results
+
+
+def _warm_start_params(previous_params, add_params=None):
+    """ Start values for a fit taken from the result of a neighbouring fit.
+
+    @param lmfit.Parameters previous_params: best fit parameters of the previous row
+    @param Parameters or dict add_params: optional, user parameters which take precedence
+
+    @return dict: parameter dict understood by _substitute_params
+    """
+    warm_params = OrderedDict()
+    for name, param in previous_params.items():
+        # constrained parameters follow from the free ones
+        if param.vary and param.expr is None and np.isfinite(param.value):
+            warm_params[name] = {'value': param.value}
+    if add_params is not None:
+        for name in add_params:
+            param = add_params[name]
+            if isinstance(param, lmfit.Parameter):
+                param = {key: getattr(param, key)
+                         for key in ('value', 'min', 'max', 'vary', 'expr')
+                         if getattr(param, key) is not None}
+            warm_params.setdefault(name, dict()).update(param)
+    return warm_params
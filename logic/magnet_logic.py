@@ -25,8 +25,12 @@ import numpy as np
 import time
 
 from collections import OrderedDict
+from concurrent import futures
 from core.module import Connector, ConfigOption, StatusVar
 from logic.generic_logic import GenericLogic
+from logic.magnet_pathway import PATHWAY_STRATEGIES, PATHWAY_STRATEGY_ALIASES
+from logic.magnet_pathway import compare_pathway_strategies, create_grid_pathway, pathway_axes
+from logic.magnet_pathway import coarse_subgrid, create_subgrid_pathway, refine_subgrid
 from qtpy import QtCore
 from interface.slow_counter_interface import CountingMode
 
@@ -78,6 +82,7 @@ class MagnetLogic(GenericLogic):
     traceanalysis = Connector(interface='TraceAnalysisLogic')
     gatedcounterlogic = Connector(interface='GatedCounterLogic')
     sequencegeneratorlogic = Connector(interface='SequenceGeneratorLogic')
+    fitlogic = Connector(interface='FitLogic')
 
     align_2d_axis0_range = StatusVar('align_2d_axis0_range', 10e-3)
     align_2d_axis0_step = StatusVar('align_2d_axis0_step', 1e-3)
@@ -85,9 +90,20 @@ class MagnetLogic(GenericLogic):
     align_2d_axis1_range = StatusVar('align_2d_axis1_range', 10e-3)
     align_2d_axis1_step = StatusVar('align_2d_axis1_step', 1e-3)
     align_2d_axis1_vel = StatusVar('align_2d_axis1_vel', 10e-6)
-    curr_2d_pathway_mode = StatusVar('curr_2d_pathway_mode', 'snake-wise')
+    curr_2d_pathway_mode = StatusVar('curr_2d_pathway_mode', 'serpentine')
+    # time the stage needs to settle after a move, used to optimize and estimate the pathway
+    align_settle_time = StatusVar('align_settle_time', 0.0)
+    # adaptive 2D alignment: measure a coarse sub-grid and refine around the fitted maximum.
+    # It stops at the step size or once the fit locates the maximum to the precision, a
+    # precision of 0 always refines down to the step size.
+    align_2d_adaptive = StatusVar('align_2d_adaptive', False)
+    align_2d_adaptive_points = StatusVar('align_2d_adaptive_points', 5)
+    align_2d_axis0_precision = StatusVar('align_2d_axis0_precision', 0.0)
+    align_2d_axis1_precision = StatusVar('align_2d_axis1_precision', 0.0)
 
     _checktime = StatusVar('_checktime', 2.5)
+    # time in s added to the expected duration of a move before it counts as failed
+    _move_timeout_margin = ConfigOption('move_timeout_margin', 30)
     _1D_axis0_data = StatusVar('_1D_axis0_data', np.zeros(2))
     _2D_axis0_data = StatusVar('_2D_axis0_data', np.zeros(2))
     _2D_axis1_data = StatusVar('_2D_axis1_data', np.zeros(2))
@@ -149,6 +165,7 @@ class MagnetLogic(GenericLogic):
     # GUI to the leading underscore signals!
     _sigStepwiseAlignmentNext = QtCore.Signal()
     _sigContinuousAlignmentNext = QtCore.Signal()
+    _sigMotionFinished = QtCore.Signal() # emitted from the motion watcher thread
     _sigInitializeMeasPos = QtCore.Signal(bool) # signal to go to the initial measurement position
     sigPosReached = QtCore.Signal()
 
@@ -190,6 +207,18 @@ class MagnetLogic(GenericLogic):
         super().__init__(config=config, **kwargs)
 
         self._stop_measure = False
+        # velocities of the axes during the alignment moves, None for no change
+        self._pathway_vel = dict()
+        # future of the current alignment move and whether the pulsed ODMR
+        # sequence was already loaded during that move
+        self._stepwise_meas = True
+        self._motion_future = None
+        self._pulsed_odmr_prepared = False
+        # grid and strides of the current adaptive 2D map, None if the full grid is measured
+        self._2d_adaptive_grid = None
+        self._2d_adaptive_strides = None
+        # fitted position of the maximum of the last adaptive 2D map
+        self.align_2d_optimum = dict()
 
     def on_activate(self):
         """ Definition and initialisation of the GUI.
@@ -209,6 +238,7 @@ class MagnetLogic(GenericLogic):
         #self._odmr_logic = self.get_connector('odmrlogic')
 
         self._seq_gen_logic = self.get_connector('sequencegeneratorlogic')
+        self._fit_logic = self.get_connector('fitlogic')
 
         # EXPERIMENTAL:
         # connect now directly signals to the interface methods, so that
@@ -223,8 +253,10 @@ class MagnetLogic(GenericLogic):
         self._sigInitializeMeasPos.connect(self._move_to_curr_pathway_index)
         self._sigStepwiseAlignmentNext.connect(self._stepwise_loop_body,
                                                QtCore.Qt.QueuedConnection)
+        self._sigMotionFinished.connect(self._alignment_move_finished,
+                                        QtCore.Qt.QueuedConnection)
 
-        self.pathway_modes = ['spiral-in', 'spiral-out', 'snake-wise', 'diagonal-snake-wise']
+        self.pathway_modes = list(PATHWAY_STRATEGIES)
 
         # relative movement settings
 
@@ -442,202 +474,89 @@ class MagnetLogic(GenericLogic):
         @param str axis1_name:
         @param float axis1_range:
         @param float axis1_step:
+        @param dict init_pos: position of the magnet, the path is centered around it
+        @param float axis0_vel: optional, velocity of axis0
+        @param float axis1_vel: optional, velocity of axis1
+
+        @return numpy.ndarray: structured array with one entry per measurement point in the
+                               order of the measurement. The fields axis0_name and axis1_name
+                               hold the absolute positions, the field 'index' the index of the
+                               point in the 2D data matrix. The array serves as pathway and as
+                               back map from the pathway index to the matrix index.
+
+        The order through the matrix is chosen by curr_2d_pathway_mode, see
+        logic.magnet_pathway.PATHWAY_STRATEGIES. Mirrored and axis-swapped variants of the
+        order are compared and the one with the least stage time is taken.
+        """
+        grid = self._get_2d_grid(axis0_name, axis0_range, axis0_step,
+                                 axis1_name, axis1_range, axis1_step, init_pos)
+        velocities = self._get_pathway_velocities([axis0_name, axis1_name],
+                                                  [axis0_vel, axis1_vel])
+        return create_grid_pathway(*grid,
+                                   strategy=self.curr_2d_pathway_mode,
+                                   velocities=velocities,
+                                   settle_time=self.align_settle_time,
+                                   start_pos=init_pos)
+
+    def _get_2d_grid(self, axis0_name, axis0_range, axis0_step,
+                     axis1_name, axis1_range, axis1_step, init_pos):
+        """ Axis names, start positions, steps and number of points of a 2D alignment map.
+        """
+        axis_names = [axis0_name, axis1_name]
+        axis_starts = [round(init_pos[axis0_name] - axis0_range / 2, 7),
+                       round(init_pos[axis1_name] - axis1_range / 2, 7)]
+        axis_steps = [axis0_step, axis1_step]
+        # +1 because number of points and not number of steps are needed
+        axis_points = [int(axis0_range // axis0_step) + 1, int(axis1_range // axis1_step) + 1]
+        return axis_names, axis_starts, axis_steps, axis_points
+
+    def _get_pathway_velocities(self, axis_names, velocities):
+        """ Velocities of the axes, the maximal velocity of the hardware if not given. """
+        constraints = self.get_hardware_constraints()
+        return [constraints[name]['vel_max'] if vel is None else vel
+                for name, vel in zip(axis_names, velocities)]
 
-        @return array: 1D np.array, which has dictionary as entries. In this
-                       dictionary, it will be specified, how the magnet is going
-                       from the present point to the next.
-
-        That should be quite a general function, which maps from a given matrix
-        and axes information a 2D array into a 1D path with steps being the
-        relative movements.
-
-        All kind of standard and fancy pathways through the array should be
-        implemented here!
-        The movement is not restricted to relative movements!
-        The entry dicts have the following structure:
-
-           pathway =  [ dict1, dict2, dict3, ...]
+    def estimate_2d_pathway_times(self, strategies=None):
+        """ Estimate the stage time of the current 2D alignment settings for several pathways.
 
-        whereas the dictionary can only have one or two key entries:
-             dict1[axis0_name] = {'move_rel': 123, 'move_vel': 3 }
-             dict1[axis1_name] = {'move_abs': 29.5}
+        @param list strategies: optional, pathway strategies to compare, all by default
 
-        Note that the entries may either have a relative OR an absolute movement!
-        Never both! Absolute movement will be taken always before relative
-        movement. Moreover you can specify in each movement step the velocity
-        and the acceleration of the movement.
-        E.g. if no velocity is specified, then nothing will be changed in terms
-        of speed during the move.
+        @return OrderedDict: for each strategy a dict with the total stage time 'time' in s,
+                             the travel per axis 'travel' and the number of moves 'moves'
         """
-
-        # calculate number of steps (those are NOT the number of points!)
-        axis0_num_of_steps = int(axis0_range//axis0_step)
-        axis1_num_of_steps = int(axis1_range//axis1_step)
-
-        # make an array of movement steps
-        axis0_steparray = [axis0_step] * axis0_num_of_steps
-        axis1_steparray = [axis1_step] * axis1_num_of_steps
-
-        pathway = []
-
-        #FIXME: create these path modes:
-        if self.curr_2d_pathway_mode == 'spiral-in':
-            self.log.error('The pathway creation method "{0}" through the '
-                    'matrix is not implemented yet!\nReturn an empty '
-                    'patharray.'.format(self.curr_2d_pathway_mode))
-            return [], []
-
-        elif self.curr_2d_pathway_mode == 'spiral-out':
-            self.log.error('The pathway creation method "{0}" through the '
-                    'matrix is not implemented yet!\nReturn an empty '
-                    'patharray.'.format(self.curr_2d_pathway_mode))
-            return [], []
-
-        elif self.curr_2d_pathway_mode == 'diagonal-snake-wise':
-            self.log.error('The pathway creation method "{0}" through the '
-                    'matrix is not implemented yet!\nReturn an empty '
-                    'patharray.'.format(self.current_2d_pathway_mode))
-            return [], []
-
-        elif self.curr_2d_pathway_mode == 'selected-points':
-            self.log.error('The pathway creation method "{0}" through the '
-                    'matrix is not implemented yet!\nReturn an empty '
-                    'patharray.'.format(self.current_2d_pathway_mode))
-            return [], []
-
-        # choose the snake-wise as default for now.
+        if strategies is None:
+            strategies = PATHWAY_STRATEGIES
+        init_pos = self.get_pos([self.align_2d_axis0_name, self.align_2d_axis1_name])
+        grid = self._get_2d_grid(self.align_2d_axis0_name,
+                                 self.align_2d_axis0_range,
+                                 self.align_2d_axis0_step,
+                                 self.align_2d_axis1_name,
+                                 self.align_2d_axis1_range,
+                                 self.align_2d_axis1_step,
+                                 init_pos)
+        velocities = self._get_pathway_velocities(grid[0], [self.align_2d_axis0_vel,
+                                                            self.align_2d_axis1_vel])
+        return compare_pathway_strategies(*grid,
+                                          velocities=velocities,
+                                          settle_time=self.align_settle_time,
+                                          start_pos=init_pos,
+                                          strategies=strategies)
+
+    def set_2d_pathway_mode(self, mode):
+        """ Set the order in which the 2D alignment map is measured.
+
+        @param str mode: one of self.pathway_modes
+
+        @return str: the pathway mode in use
+        """
+        mode = PATHWAY_STRATEGY_ALIASES.get(mode, mode)
+        if mode in PATHWAY_STRATEGIES:
+            self.curr_2d_pathway_mode = mode
         else:
-
-            # create a snake-wise stepping procedure through the matrix:
-            self.log.debug(axis0_name)
-            self.log.debug(axis0_range)
-            self.log.debug(init_pos[axis0_name])
-            axis0_pos = round(init_pos[axis0_name] - axis0_range/2, 7)
-            axis1_pos = round(init_pos[axis1_name] - axis1_range/2, 7)
-
-            # append again so that the for loop later will run once again
-            # through the axis0 array but the last value of axis1_steparray will
-            # not be performed.
-            axis1_steparray.append(axis1_num_of_steps)
-
-            # step_config is the dict containing the commands for one pathway
-            # entry. Move at first to start position:
-            step_config = dict()
-
-            if axis0_vel is None:
-                step_config[axis0_name] = {'move_abs': axis0_pos}
-            else:
-                step_config[axis0_name] = {'move_abs': axis0_pos, 'move_vel': axis0_vel}
-
-            if axis1_vel is None:
-                step_config[axis1_name] = {'move_abs': axis1_pos}
-            else:
-                step_config[axis1_name] = {'move_abs': axis1_pos, 'move_vel': axis1_vel}
-
-            pathway.append(step_config)
-
-            path_index = 0
-
-            # these indices should be used to facilitate the mapping to a 2D
-            # array, since the
-            axis0_index = 0
-            axis1_index = 0
-
-            # that is a map to transform a pathway index value back to an
-            # absolute position and index. That will be important for saving the
-            # data corresponding to a certain path_index value.
-            back_map = dict()
-            back_map[path_index] = {axis0_name: axis0_pos,
-                                    axis1_name: axis1_pos,
-                                    'index': (axis0_index, axis1_index)}
-
-            path_index += 1
-            # axis0_index += 1
-
-            go_pos_dir = True
-            for step_in_axis1 in axis1_steparray:
-
-                if go_pos_dir:
-                    go_pos_dir = False
-                    direction = +1
-                else:
-                    go_pos_dir = True
-                    direction = -1
-
-                for step_in_axis0 in axis0_steparray:
-
-                    axis0_index += direction
-                    # make move along axis0:
-                    step_config = dict()
-
-                    # relative movement:
-                    # step_config[axis0_name] = {'move_rel': direction*step_in_axis0}
-
-                    # absolute movement:
-                    axis0_pos =round(axis0_pos + direction*step_in_axis0, 7)
-
-                    # if axis0_vel is None:
-                    #     step_config[axis0_name] = {'move_abs': axis0_pos}
-                    #     step_config[axis1_name] = {'move_abs': axis1_pos}
-                    # else:
-                    #     step_config[axis0_name] = {'move_abs': axis0_pos,
-                    #                                'move_vel': axis0_vel}
-                    if axis1_vel is None and axis0_vel is None:
-                        step_config[axis0_name] = {'move_abs': axis0_pos}
-                        step_config[axis1_name] = {'move_abs': axis1_pos}
-                    else:
-                        step_config[axis0_name] = {'move_abs': axis0_pos}
-                        step_config[axis1_name] = {'move_abs': axis1_pos}
-
-                        if axis0_vel is not None:
-                            step_config[axis0_name] = {'move_abs': axis0_pos, 'move_vel': axis0_vel}
-
-                        if axis1_vel is not None:
-                            step_config[axis1_name] = {'move_abs': axis1_pos, 'move_vel': axis1_vel}
-
-                    # append to the pathway
-                    pathway.append(step_config)
-                    back_map[path_index] = {axis0_name: axis0_pos,
-                                            axis1_name: axis1_pos,
-                                            'index': (axis0_index, axis1_index)}
-                    path_index += 1
-
-                if (axis1_index+1) >= len(axis1_steparray):
-                    break
-
-                # make a move along axis1:
-                step_config = dict()
-
-                # relative movement:
-                # step_config[axis1_name] = {'move_rel' : step_in_axis1}
-
-                # absolute movement:
-                axis1_pos = round(axis1_pos + step_in_axis1, 7)
-
-                if axis1_vel is None and axis0_vel is None:
-                    step_config[axis0_name] = {'move_abs': axis0_pos}
-                    step_config[axis1_name] = {'move_abs': axis1_pos}
-                else:
-                    step_config[axis0_name] = {'move_abs': axis0_pos}
-                    step_config[axis1_name] = {'move_abs': axis1_pos}
-
-                    if axis0_vel is not None:
-                        step_config[axis0_name] = {'move_abs': axis0_pos, 'move_vel': axis0_vel}
-
-                    if axis1_vel is not None:
-                        step_config[axis1_name] = {'move_abs': axis1_pos, 'move_vel': axis1_vel}
-
-                pathway.append(step_config)
-                axis1_index += 1
-                back_map[path_index] = {axis0_name: axis0_pos,
-                                        axis1_name: axis1_pos,
-                                        'index': (axis0_index, axis1_index)}
-                path_index += 1
-
-
-
-        return pathway, back_map
-
+            self.log.warning('Pathway mode "{0}" is not available, choose one of {1}. The '
+                             'pathway mode "{2}" is kept.'
+                             ''.format(mode, PATHWAY_STRATEGIES, self.curr_2d_pathway_mode))
+        return self.curr_2d_pathway_mode
 
     def _create_2d_cont_pathway(self, pathway):
 
@@ -763,20 +682,42 @@ class MagnetLogic(GenericLogic):
             # current measurement point
             self._pathway_index = 0
 
-            self._pathway, self._backmap = self._create_2d_pathway(self.align_2d_axis0_name,
-                                                                   self.align_2d_axis0_range,
-                                                                   self.align_2d_axis0_step,
-                                                                   self.align_2d_axis1_name,
-                                                                   self.align_2d_axis1_range,
-                                                                   self.align_2d_axis1_step,
-                                                                   self._saved_pos_before_align,
-                                                                   self.align_2d_axis0_vel,
-                                                                   self.align_2d_axis1_vel)
-
-            # determine the start point, either relative or absolute!
-            # Now the absolute position will be used:
-            axis0_start = self._backmap[0][self.align_2d_axis0_name]
-            axis1_start = self._backmap[0][self.align_2d_axis1_name]
+            grid = self._get_2d_grid(self.align_2d_axis0_name,
+                                     self.align_2d_axis0_range,
+                                     self.align_2d_axis0_step,
+                                     self.align_2d_axis1_name,
+                                     self.align_2d_axis1_range,
+                                     self.align_2d_axis1_step,
+                                     self._saved_pos_before_align)
+            axis0_start, axis1_start = grid[1]
+
+            if self.align_2d_adaptive:
+                self._2d_adaptive_grid = grid
+                self.align_2d_optimum = dict()
+                self._2D_measured_matrix = np.zeros(grid[3], dtype=bool)
+                self._pathway = self._create_2d_adaptive_pathway(
+                    coarse_subgrid(grid[3], self.align_2d_adaptive_points),
+                    self._saved_pos_before_align)
+            else:
+                self._2d_adaptive_grid = None
+                self._2d_adaptive_strides = None
+                for strategy, estimate in self.estimate_2d_pathway_times().items():
+                    self.log.info('Estimated stage time of the {0} pathway: {1:.1f} s'
+                                  ''.format(strategy, estimate['time']))
+
+                self._pathway = self._create_2d_pathway(self.align_2d_axis0_name,
+                                                        self.align_2d_axis0_range,
+                                                        self.align_2d_axis0_step,
+                                                        self.align_2d_axis1_name,
+                                                        self.align_2d_axis1_range,
+                                                        self.align_2d_axis1_step,
+                                                        self._saved_pos_before_align,
+                                                        self.align_2d_axis0_vel,
+                                                        self.align_2d_axis1_vel)
+            # the pathway also maps the pathway index back to the position and matrix index
+            self._backmap = self._pathway
+            self._pathway_vel = {self.align_2d_axis0_name: self.align_2d_axis0_vel,
+                                 self.align_2d_axis1_name: self.align_2d_axis1_vel}
 
             prepared_graph = self._prepare_2d_graph(
                 axis0_start,
@@ -824,35 +765,66 @@ class MagnetLogic(GenericLogic):
 
         # move absolute to the index position, which is currently given
 
-        move_dict_vel, \
-        move_dict_abs, \
-        move_dict_rel = self._move_to_index(self._pathway_index, self._pathway)
+        self._stepwise_meas = stepwise_meas
+        self._start_alignment_move(self._pathway_index)
 
-        self.log.debug("I'm in _move_to_curr_pathway_index: {0}".format(move_dict_abs))
-        # self.set_velocity(move_dict_vel)
-        self._magnet_device.move_abs(move_dict_abs)
-        # self.move_rel(move_dict_rel)
-        while self._check_is_moving():
-            time.sleep(self._checktime)
-            self.log.debug("Went into while loop in _move_to_curr_pathway_index")
+        # the loop body is started by _alignment_move_finished once the
+        # position is reached, set up the measurement in the meantime.
+        self._prepare_alignment_measurement()
+
+    def _start_alignment_move(self, pathway_index):
+        """ Start the move to a point of the pathway without waiting for it.
 
-        # this function will return to this function if position is reached:
-        start_pos = self._saved_pos_before_align
-        end_pos = dict()
-        for axis_name in self._saved_pos_before_align:
-            end_pos[axis_name] = self._backmap[self._pathway_index][axis_name]
+        @param int pathway_index: index of the point in the pathway
 
+        The hardware reports the end of the movement through the future of
+        move_abs_async, which emits _sigMotionFinished from its thread.
+        """
+        move_dict_vel, \
+        move_dict_abs, \
+        move_dict_rel = self._move_to_index(pathway_index, self._pathway)
 
-        self.log.debug("(first movement) magnet moving ? {0}".format(self._check_is_moving()))
+        self.log.debug('Alignment move to {0}'.format(move_dict_abs))
+        # commenting this out for now, because it is kind of useless for us
+        # self.set_velocity(move_dict_vel)
+        self._motion_future = self._magnet_device.move_abs_async(
+            move_dict_abs, timeout=self._get_move_timeout(move_dict_abs))
+        self._motion_future.add_done_callback(lambda future: self._sigMotionFinished.emit())
 
+    def _alignment_move_finished(self):
+        """ Continue the alignment loop after a move has finished. """
+        if self._motion_future is None:
+            return
+        error = self._motion_future.exception()
+        if error is not None:
+            self.log.error('Magnet movement during the alignment failed: {0}'.format(error))
+            self._stop_measure = True
+            self._end_alignment_procedure()
+            return
 
-        if stepwise_meas:
+        if self._stepwise_meas:
             # start the Stepwise alignment loop body self._stepwise_loop_body:
             self._sigStepwiseAlignmentNext.emit()
         else:
             # start the continuous alignment loop body self._continuous_loop_body:
             self._sigContinuousAlignmentNext.emit()
 
+    def _prepare_alignment_measurement(self):
+        """ Set up the measurement of the next point while the magnet moves.
+
+        Only settings which do not depend on the magnetic field are made here,
+        the ODMR frequencies and the refocus have to wait for the position.
+        """
+        if self.curr_alignment_method == '2d_fluorescence':
+            if self._counter_logic.get_counting_mode() != CountingMode.CONTINUOUS:
+                self._counter_logic.set_counting_mode(mode=CountingMode.CONTINUOUS)
+
+        elif self.curr_alignment_method == '2d_nuclear' and self._optimize_pos_freq == 0:
+            # a running pulser would disturb the refocus of the pre measurement
+            self._load_pulsed_odmr()
+            self._pulser_on()
+            self._pulsed_odmr_prepared = True
+
 
     def _stepwise_loop_body(self):
         """ Go one by one through the created path
@@ -867,25 +839,17 @@ class MagnetLogic(GenericLogic):
         pos = self._magnet_device.get_pos()
         end_pos = self._pathway[self._pathway_index]
         self.log.debug('end_pos {0}'.format(end_pos))
-        differences = []
-        for key in end_pos:
-            differences.append((pos[key] - end_pos[key]['move_abs'])**2)
-
-        for key in self._control_dict:
-            differences.append((pos[key] - self._control_dict[key])**2)
-
-        distance = 0
-        for difference in differences:
-            distance += difference
-
+        # the desired field
+        act_pos = {key: float(end_pos[key]) for key in pathway_axes(self._pathway)}
+        keys = list(act_pos) + list(self._control_dict)
+        wanted = [act_pos[key] for key in act_pos] + [self._control_dict[key]
+                                                      for key in self._control_dict]
 
         # this is not the actual distance (in a physical sense), just some sort of mean of the
         # variation of the measurement variables. ( Don't know which coordinates are used ... spheric, cartesian ... )
-        distance = np.sqrt(distance)
+        distance = np.linalg.norm(np.array([pos[key] for key in keys]) - np.array(wanted))
         self._2d_error.append(distance)
         self._2d_measured_fields.append(pos)
-        # the desired field
-        act_pos = {key: self._pathway[self._pathway_index][key]['move_abs'] for key in self._pathway[self._pathway_index]}
         # wanted_pos = {**self._control_dict, **act_pos}
         # Workaround for Python 3.4.4
         self._control_dict.update(act_pos)
@@ -910,34 +874,155 @@ class MagnetLogic(GenericLogic):
 
             #
             self._do_postmeasurement_proc()
-            move_dict_vel, \
-            move_dict_abs, \
-            move_dict_rel = self._move_to_index(self._pathway_index, self._pathway)
 
-            # commenting this out for now, because it is kind of useless for us
-            # self.set_velocity(move_dict_vel)
-            self._magnet_device.move_abs(move_dict_abs)
+            # rerun this loop again once the next position is reached, which is
+            # signalled by _alignment_move_finished.
+            self._start_alignment_move(self._pathway_index)
+            self._prepare_alignment_measurement()
 
-            while self._check_is_moving():
-                time.sleep(self._checktime)
-                self.log.debug("Went into while loop in stepwise_loop_body")
+        elif self._2d_adaptive_strides is not None and self._refine_2d_alignment():
+            # the next round of the adaptive map starts with its first point
+            self._do_postmeasurement_proc()
+            self._start_alignment_move(self._pathway_index)
+            self._prepare_alignment_measurement()
 
-            self.log.debug("stepwise_loop_body reports magnet moving ? {0}".format(self._check_is_moving()))
+        else:
+            self._end_alignment_procedure()
 
-            # this function will return to this function if position is reached:
-            start_pos = dict()
-            end_pos = dict()
-            for axis_name in self._saved_pos_before_align:
-                start_pos[axis_name] = self._backmap[self._pathway_index - 1][axis_name]
-                end_pos[axis_name] = self._backmap[self._pathway_index][axis_name]
+    def _create_2d_adaptive_pathway(self, subgrid, start_pos):
+        """ Create the pathway of one round of an adaptive 2D map.
 
+        @param tuple subgrid: (index_starts, index_strides, index_points) of the round, see
+                              logic.magnet_pathway.coarse_subgrid and refine_subgrid
+        @param dict start_pos: position of the magnet before the round
 
+        @return numpy.ndarray: structured pathway array without the points which are measured
+                               already
+        """
+        axis_names, axis_starts, axis_steps, axis_points = self._2d_adaptive_grid
+        index_starts, index_strides, index_points = subgrid
+        self._2d_adaptive_strides = index_strides
+        velocities = self._get_pathway_velocities(axis_names, [self.align_2d_axis0_vel,
+                                                               self.align_2d_axis1_vel])
+        return create_subgrid_pathway(axis_names, axis_starts, axis_steps,
+                                      index_starts, index_strides, index_points,
+                                      strategy=self.curr_2d_pathway_mode,
+                                      velocities=velocities,
+                                      settle_time=self.align_settle_time,
+                                      start_pos=start_pos,
+                                      skip=self._2D_measured_matrix)
+
+    def _refine_2d_alignment(self):
+        """ Locate the maximum of an adaptive 2D map and set up the pathway of the next round.
+
+        @return bool: True if a next round follows, False if the maximum is located to the
+                      requested precision or the map reached the step size of the grid.
+        """
+        axis_names, axis_starts, axis_steps, axis_points = self._2d_adaptive_grid
+        precision = [self.align_2d_axis0_precision, self.align_2d_axis1_precision]
+        previous = [self.align_2d_optimum.get(name) for name in axis_names]
+
+        center, uncertainty = self._fit_2d_alignment_optimum()
+        self.align_2d_optimum = dict(zip(axis_names, center))
+        self.log.info('Maximum of the adaptive alignment map after {0} points: {1}, '
+                      'uncertainty {2}'.format(np.count_nonzero(self._2D_measured_matrix),
+                                               self.align_2d_optimum, uncertainty))
+
+        # the fit has to be precise and must not have moved since the last round
+        located = uncertainty is not None and None not in previous and all(
+            0 < prec and err <= prec and abs(pos - prev) <= prec
+            for pos, prev, err, prec in zip(center, previous, uncertainty, precision))
+
+        pathway = self._pathway[:0]
+        while len(pathway) == 0:
+            if located or max(self._2d_adaptive_strides) == 1:
+                self._2d_adaptive_strides = None
+                return False
+            center_index = [int(np.clip(np.round((pos - start) / step), 0, points - 1))
+                            for pos, start, step, points
+                            in zip(center, axis_starts, axis_steps, axis_points)]
+            subgrid = refine_subgrid(center_index, self._2d_adaptive_strides, axis_points,
+                                     self.align_2d_adaptive_points)
+            start_pos = {name: float(self._pathway[-1][name]) for name in axis_names}
+            pathway = self._create_2d_adaptive_pathway(subgrid, start_pos)
+
+        self._pathway = pathway
+        self._backmap = self._pathway
+        self._pathway_index = 0
+        return True
 
-            # rerun this loop again
-            self._sigStepwiseAlignmentNext.emit()
+    def _fit_2d_alignment_optimum(self):
+        """ Fit a 2D gaussian to the measured points of the adaptive 2D map.
 
-        else:
-            self._end_alignment_procedure()
+        @return tuple(list, list): position of the maximum and its uncertainty for both axes.
+                                   If the fit fails the position of the highest measured
+                                   point and None are returned.
+        """
+        axis_names, axis_starts, axis_steps, axis_points = self._2d_adaptive_grid
+        index = np.nonzero(self._2D_measured_matrix)
+        data = self._2D_data_matrix[index]
+        axis0 = axis_starts[0] + index[0] * axis_steps[0]
+        axis1 = axis_starts[1] + index[1] * axis_steps[1]
+        best = int(np.argmax(data))
+        best_pos = [float(axis0[best]), float(axis1[best])]
+
+        model, params = self._fit_logic.make_twoDgaussian_model()
+        if len(data) <= len(params) or min(axis_points) < 2:
+            return best_pos, None
+
+        span0 = (axis_points[0] - 1) * axis_steps[0]
+        span1 = (axis_points[1] - 1) * axis_steps[1]
+        params['amplitude'].set(value=float(data.max() - data.min()), min=0)
+        params['center_x'].set(value=best_pos[0], min=axis_starts[0],
+                               max=axis_starts[0] + span0)
+        params['center_y'].set(value=best_pos[1], min=axis_starts[1],
+                               max=axis_starts[1] + span1)
+        params['sigma_x'].set(value=span0 / 4, min=axis_steps[0], max=3 * span0)
+        params['sigma_y'].set(value=span1 / 4, min=axis_steps[1], max=3 * span1)
+        params['theta'].set(value=0.0, min=0, max=np.pi)
+        params['offset'].set(value=float(data.min()))
+
+        try:
+            result = model.fit(data, x=(axis0, axis1), params=params)
+        except Exception as e:
+            self.log.warning('The 2D gaussian fit of the alignment map did not work: '
+                             '{0}'.format(e))
+            return best_pos, None
+        if not result.success:
+            self.log.warning('The 2D gaussian fit of the alignment map did not work: '
+                             '{0}'.format(result.message))
+            return best_pos, None
+
+        center = [result.params['center_x'].value, result.params['center_y'].value]
+        uncertainty = [result.params['center_x'].stderr, result.params['center_y'].stderr]
+        if None in uncertainty:
+            uncertainty = None
+        return center, uncertainty
+
+    def set_2d_adaptive_mode(self, adaptive, points_per_axis=None,
+                             axis0_precision=None, axis1_precision=None):
+        """ Choose between measuring the full 2D grid and an adaptive 2D map.
+
+        @param bool adaptive: True to refine the map around the fitted maximum
+        @param int points_per_axis: optional, points per axis of each round, at least 3
+        @param float axis0_precision: optional, precision of the maximum along axis0, in the
+                                      units of the axis. 0 refines down to the step size.
+        @param float axis1_precision: optional, same for axis1
+
+        @return bool: whether the adaptive mode is used
+        """
+        self.align_2d_adaptive = bool(adaptive)
+        if points_per_axis is not None:
+            if points_per_axis >= 3:
+                self.align_2d_adaptive_points = int(points_per_axis)
+            else:
+                self.log.warning('An adaptive map needs at least 3 points per axis, {0} '
+                                 'points are kept.'.format(self.align_2d_adaptive_points))
+        if axis0_precision is not None:
+            self.align_2d_axis0_precision = axis0_precision
+        if axis1_precision is not None:
+            self.align_2d_axis1_precision = axis1_precision
+        return self.align_2d_adaptive
 
 
     def _continuous_loop_body(self):
@@ -969,16 +1054,17 @@ class MagnetLogic(GenericLogic):
 
         # move back to the first position before the alignment has started:
         #
-        constraints = self.get_hardware_constraints()
-
-        last_pos = dict()
-        for axis_name in self._saved_pos_before_align:
-            last_pos[axis_name] = self._backmap[self._pathway_index-1][axis_name]
-
-        self._magnet_device.move_abs(self._saved_pos_before_align)
-
-        while self._check_is_moving():
-            time.sleep(self._checktime)
+        self._motion_future = None
+        self._pulsed_odmr_prepared = False
+        timeout = self._get_move_timeout(self._saved_pos_before_align)
+        try:
+            self._magnet_device.move_abs_async(self._saved_pos_before_align,
+                                               timeout=timeout).result(timeout + 1)
+        except (TimeoutError, futures.TimeoutError):
+            self.log.error('The magnet did not return to the position {0} before the alignment '
+                           'within {1:.1f} s, the movement is aborted.'
+                           ''.format(self._saved_pos_before_align, timeout))
+            self._magnet_device.abort()
 
         self.sigMeasurementFinished.emit()
 
@@ -990,6 +1076,23 @@ class MagnetLogic(GenericLogic):
         pass
 
 
+    def _get_move_timeout(self, target):
+        """ Time after which a move to target counts as failed.
+
+        @param dict target: axis labels and absolute target positions
+
+        @return float: twice the duration of the move at the maximal velocities plus the
+                       move_timeout_margin, in s
+        """
+        constraints = self.get_hardware_constraints()
+        pos = self.get_pos(list(target))
+        duration = 0.0
+        for axis_name in target:
+            vel_max = constraints[axis_name].get('vel_max')
+            if vel_max:
+                duration = max(duration, abs(target[axis_name] - pos[axis_name]) / vel_max)
+        return 2 * duration + self._move_timeout_margin
+
     def _check_position_reached_loop(self, start_pos_dict, end_pos_dict):
         """ Perform just a while loop, which checks everytime the conditions
 
@@ -1058,7 +1161,7 @@ class MagnetLogic(GenericLogic):
         # is it point for 1d meas or 2d meas?
 
         # map the point back to the position in the measurement array
-        index_array = back_map[pathway_index]['index']
+        index_array = tuple(back_map['index'][pathway_index])
 
         # then index_array is actually no array, but just a number. That is the
         # 1D case:
@@ -1072,6 +1175,8 @@ class MagnetLogic(GenericLogic):
 
             self._2D_data_matrix[index_array] = meas_val
             self._2D_add_data_matrix[index_array] = add_meas_val
+            if self._2d_adaptive_grid is not None:
+                self._2D_measured_matrix[index_array] = True
 
             # self.log.debug('Data "{0}", saved at intex "{1}"'.format(meas_val, index_array))
 
@@ -1238,22 +1343,22 @@ class MagnetLogic(GenericLogic):
         # odmr_2d_peak_axis1_move_ratio:
         if self._pathway_index > 1:
             # in essence, get the last measurement value for odmr freq:
-            if self._2D_add_data_matrix[self._backmap[self._pathway_index-1]['index']].get('low_freq_Frequency') is not None:
-                low_odmr_freq1 = self._2D_add_data_matrix[self._backmap[self._pathway_index-1]['index']]['low_freq_Frequency']['value']*1e6
-                low_odmr_freq2 = self._2D_add_data_matrix[self._backmap[self._pathway_index-2]['index']]['low_freq_Frequency']['value']*1e6
-            elif self._2D_add_data_matrix[self._backmap[self._pathway_index-1]['index']].get('low_freq_Freq. 1') is not None:
-                low_odmr_freq1 = self._2D_add_data_matrix[self._backmap[self._pathway_index-1]['index']]['low_freq_Freq. 1']['value']*1e6
-                low_odmr_freq2 = self._2D_add_data_matrix[self._backmap[self._pathway_index-2]['index']]['low_freq_Freq. 1']['value']*1e6
+            if self._2D_add_data_matrix[tuple(self._backmap[self._pathway_index-1]['index'])].get('low_freq_Frequency') is not None:
+                low_odmr_freq1 = self._2D_add_data_matrix[tuple(self._backmap[self._pathway_index-1]['index'])]['low_freq_Frequency']['value']*1e6
+                low_odmr_freq2 = self._2D_add_data_matrix[tuple(self._backmap[self._pathway_index-2]['index'])]['low_freq_Frequency']['value']*1e6
+            elif self._2D_add_data_matrix[tuple(self._backmap[self._pathway_index-1]['index'])].get('low_freq_Freq. 1') is not None:
+                low_odmr_freq1 = self._2D_add_data_matrix[tuple(self._backmap[self._pathway_index-1]['index'])]['low_freq_Freq. 1']['value']*1e6
+                low_odmr_freq2 = self._2D_add_data_matrix[tuple(self._backmap[self._pathway_index-2]['index'])]['low_freq_Freq. 1']['value']*1e6
             else:
                 self.log.error('No previous saved lower odmr freq found in '
                         'ODMR alignment data! Cannot do the ODMR Alignment!')
 
-            if self._2D_add_data_matrix[self._backmap[self._pathway_index-1]['index']].get('high_freq_Frequency') is not None:
-                high_odmr_freq1 = self._2D_add_data_matrix[self._backmap[self._pathway_index-1]['index']]['high_freq_Frequency']['value']*1e6
-                high_odmr_freq2 = self._2D_add_data_matrix[self._backmap[self._pathway_index-2]['index']]['high_freq_Frequency']['value']*1e6
-            elif self._2D_add_data_matrix[self._backmap[self._pathway_index-1]['index']].get('high_freq_Freq. 1') is not None:
-                high_odmr_freq1 = self._2D_add_data_matrix[self._backmap[self._pathway_index-1]['index']]['high_freq_Freq. 1']['value']*1e6
-                high_odmr_freq2 = self._2D_add_data_matrix[self._backmap[self._pathway_index-2]['index']]['high_freq_Freq. 1']['value']*1e6
+            if self._2D_add_data_matrix[tuple(self._backmap[self._pathway_index-1]['index'])].get('high_freq_Frequency') is not None:
+                high_odmr_freq1 = self._2D_add_data_matrix[tuple(self._backmap[self._pathway_index-1]['index'])]['high_freq_Frequency']['value']*1e6
+                high_odmr_freq2 = self._2D_add_data_matrix[tuple(self._backmap[self._pathway_index-2]['index'])]['high_freq_Frequency']['value']*1e6
+            elif self._2D_add_data_matrix[tuple(self._backmap[self._pathway_index-1]['index'])].get('high_freq_Freq. 1') is not None:
+                high_odmr_freq1 = self._2D_add_data_matrix[tuple(self._backmap[self._pathway_index-1]['index'])]['high_freq_Freq. 1']['value']*1e6
+                high_odmr_freq2 = self._2D_add_data_matrix[tuple(self._backmap[self._pathway_index-2]['index'])]['high_freq_Freq. 1']['value']*1e6
             else:
                 self.log.error('No previous saved higher odmr freq found in '
                         'ODMR alignment data! Cannot do the ODMR Alignment!')
@@ -1430,12 +1535,12 @@ class MagnetLogic(GenericLogic):
         # odmr_2d_peak_axis1_move_ratio:
         if self._pathway_index > 1:
             # in essence, get the last measurement value for odmr freq:
-            if self._2D_add_data_matrix[self._backmap[self._pathway_index-1]['index']].get('Frequency') is not None:
-                odmr_freq1 = self._2D_add_data_matrix[self._backmap[self._pathway_index-1]['index']]['Frequency']['value']*1e6
-                odmr_freq2 = self._2D_add_data_matrix[self._backmap[self._pathway_index-2]['index']]['Frequency']['value']*1e6
-            elif self._2D_add_data_matrix[self._backmap[self._pathway_index-1]['index']].get('Freq. 1') is not None:
-                odmr_freq1 = self._2D_add_data_matrix[self._backmap[self._pathway_index-1]['index']]['Freq. 1']['value']*1e6
-                odmr_freq2 = self._2D_add_data_matrix[self._backmap[self._pathway_index-2]['index']]['Freq. 1']['value']*1e6
+            if self._2D_add_data_matrix[tuple(self._backmap[self._pathway_index-1]['index'])].get('Frequency') is not None:
+                odmr_freq1 = self._2D_add_data_matrix[tuple(self._backmap[self._pathway_index-1]['index'])]['Frequency']['value']*1e6
+                odmr_freq2 = self._2D_add_data_matrix[tuple(self._backmap[self._pathway_index-2]['index'])]['Frequency']['value']*1e6
+            elif self._2D_add_data_matrix[tuple(self._backmap[self._pathway_index-1]['index'])].get('Freq. 1') is not None:
+                odmr_freq1 = self._2D_add_data_matrix[tuple(self._backmap[self._pathway_index-1]['index'])]['Freq. 1']['value']*1e6
+                odmr_freq2 = self._2D_add_data_matrix[tuple(self._backmap[self._pathway_index-2]['index'])]['Freq. 1']['value']*1e6
             else:
                 self.log.error('No previous saved lower odmr freq found in '
                             'ODMR alignment data! Cannot do the ODMR '
@@ -1533,8 +1638,10 @@ class MagnetLogic(GenericLogic):
         # self.nuclear_2d_idle_time
         # self.nuclear_2d_reps_within_ssr
         # self.nuclear_2d_num_ssr
-        self._load_pulsed_odmr()
-        self._pulser_on()
+        if not self._pulsed_odmr_prepared:
+            self._load_pulsed_odmr()
+            self._pulser_on()
+        self._pulsed_odmr_prepared = False
 
         # self.odmr_2d_low_center_freq
         # self.odmr_2d_low_step_freq
@@ -1852,33 +1959,32 @@ class MagnetLogic(GenericLogic):
         if self._stop_measurement_time is not None:
             parameters['Measurement stop time'] = self._stop_measurement_time
         parameters['Time at Data save'] = timestamp
-        parameters['Pathway of the magnet alignment'] = 'Snake-wise steps'
+        parameters['Pathway of the magnet alignment'] = self.curr_2d_pathway_mode
 
         for index, entry in enumerate(self._pathway):
-            parameters['index_'+str(index)] = entry
+            parameters['index_'+str(index)] = {key: float(entry[key])
+                                               for key in pathway_axes(self._pathway)}
 
         parameters['Backmap of the magnet alignment'] = 'Index wise display'
 
-        for entry in self._backmap:
-            parameters['related_intex_'+str(entry)] = self._backmap[entry]
+        for index, entry in enumerate(self._backmap):
+            parameters['related_intex_'+str(index)] = tuple(entry['index'])
 
 
 
-        self._save_logic.save_data(matrix_data, filepath=filepath, parameters=parameters,
-                                   filelabel=filelabel, timestamp=timestamp)
+        self._save_logic.save_data_async(matrix_data, filepath=filepath, parameters=parameters,
+                                         filelabel=filelabel, timestamp=timestamp)
 
         self.log.debug('Magnet 2D data saved to:\n{0}'.format(filepath))
 
         # prepare the data in a dict or in an OrderedDict:
         add_data = OrderedDict()
-        axis0_data = np.zeros(len(self._backmap))
-        axis1_data = np.zeros(len(self._backmap))
+        axis0_data = np.array(self._backmap[self._axis0_name])
+        axis1_data = np.array(self._backmap[self._axis1_name])
         param_data = np.zeros(len(self._backmap), dtype='object')
 
-        for backmap_index in self._backmap:
-            axis0_data[backmap_index] = self._backmap[backmap_index][self._axis0_name]
-            axis1_data[backmap_index] = self._backmap[backmap_index][self._axis1_name]
-            param_data[backmap_index] = str(self._2D_add_data_matrix[self._backmap[backmap_index]['index']])
+        for backmap_index, matrix_index in enumerate(self._backmap['index']):
+            param_data[backmap_index] = str(self._2D_add_data_matrix[tuple(matrix_index)])
 
         constr = self.get_hardware_constraints()
         units_axis0 = constr[self._axis0_name]['unit']
@@ -1890,8 +1996,8 @@ class MagnetLogic(GenericLogic):
 
 
 
-        self._save_logic.save_data(add_data, filepath=filepath, filelabel=filelabel2,
-                                   timestamp=timestamp)
+        self._save_logic.save_data_async(add_data, filepath=filepath, filelabel=filelabel2,
+                                         timestamp=timestamp)
         # save the data table
 
         count_data = self._2D_data_matrix
@@ -1917,51 +2023,43 @@ class MagnetLogic(GenericLogic):
 
         # making saveable dictionaries
 
-        self._save_logic.save_data(save_dict, filepath=filepath, filelabel=filelabel3,
-                                   timestamp=timestamp, fmt='%.6e')
+        self._save_logic.save_data_async(save_dict, filepath=filepath, filelabel=filelabel3,
+                                         timestamp=timestamp, fmt='%.6e')
         keys = self._2d_intended_fields[0].keys()
         intended_fields = OrderedDict()
         for key in keys:
             field_values = [coord_dict[key] for coord_dict in self._2d_intended_fields]
             intended_fields[key] = field_values
 
-        self._save_logic.save_data(intended_fields, filepath=filepath, filelabel=filelabel4,
-                                   timestamp=timestamp)
+        self._save_logic.save_data_async(intended_fields, filepath=filepath, filelabel=filelabel4,
+                                         timestamp=timestamp)
 
         measured_fields = OrderedDict()
         for key in keys:
             field_values = [coord_dict[key] for coord_dict in self._2d_measured_fields]
             measured_fields[key] = field_values
 
-        self._save_logic.save_data(measured_fields, filepath=filepath, filelabel=filelabel5,
-                                   timestamp=timestamp)
+        self._save_logic.save_data_async(measured_fields, filepath=filepath, filelabel=filelabel5,
+                                         timestamp=timestamp)
 
         error = OrderedDict()
         error['quadratic error'] = self._2d_error
 
-        self._save_logic.save_data(error, filepath=filepath, filelabel=filelabel6,
-                                   timestamp=timestamp)
+        self._save_logic.save_data_async(error, filepath=filepath, filelabel=filelabel6,
+                                         timestamp=timestamp)
 
     def _move_to_index(self, pathway_index, pathway):
 
         # make here the move and set also for the move the velocity, if
-        # specified!
+        # specified! The pathway only contains absolute positions.
 
-        move_commmands = pathway[pathway_index]
+        axis_names = pathway_axes(pathway)
+        position = pathway[pathway_index]
 
-        move_dict_abs = dict()
+        move_dict_abs = {axis_name: float(position[axis_name]) for axis_name in axis_names}
         move_dict_rel = dict()
-        move_dict_vel = dict()
-
-        for axis_name in move_commmands:
-
-            if move_commmands[axis_name].get('vel') is not None:
-                    move_dict_vel[axis_name] = move_commmands[axis_name]['vel']
-
-            if move_commmands[axis_name].get('move_abs') is not None:
-                move_dict_abs[axis_name] = move_commmands[axis_name]['move_abs']
-            elif move_commmands[axis_name].get('move_rel') is not None:
-                move_dict_rel[axis_name] = move_commmands[axis_name]['move_rel']
+        move_dict_vel = {axis_name: self._pathway_vel[axis_name] for axis_name in axis_names
+                         if self._pathway_vel.get(axis_name) is not None}
 
         return move_dict_vel, move_dict_abs, move_dict_rel
 
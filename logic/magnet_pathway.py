@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file contains the pathway planning of the magnet alignment: the grid points of an
+alignment map, the order in which the magnet visits them and an estimate of the stage time.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import itertools
+import numpy as np
+from collections import OrderedDict
+
+
+# traversal strategies through the grid of an alignment map
+PATHWAY_STRATEGIES = ('serpentine', 'raster', 'hilbert', 'nearest-neighbour')
+
+# older names of the strategies
+PATHWAY_STRATEGY_ALIASES = {'snake-wise': 'serpentine', 'line-wise': 'raster'}
+
+
+def pathway_dtype(axis_names):
+    """ Structured dtype of a pathway: one position field per axis and the grid index.
+
+    @param list axis_names: names of the magnet axes
+
+    @return numpy.dtype: dtype with a float field per axis and an int field 'index' with one
+                         entry per axis
+    """
+    fields = [(str(name), np.float64) for name in axis_names]
+    fields.append(('index', np.int64, (len(axis_names),)))
+    return np.dtype(fields)
+
+
+def pathway_axes(pathway):
+    """ Axis names of a pathway.
+
+    @param numpy.ndarray pathway: structured pathway array
+
+    @return list: the axis names in the order of the grid index
+    """
+    return [name for name in pathway.dtype.names if name != 'index']
+
+
+def pathway_positions(pathway):
+    """ Positions of a pathway as a plain array.
+
+    @param numpy.ndarray pathway: structured pathway array
+
+    @return numpy.ndarray: 2D array (number of points, number of axes)
+    """
+    return np.column_stack([pathway[name] for name in pathway_axes(pathway)])
+
+
+def create_grid_pathway(axis_names, axis_starts, axis_steps, axis_points,
+                        strategy='serpentine', velocities=None, settle_time=0.0, start_pos=None):
+    """ Create the pathway through a regular grid of magnet positions.
+
+    @param list axis_names: names of the magnet axes, 2 or 3 for 2D/3D maps
+    @param list axis_starts: lowest position of each axis
+    @param list axis_steps: step size of each axis
+    @param list axis_points: number of points of each axis
+    @param str strategy: one of PATHWAY_STRATEGIES or their aliases
+    @param list velocities: optional, velocity of each axis. Used to weight the axes when the
+                            order is optimized, all axes are equally fast if not given.
+    @param float settle_time: time the stage needs to settle after each move
+    @param dict start_pos: optional, position of the magnet before the first point. For
+                           raster, serpentine and hilbert the mirrored and axis-swapped
+                           variants of the order are compared and the one with the shortest
+                           stage time, including the return to start_pos, is taken.
+                           Nearest-neighbour ordering starts at the point closest to it.
+
+    @return numpy.ndarray: structured array with pathway_dtype(axis_names), one entry per
+                           grid point in the order they are visited
+    """
+    strategy = PATHWAY_STRATEGY_ALIASES.get(strategy, strategy)
+    if strategy not in PATHWAY_STRATEGIES:
+        raise ValueError('Unknown pathway strategy "{0}", choose one of {1}.'
+                         ''.format(strategy, PATHWAY_STRATEGIES))
+    axis_points = tuple(int(points) for points in axis_points)
+    ndim = len(axis_points)
+    if velocities is None:
+        velocities = np.ones(ndim)
+    velocities = np.asarray(velocities, dtype=float)
+    if start_pos is not None:
+        start_pos = np.array([start_pos[name] for name in axis_names], dtype=float)
+
+    # positions of all grid points, in C order of the grid index
+    index_grid = np.indices(axis_points).reshape(ndim, -1).T
+    positions = np.round(np.asarray(axis_starts, dtype=float)
+                         + index_grid * np.asarray(axis_steps, dtype=float), 7)
+
+    if strategy == 'nearest-neighbour':
+        order = _nearest_neighbour_order(positions, velocities, start_pos)
+    else:
+        best_time = np.inf
+        order = None
+        for flat_order in _grid_order_variants(axis_points, strategy):
+            if start_pos is None:
+                order = flat_order
+                break
+            path_positions = np.vstack((start_pos, positions[flat_order], start_pos))
+            time = np.sum(_move_times(path_positions, velocities, settle_time))
+            if time < best_time:
+                best_time = time
+                order = flat_order
+
+    pathway = np.empty(len(order), dtype=pathway_dtype(axis_names))
+    for axis, name in enumerate(axis_names):
+        pathway[name] = positions[order, axis]
+    pathway['index'] = index_grid[order]
+    return pathway
+
+
+def create_subgrid_pathway(axis_names, axis_starts, axis_steps, index_starts, index_strides,
+                           index_points, strategy='serpentine', velocities=None, settle_time=0.0,
+                           start_pos=None, skip=None):
+    """ Create the pathway through every index_strides-th point of a part of a regular grid.
+
+    The points keep the positions and indices of the full grid, so the measurements of several
+    sub-grids, e.g. the rounds of an adaptive map, end up in one data matrix.
+
+    @param list axis_names: names of the magnet axes
+    @param list axis_starts: lowest position of each axis of the full grid
+    @param list axis_steps: step size of each axis of the full grid
+    @param list index_starts: grid index of the first point of the sub-grid
+    @param list index_strides: distance of the sub-grid points in grid points
+    @param list index_points: number of points of each axis of the sub-grid
+    @param str strategy: one of PATHWAY_STRATEGIES or their aliases
+    @param list velocities: optional, velocity of each axis
+    @param float settle_time: time the stage needs to settle after each move
+    @param dict start_pos: optional, position of the magnet before the first point
+    @param numpy.ndarray skip: optional, bool array with the shape of the full grid, True for
+                               points which are left out, e.g. because they are measured already
+
+    @return numpy.ndarray: structured array with pathway_dtype(axis_names)
+    """
+    index_starts = np.asarray(index_starts, dtype=np.int64)
+    index_strides = np.asarray(index_strides, dtype=np.int64)
+    sub_starts = np.asarray(axis_starts, dtype=float) + index_starts * np.asarray(axis_steps)
+    sub_steps = index_strides * np.asarray(axis_steps, dtype=float)
+    pathway = create_grid_pathway(axis_names, sub_starts, sub_steps, index_points, strategy,
+                                  velocities, settle_time, start_pos)
+
+    # back to the index and positions of the full grid
+    pathway['index'] = index_starts + pathway['index'] * index_strides
+    for axis, name in enumerate(axis_names):
+        pathway[name] = np.round(axis_starts[axis] + pathway['index'][:, axis] * axis_steps[axis], 7)
+    if skip is not None:
+        pathway = pathway[~skip[tuple(pathway['index'].T)]]
+    return pathway
+
+
+def coarse_subgrid(axis_points, points_per_axis):
+    """ Sub-grid of the first round of an adaptive map.
+
+    @param list axis_points: number of points of each axis of the full grid
+    @param int points_per_axis: minimal number of points per axis of the sub-grid
+
+    @return tuple: (index_starts, index_strides, index_points) for create_subgrid_pathway. The
+                   strides are the largest powers of 2 which give points_per_axis points, so
+                   that refine_subgrid can halve them down to the full grid.
+    """
+    index_starts, index_strides, index_points = [], [], []
+    for points in axis_points:
+        stride = 1
+        while 2 * stride <= points - 1 and 2 * stride * (points_per_axis - 1) <= points - 1:
+            stride *= 2
+        # centre the sub-grid in the full grid
+        index_starts.append(((points - 1) % stride) // 2)
+        index_strides.append(stride)
+        index_points.append((points - 1) // stride + 1)
+    return index_starts, index_strides, index_points
+
+
+def refine_subgrid(center_index, index_strides, axis_points, points_per_axis):
+    """ Sub-grid of the next round of an adaptive map around the current optimum.
+
+    The strides of the previous round are halved and the sub-grid of points_per_axis points
+    per axis is centred at the optimum, shifted where it would leave the full grid. With 5
+    points per axis it reaches one stride of the previous round to each side.
+
+    @param list center_index: grid index of the current optimum
+    @param list index_strides: strides of the previous round
+    @param list axis_points: number of points of each axis of the full grid
+    @param int points_per_axis: number of points per axis of the sub-grid
+
+    @return tuple: (index_starts, index_strides, index_points) for create_subgrid_pathway
+    """
+    half = points_per_axis // 2
+    index_starts, new_strides, index_points = [], [], []
+    for center, stride, points in zip(center_index, index_strides, axis_points):
+        stride = max(stride // 2, 1)
+        start = max(min(center - half * stride, points - 1 - 2 * half * stride), 0)
+        index_starts.append(start)
+        new_strides.append(stride)
+        index_points.append(min(2 * half + 1, (points - 1 - start) // stride + 1))
+    return index_starts, new_strides, index_points
+
+
+def estimate_pathway_time(pathway, velocities, settle_time=0.0, start_pos=None):
+    """ Estimate the stage time and travel of a pathway.
+
+    All axes are assumed to move at the same time with their constant velocity, so a move takes
+    as long as its slowest axis. Every move is followed by the settle time.
+
+    @param numpy.ndarray pathway: structured pathway array
+    @param list velocities: velocity of each axis, in the order of the pathway axes
+    @param float settle_time: time the stage needs to settle after each move
+    @param dict start_pos: optional, position of the magnet before and after the pathway
+
+    @return dict: 'time': total stage time, 'travel': travel distance per axis,
+                  'moves': number of moves
+    """
+    positions = pathway_positions(pathway)
+    if start_pos is not None:
+        start = np.array([start_pos[name] for name in pathway_axes(pathway)], dtype=float)
+        positions = np.vstack((start, positions, start))
+    steps = np.abs(np.diff(positions, axis=0))
+    times = _move_times(positions, np.asarray(velocities, dtype=float), settle_time)
+    return {'time': float(np.sum(times)),
+            'travel': steps.sum(axis=0),
+            'moves': int(np.count_nonzero(times))}
+
+
+def compare_pathway_strategies(axis_names, axis_starts, axis_steps, axis_points, velocities,
+                               settle_time=0.0, start_pos=None, strategies=PATHWAY_STRATEGIES):
+    """ Estimate the stage time of a grid pathway for several strategies.
+
+    @param list axis_names: names of the magnet axes
+    @param list axis_starts: lowest position of each axis
+    @param list axis_steps: step size of each axis
+    @param list axis_points: number of points of each axis
+    @param list velocities: velocity of each axis
+    @param float settle_time: time the stage needs to settle after each move
+    @param dict start_pos: optional, position of the magnet before and after the pathway
+    @param list strategies: optional, the strategies to compare
+
+    @return OrderedDict: estimate_pathway_time result for each strategy
+    """
+    estimates = OrderedDict()
+    for strategy in strategies:
+        pathway = create_grid_pathway(axis_names, axis_starts, axis_steps, axis_points,
+                                      strategy, velocities, settle_time, start_pos)
+        estimates[strategy] = estimate_pathway_time(pathway, velocities, settle_time, start_pos)
+    return estimates
+
+
+def _move_times(positions, velocities, settle_time):
+    """ Duration of each move between consecutive positions, zero for moves of zero length. """
+    durations = np.max(np.abs(np.diff(positions, axis=0)) / velocities, axis=1)
+    return np.where(durations > 0, durations + settle_time, 0.0)
+
+
+def _grid_order_variants(axis_points, strategy):
+    """ Orders of the flat grid indices for all axis permutations and mirrorings. """
+    ndim = len(axis_points)
+    for axes in itertools.permutations(range(ndim)):
+        shape = tuple(axis_points[axis] for axis in axes)
+        if strategy == 'raster':
+            index_grid = np.indices(shape[::-1]).reshape(ndim, -1).T[:, ::-1]
+        elif strategy == 'serpentine':
+            index_grid = _serpentine_indices(shape)
+        else:
+            index_grid = _hilbert_indices(shape)
+        # back to the original axis order
+        grid_index = np.empty_like(index_grid)
+        grid_index[:, list(axes)] = index_grid
+        for mirror in itertools.product((False, True), repeat=ndim):
+            mirrored = np.where(mirror, np.array(axis_points) - 1 - grid_index, grid_index)
+            yield np.ravel_multi_index(mirrored.T, axis_points)
+
+
+def _serpentine_indices(shape):
+    """ Grid indices of a serpentine (boustrophedon) path, the first axis is the fastest.
+
+    @param tuple shape: number of points per axis
+
+    @return numpy.ndarray: 2D array (number of points, number of axes)
+    """
+    indices = np.arange(shape[0])[:, np.newaxis]
+    for points in shape[1:]:
+        blocks = []
+        for position in range(points):
+            # every other block goes backwards along the path of the faster axes
+            block = indices if position % 2 == 0 else indices[::-1]
+            blocks.append(np.column_stack((block, np.full(len(block), position))))
+        indices = np.vstack(blocks)
+    return indices
+
+
+def _hilbert_indices(shape):
+    """ Grid indices sorted along a Hilbert curve through the enclosing power of 2 cube.
+
+    @param tuple shape: number of points per axis
+
+    @return numpy.ndarray: 2D array (number of points, number of axes)
+    """
+    ndim = len(shape)
+    index_grid = np.indices(shape).reshape(ndim, -1).T
+    bits = max(int(np.ceil(np.log2(max(max(shape), 2)))), 1)
+    return index_grid[np.argsort(_hilbert_keys(index_grid, bits))]
+
+
+def _hilbert_keys(index_grid, bits):
+    """ Distance along the Hilbert curve of grid indices (Skilling's algorithm, vectorized).
+
+    @param numpy.ndarray index_grid: 2D int array (number of points, number of axes)
+    @param int bits: number of bits per axis
+
+    @return numpy.ndarray: the Hilbert distance of each point
+    """
+    x = index_grid.T.astype(np.int64)
+    ndim = x.shape[0]
+    top = 1 << (bits - 1)
+    # inverse undo
+    q = top
+    while q > 1:
+        p = q - 1
+        for i in range(ndim):
+            set_bit = (x[i] & q) != 0
+            x[0] = np.where(set_bit, x[0] ^ p, x[0])
+            t = np.where(set_bit, 0, (x[0] ^ x[i]) & p)
+            x[0] ^= t
+            x[i] ^= t
+        q >>= 1
+    # gray encode
+    for i in range(1, ndim):
+        x[i] ^= x[i - 1]
+    t = np.zeros_like(x[0])
+    q = top
+    while q > 1:
+        t = np.where((x[ndim - 1] & q) != 0, t ^ (q - 1), t)
+        q >>= 1
+    x ^= t
+    # interleave the bits of the transposed representation
+    keys = np.zeros(x.shape[1], dtype=np.int64)
+    for bit in range(bits - 1, -1, -1):
+        for i in range(ndim):
+            keys = (keys << 1) | ((x[i] >> bit) & 1)
+    return keys
+
+
+def _nearest_neighbour_order(positions, velocities, start_pos=None):
+    """ Greedy travelling salesman order: always move to the closest unvisited point in time.
+
+    @param numpy.ndarray positions: 2D array (number of points, number of axes)
+    @param numpy.ndarray velocities: velocity of each axis
+    @param numpy.ndarray start_pos: optional, position before the first point
+
+    @return numpy.ndarray: the order of the points
+    """
+    # in units of time, a move takes as long as its slowest axis
+    scaled = positions / velocities
+    current = scaled[0] if start_pos is None else start_pos / velocities
+    remaining = np.ones(len(scaled), dtype=bool)
+    order = np.empty(len(scaled), dtype=np.int64)
+    costs = np.empty(len(scaled))
+    for step in range(len(scaled)):
+        np.max(np.abs(scaled - current), axis=1, out=costs)
+        costs[~remaining] = np.inf
+        point = int(np.argmin(costs))
+        order[step] = point
+        remaining[point] = False
+        current = scaled[point]
+    return order
@@ -961,21 +961,21 @@ class NuclearOperationsLogic(GenericLogic):
         param['Elapsed Time (s)'] = self.elapsed_time
         param['Start of measurement'] = self.start_time.strftime('%Y-%m-%d %H:%M:%S')
 
-        self._save_logic.save_data(data1,
-                                   filepath=filepath,
-                                   parameters=param,
-                                   filelabel=filelabel1,
-                                   timestamp=timestamp)
-
-        self._save_logic.save_data(data2,
-                                   filepath=filepath,
-                                   filelabel=filelabel2,
-                                   timestamp=timestamp)
-
-        self._save_logic.save_data(data4,
-                                   filepath=filepath,
-                                   filelabel=filelabel4,
-                                   timestamp=timestamp)
+        self._save_logic.save_data_async(data1,
+                                         filepath=filepath,
+                                         parameters=param,
+                                         filelabel=filelabel1,
+                                         timestamp=timestamp)
+
+        self._save_logic.save_data_async(data2,
+                                         filepath=filepath,
+                                         filelabel=filelabel2,
+                                         timestamp=timestamp)
+
+        self._save_logic.save_data_async(data4,
+                                         filepath=filepath,
+                                         filelabel=filelabel4,
+                                         timestamp=timestamp)
 
         # self._save_logic.save_data(data3,
         #                            filepath=filepath,
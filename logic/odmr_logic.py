@@ -31,6 +31,7 @@ import matplotlib.pyplot as plt
 import lmfit
 
 from logic.generic_logic import GenericLogic
+from core.util.append_buffer import AppendBuffer
 from core.util.mutex import Mutex
 from core.module import Connector, ConfigOption, StatusVar
 
@@ -53,6 +54,10 @@ class ODMRLogic(GenericLogic):
                     'LIST',
                     missing='warn',
                     converter=lambda x: MicrowaveMode[x.upper()])
+    # max. memory used by the recorded sweeps before they are moved to a temporary
+    # memory-mapped file (in raw_data_spill_dir or the system temp dir)
+    _raw_data_spill_bytes = ConfigOption('raw_data_spill_bytes', 256 * 2**20)
+    _raw_data_spill_dir = ConfigOption('raw_data_spill_dir', None)
 
     clock_frequency = StatusVar('clock_frequency', 200)
     cw_mw_frequency = StatusVar('cw_mw_frequency', 2870e6)
@@ -118,8 +123,8 @@ class ODMRLogic(GenericLogic):
 
         # Initalize the ODMR data arrays (mean signal and sweep matrix)
         self._initialize_odmr_plots()
-        # Raw data array
-        self.odmr_raw_data = np.zeros([self.number_of_lines, self.odmr_plot_x.size])
+        # Raw data of all sweeps
+        self._odmr_sweeps = self._create_sweep_buffer(self.number_of_lines)
 
         # Switch off microwave and set CW frequency and power
         self.mw_off()
@@ -148,6 +153,38 @@ class ODMRLogic(GenericLogic):
         self._mw_device.off()
         # Disconnect signals
         self.sigNextLine.disconnect()
+        self._odmr_sweeps.clear()
+
+    @property
+    def odmr_raw_data(self):
+        """ The count data of all sweeps since the start of the measurement.
+
+        @return numpy.ndarray: read-only 2D array (sweeps, frequencies), latest sweep first
+        """
+        return self._odmr_sweeps.get_data()[::-1]
+
+    def _create_sweep_buffer(self, chunk_rows):
+        """ Create an empty buffer for the count data of the sweeps.
+
+        @param int chunk_rows: number of sweeps allocated at once
+
+        @return AppendBuffer: buffer with one row per sweep
+        """
+        return AppendBuffer(self.odmr_plot_x.size, chunk_rows=chunk_rows,
+                            spill_bytes=self._raw_data_spill_bytes,
+                            spill_dir=self._raw_data_spill_dir)
+
+    def _get_latest_sweeps(self):
+        """ The matrix of the latest number_of_lines sweeps. The effort does not depend on the
+        number of sweeps recorded so far.
+
+        @return numpy.ndarray: 2D array (number_of_lines, frequencies), latest sweep first. Rows
+                               without a sweep yet are zero.
+        """
+        latest_sweeps = self._odmr_sweeps.latest(self.number_of_lines)
+        matrix = np.zeros([self.number_of_lines, self.odmr_plot_x.size])
+        matrix[:latest_sweeps.shape[0]] = latest_sweeps[::-1]
+        return matrix
 
     @fc.constructor
     def sv_set_fits(self, val):
@@ -495,14 +532,15 @@ class ODMRLogic(GenericLogic):
                 return -1
 
             self._initialize_odmr_plots()
-            # initialize raw_data array
+            # initialize the raw data buffer, it grows by chunks of the estimated number of lines
             estimated_number_of_lines = self.run_time * self.clock_frequency / self.odmr_plot_x.size
             estimated_number_of_lines = int(1.5 * estimated_number_of_lines)  # Safety
-            if estimated_number_of_lines < self.number_of_lines:
-                estimated_number_of_lines = self.number_of_lines
-            self.log.debug('Estimated number of raw data lines: {0:d}'
+            estimated_number_of_lines = min(max(estimated_number_of_lines, self.number_of_lines),
+                                            10000)
+            self.log.debug('Raw data lines allocated at once: {0:d}'
                            ''.format(estimated_number_of_lines))
-            self.odmr_raw_data = np.zeros([estimated_number_of_lines, self.odmr_plot_x.size])
+            self._odmr_sweeps.clear()
+            self._odmr_sweeps = self._create_sweep_buffer(estimated_number_of_lines)
             self.sigNextLine.emit()
             return 0
 
@@ -592,37 +630,20 @@ class ODMRLogic(GenericLogic):
                 self.sigNextLine.emit()
                 return
 
-            # Add new count data to mean signal
+            # Add new count data to the running mean signal
             if self._clearOdmrData:
-                self.odmr_plot_y[:] = 0
-            self.odmr_plot_y = (self.elapsed_sweeps * self.odmr_plot_y + new_counts) / (
+                self.odmr_plot_y = np.zeros(self.odmr_plot_x.size)
+            self.odmr_plot_y = self.odmr_plot_y + (new_counts - self.odmr_plot_y) / (
                 self.elapsed_sweeps + 1)
 
-            # Add new count data to raw_data array and append if array is too small
+            # Append new count data to the raw data, old sweeps are never moved
             if self._clearOdmrData:
-                self.odmr_raw_data[:, :] = 0
+                self._odmr_sweeps.clear()
                 self._clearOdmrData = False
-            if self.elapsed_sweeps == (self.odmr_raw_data.shape[0] - 1):
-                expanded_array = np.zeros([self.odmr_raw_data.shape[0] + self.number_of_lines,
-                                           self.odmr_raw_data.shape[1]])
-                expanded_array[:self.elapsed_sweeps, :] = self.odmr_raw_data[
-                                                          :self.elapsed_sweeps, :]
-                self.odmr_raw_data = expanded_array
-                self.log.warning('raw data array in ODMRLogic was not big enough for the entire '
-                                 'measurement. Array will be expanded.\nOld array shape was '
-                                 '({0:d}, {1:d}), new shape is ({2:d}, {3:d}).'
-                                 ''.format(self.odmr_raw_data.shape[0]-self.number_of_lines,
-                                           self.odmr_raw_data.shape[1],
-                                           self.odmr_raw_data.shape[0],
-                                           self.odmr_raw_data.shape[1]))
-
-            # shift data in the array "up" and add new data at the "bottom"
-            self.odmr_raw_data[1:self.elapsed_sweeps + 1, :] = self.odmr_raw_data[
-                                                               :self.elapsed_sweeps, :]
-            self.odmr_raw_data[0, :] = new_counts
-
-            # Set plot slice of matrix
-            self.odmr_plot_xy = self.odmr_raw_data[:self.number_of_lines, :]
+            self._odmr_sweeps.append(new_counts)
+
+            # Set plot matrix of the latest sweeps
+            self.odmr_plot_xy = self._get_latest_sweeps()
 
             # Update elapsed time/sweeps
             self.elapsed_sweeps += 1
@@ -699,7 +720,7 @@ class ODMRLogic(GenericLogic):
         data2 = OrderedDict()
         data['frequency (Hz)'] = self.odmr_plot_x
         data['count data (counts/s)'] = self.odmr_plot_y
-        data2['count data (counts/s)'] = self.odmr_raw_data[:self.elapsed_sweeps, :]
+        data2['count data (counts/s)'] = self.odmr_raw_data
 
         parameters = OrderedDict()
         parameters['Microwave CW Power (dBm)'] = self.cw_mw_power
@@ -51,6 +51,7 @@ class PulseAnalysisLogic(GenericLogic):
         """
 
         self.analysis_methods = OrderedDict()
+        self.window_sum_methods = OrderedDict()
         filename_list = []
         # The assumption is that in the directory pulsed_analysis_methods, there are
         # *.py files, which contain only methods!
@@ -71,6 +72,9 @@ class PulseAnalysisLogic(GenericLogic):
                         # Add method to dictionary if it is a generator method
                         if method.startswith('analyse_'):
                             self.analysis_methods[method[8:]] = eval('self.' + method)
+                        # Add method to dictionary if it analyses precomputed window sums
+                        elif method.startswith('sums_'):
+                            self.window_sum_methods[method[5:]] = eval('self.' + method)
                 except:
                     self.log.error('It was not possible to import element {0} from {1} into '
                                    'PulseAnalysisLogic.'.format(method, filename))
@@ -89,12 +93,45 @@ class PulseAnalysisLogic(GenericLogic):
         @return: float array signal_data: Array with the computed signal
         @return: float array measuring_error: Array with the computed signal error
         """
-#
-        # convert time to bin
+        self._update_window_bins()
+        signal_data, measuring_error = self.analysis_methods[self.analysis_settings['current_method']](laser_data)
+        return signal_data, measuring_error
+
+    def analyze_window_sums(self, window_sums):
+        """ Same as analyze_data but based on the per-laser counts in the analysis windows.
+
+        @param dict window_sums: per-laser counts in the signal and normalization windows and the
+                                 window widths in bins (keys: 'signal_sum', 'signal_width',
+                                 'norm_sum', 'norm_width')
+
+        @return: float array signal_data: Array with the computed signal
+        @return: float array measuring_error: Array with the computed signal error
+        """
+        self._update_window_bins()
+        signal_data, measuring_error = self.window_sum_methods[self.analysis_settings['current_method']](window_sums)
+        return signal_data, measuring_error
+
+    def has_window_sum_method(self):
+        """ Check if the current analysis method can be computed from window sums alone.
+
+        @return bool: True if analyze_window_sums can be used for the current method
+        """
+        return self.analysis_settings['current_method'] in self.window_sum_methods
+
+    def get_window_bins(self):
+        """ Get the signal and normalization windows in units of fast counter bins.
+
+        @return dict: (start_bin, end_bin) tuples for the keys 'signal' and 'norm'
+        """
+        self._update_window_bins()
+        return {'signal': (self.signal_start_bin, self.signal_end_bin),
+                'norm': (self.norm_start_bin, self.norm_end_bin)}
+
+    def _update_window_bins(self):
+        """ Convert the analysis windows from seconds to fast counter bins.
+        """
         self.signal_start_bin = round(self.analysis_settings['signal_start_s'] / self.fast_counter_binwidth)
         self.signal_end_bin = round(self.analysis_settings['signal_end_s'] / self.fast_counter_binwidth)
         self.norm_start_bin = round(self.analysis_settings['norm_start_s'] / self.fast_counter_binwidth)
         self.norm_end_bin = round(self.analysis_settings['norm_end_s'] / self.fast_counter_binwidth)
-
-        signal_data, measuring_error = self.analysis_methods[self.analysis_settings['current_method']](laser_data)
-        return signal_data, measuring_error
+        return
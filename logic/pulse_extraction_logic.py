@@ -25,7 +25,7 @@ import inspect
 import numpy as np
 
 from collections import OrderedDict
-from core.module import StatusVar
+from core.module import ConfigOption, StatusVar
 from core.util.modules import get_main_dir
 from logic.generic_logic import GenericLogic
 
@@ -37,6 +37,10 @@ class PulseExtractionLogic(GenericLogic):
     _modclass = 'PulseExtractionLogic'
     _modtype = 'logic'
 
+    # max. median deviation of the laser edges from the cached positions before the edges are
+    # detected again by the extraction method "cached_conv_deriv"
+    _edge_drift_tolerance = ConfigOption('edge_drift_tolerance_bins', 5)
+
     extraction_settings = StatusVar('extraction_settings', default={'conv_std_dev': 10.0,
                                                                     'count_threshold': 10,
                                                                     'threshold_tolerance_bins': 20,
@@ -52,6 +56,13 @@ class PulseExtractionLogic(GenericLogic):
             self.log.debug('{0}: {1}'.format(key, config[key]))
 
         self.number_of_lasers = 50
+        # expected (rising, falling) edge indices of the laser pulses in the timetrace
+        self.expected_laser_edges = None
+        # edge positions and gather indices of the last detection (cached_conv_deriv)
+        self._laser_edge_cache = None
+        self.laser_edge_detections = 0
+        # laser array reused by the ungated extraction methods as long as its shape is unchanged
+        self._laser_buffer = None
 
     def on_activate(self):
         """ Initialisation performed during activation of the module.
@@ -93,6 +104,33 @@ class PulseExtractionLogic(GenericLogic):
         """
         return
 
+    def set_expected_laser_edges(self, rising_bins, falling_bins):
+        """ Set the positions of the laser pulses in the timetrace as expected from the loaded
+        pulse sequence. The extraction method "cached_conv_deriv" only searches for the edges
+        around these positions (up to a common shift of all pulses).
+
+        @param numpy.ndarray rising_bins: expected timetrace indices of the rising laser edges.
+                                          None to search the whole timetrace.
+        @param numpy.ndarray falling_bins: expected timetrace indices of the falling laser edges
+        """
+        if rising_bins is None or falling_bins is None:
+            self.expected_laser_edges = None
+        elif len(rising_bins) != len(falling_bins):
+            self.log.error('Number of expected rising ({0:d}) and falling ({1:d}) laser edges '
+                           'does not match.'.format(len(rising_bins), len(falling_bins)))
+            self.expected_laser_edges = None
+        else:
+            self.expected_laser_edges = (np.sort(np.asarray(rising_bins, dtype=int)),
+                                         np.sort(np.asarray(falling_bins, dtype=int)))
+        self.clear_laser_edge_cache()
+        return
+
+    def clear_laser_edge_cache(self):
+        """ Discard the cached laser edges. The next extraction detects them again.
+        """
+        self._laser_edge_cache = None
+        return
+
     def extract_laser_pulses(self, count_data, is_gated=False):
         """
 
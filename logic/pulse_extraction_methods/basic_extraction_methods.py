@@ -32,13 +32,14 @@ def gated_conv_deriv(self, count_data):
     if len(conv_deriv.nonzero()[0]) == 0:
         laser_arr = np.zeros(count_data.shape, dtype=int)
     else:
-        # slice the data array to cut off anything but laser pulses
-        laser_arr = count_data[:, rising_ind:falling_ind]
+        # slice the data array to cut off anything but laser pulses. This is a read-only view
+        # into the raw data, no counts are copied.
+        laser_arr = _read_only_view(_as_int_counts(count_data)[:, rising_ind:falling_ind])
 
     # Create return dictionary
     return_dict = dict()
 
-    return_dict['laser_counts_arr'] = laser_arr.astype(int)
+    return_dict['laser_counts_arr'] = laser_arr
     return_dict['laser_indices_rising'] = rising_ind
     return_dict['laser_indices_falling'] = falling_ind
 
@@ -189,25 +190,353 @@ def ungated_conv_deriv(self, count_data):
     #self.histo = np.histogram(diff)
     #laser_length = int(self.histo[1][self.histo[0].argmax()])
 
-    # initialize the empty output array
-    laser_arr = np.zeros([self.number_of_lasers, laser_length], dtype=int)
-    # slice the detected laser pulses of the timetrace and save them in the
-    # output array according to the found rising edge
-    for i in range(self.number_of_lasers):
-        if (rising_ind[i] + laser_length > count_data.size):
-            lenarr = count_data[rising_ind[i]:].size
-            laser_arr[i, 0:lenarr] = count_data[rising_ind[i]:]
-        else:
-            laser_arr[i] = count_data[rising_ind[i]:rising_ind[i] + laser_length]
+    # slice the detected laser pulses of the timetrace according to the found rising edges
+    gather_indices, padding_mask = _laser_gather_indices(count_data.size, rising_ind,
+                                                         laser_length)
 
     # Create return dictionary
     return_dict = dict()
-    return_dict['laser_counts_arr'] = laser_arr.astype(int)
+    return_dict['laser_counts_arr'] = self._gather_laser_pulses(count_data, gather_indices,
+                                                                padding_mask)
     return_dict['laser_indices_rising'] = rising_ind
     return_dict['laser_indices_falling'] = falling_ind
+    # number of bins of each laser pulse taken from the timetrace (the rest is zero padding)
+    return_dict['laser_lengths'] = np.minimum(laser_length, count_data.size - rising_ind)
     return return_dict
 
 
+def ungated_cached_conv_deriv(self, count_data):
+    """ Detects the laser pulses in the ungated timetrace data and extracts them. The edges are
+    detected in the same way as in ungated_conv_deriv but all of them in one vectorized pass.
+
+    @param numpy.ndarray count_data:    1D array the raw timetrace data from an ungated fast counter
+
+    @return dict:   The extracted laser pulses of the timetrace as well as the indices for rising
+                    and falling flanks.
+
+    Procedure:
+        Edge Detection:
+        ---------------
+
+        The convolved and derived timetrace is compared to a fraction of its maximum (minimum).
+        Each connected region above the threshold is a candidate for a rising (falling) edge and
+        the strongest number_of_lasers regions are kept. The edge positions are refined with the
+        derivative of a slightly smoothed timetrace within +-conv_std_dev, like in
+        ungated_conv_deriv.
+
+        If the expected edge positions of the loaded PulseBlockEnsemble are known (see
+        PulseExtractionLogic.set_expected_laser_edges) the whole expected laser pattern is shifted
+        onto the timetrace by cross-correlation and each edge is only refined locally.
+
+        The detected edges are cached. As long as the edges found in a small window around the
+        cached positions do not deviate by more than edge_drift_tolerance_bins, the extraction
+        only gathers the laser pulses from the timetrace with a single fancy-index operation.
+    """
+    if 'conv_std_dev' not in self.extraction_settings:
+        self.log.error('Pulse extraction method "ungated_cached_conv_deriv" will not work. No '
+                       'conv_std_dev defined in class PulseExtractionLogic.')
+        return _empty_extraction(1)
+    if self.number_of_lasers is None:
+        self.log.error('Pulse extraction method "ungated_cached_conv_deriv" will not work. No '
+                       'number_of_lasers defined in class PulseExtractionLogic.')
+        return _empty_extraction(1)
+
+    std_dev = self.extraction_settings['conv_std_dev']
+    cache = self._laser_edge_cache
+    if (cache is None or cache['size'] != count_data.size
+            or cache['number_of_lasers'] != self.number_of_lasers
+            or cache['conv_std_dev'] != std_dev
+            or _laser_edges_drifted(count_data, cache['rising'], cache['falling'],
+                                    self._edge_drift_tolerance)):
+        rising_ind, falling_ind = self._detect_laser_edges(count_data, std_dev)
+        if rising_ind is None:
+            self._laser_edge_cache = None
+            return _empty_extraction(self.number_of_lasers)
+        cache = _create_laser_edge_cache(count_data.size, rising_ind, falling_ind)
+        cache['number_of_lasers'] = self.number_of_lasers
+        cache['conv_std_dev'] = std_dev
+        self._laser_edge_cache = cache
+        self.laser_edge_detections += 1
+
+    return_dict = dict()
+    return_dict['laser_counts_arr'] = self._gather_laser_pulses(
+        count_data, cache['gather_indices'], cache['padding_mask'])
+    return_dict['laser_indices_rising'] = cache['rising'].copy()
+    return_dict['laser_indices_falling'] = cache['falling'].copy()
+    # number of bins of each laser pulse taken from the timetrace (the rest is zero padding)
+    return_dict['laser_lengths'] = cache['laser_lengths'].copy()
+    return return_dict
+
+
+def _detect_laser_edges(self, count_data, std_dev):
+    """ Finds the rising and falling edges of all laser pulses in an ungated timetrace.
+
+    @param numpy.ndarray count_data: 1D array, the raw timetrace data
+    @param float std_dev: standard deviation of the gaussian filter used for the edge detection
+
+    @return numpy.ndarray, numpy.ndarray: sorted indices of the rising and falling edges.
+                                          (None, None) if the detection failed.
+    """
+    count_data = count_data.astype(float)
+    conv_deriv = self._convolve_derive(count_data, std_dev)
+    # if gaussian smoothing or derivative failed, the returned array only contains zeros.
+    if not conv_deriv.any():
+        return None, None
+    # the exact position of the inflection points is distorted by a large conv_std_dev value
+    conv_deriv_ref = self._convolve_derive(count_data, 10)
+    half_width = max(int(std_dev), 1)
+
+    expected = self.expected_laser_edges
+    if expected is not None and expected[0].size == self.number_of_lasers:
+        # shift the expected pulse pattern onto the timetrace and search the edges around it
+        shift = _pattern_shift(conv_deriv, expected[0], expected[1], half_width)
+        rising_ind = np.clip(expected[0] + shift, 0, count_data.size - 1)
+        falling_ind = np.clip(expected[1] + shift, 0, count_data.size - 1)
+        rising_ind = _refine_edges(conv_deriv, rising_ind, 2 * half_width, True)
+        falling_ind = _refine_edges(conv_deriv, falling_ind, 2 * half_width, False)
+    else:
+        if expected is not None:
+            self.log.warning('Number of expected laser pulses ({0:d}) does not match the number '
+                             'of lasers ({1:d}). Searching the whole timetrace instead.'
+                             ''.format(expected[0].size, self.number_of_lasers))
+        rising_ind = _find_edge_peaks(conv_deriv, self.number_of_lasers, 2 * std_dev)
+        falling_ind = _find_edge_peaks(-conv_deriv, self.number_of_lasers, 2 * std_dev)
+        if rising_ind is None or falling_ind is None:
+            self.log.warning('Pulse extraction method "ungated_cached_conv_deriv" failed. Less '
+                             'than {0:d} laser pulses found in the timetrace.'
+                             ''.format(self.number_of_lasers))
+            return None, None
+
+    rising_ind = _refine_edges(conv_deriv_ref, rising_ind, half_width, True)
+    falling_ind = _refine_edges(conv_deriv_ref, falling_ind, half_width, False)
+    rising_ind.sort()
+    falling_ind.sort()
+    return rising_ind, falling_ind
+
+
+def _empty_extraction(number_of_lasers):
+    """ Return dictionary of a failed extraction, containing only zeros.
+
+    @param int number_of_lasers: number of laser pulses to return
+
+    @return dict: zero laser array and zero edge indices
+    """
+    return_dict = dict()
+    return_dict['laser_counts_arr'] = np.zeros([number_of_lasers, 10], dtype=int)
+    return_dict['laser_indices_rising'] = np.zeros(number_of_lasers, dtype=int)
+    return_dict['laser_indices_falling'] = np.zeros(number_of_lasers, dtype=int)
+    return_dict['laser_lengths'] = np.zeros(number_of_lasers, dtype=int)
+    return return_dict
+
+
+def _find_edge_peaks(values, number_of_peaks, min_distance):
+    """ Finds the number_of_peaks strongest separate maxima of values in one vectorized pass.
+
+    All bins above a fraction of the global maximum are grouped into regions (gaps shorter than
+    min_distance are bridged) and the maximum of each region is taken. The fraction is lowered
+    until enough regions are found.
+
+    @param numpy.ndarray values: 1D array to search the maxima in
+    @param int number_of_peaks: number of maxima to find
+    @param float min_distance: min. distance of two maxima in bins
+
+    @return numpy.ndarray: sorted indices of the maxima, None if not enough maxima were found
+    """
+    maximum = values.max()
+    if maximum <= 0:
+        return None
+    for fraction in (0.5, 0.25, 0.1):
+        above = np.flatnonzero(values > fraction * maximum)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(above) > min_distance) + 1))
+        if starts.size >= number_of_peaks:
+            break
+    else:
+        return None
+
+    above_values = values[above]
+    region_max = np.maximum.reduceat(above_values, starts)
+    region_index = np.repeat(np.arange(starts.size), np.diff(np.append(starts, above.size)))
+    is_max = above_values == region_max[region_index]
+    # first bin of each region reaching the maximum of that region
+    _, first_max = np.unique(region_index[is_max], return_index=True)
+    peaks = above[is_max][first_max]
+    if peaks.size > number_of_peaks:
+        strongest = np.argsort(region_max, kind='mergesort')[::-1][:number_of_peaks]
+        peaks = peaks[strongest]
+    return np.sort(peaks)
+
+
+def _refine_edges(values, edges, half_width, find_max):
+    """ Moves each edge to the extremum of values within [edge-half_width, edge+half_width).
+
+    @param numpy.ndarray values: 1D array, the derived timetrace
+    @param numpy.ndarray edges: 1D int array with the edge indices
+    @param int half_width: half width of the search window in bins
+    @param bool find_max: search the maximum (rising edges) or the minimum (falling edges)
+
+    @return numpy.ndarray: the refined edge indices
+    """
+    windows = np.clip(edges[:, np.newaxis] + np.arange(-half_width, half_width), 0,
+                      values.size - 1)
+    if find_max:
+        window_ind = np.argmax(values[windows], axis=1)
+    else:
+        window_ind = np.argmin(values[windows], axis=1)
+    return windows[np.arange(edges.size), window_ind]
+
+
+def _pattern_shift(conv_deriv, rising_ind, falling_ind, resolution=1):
+    """ Finds the shift of the expected edges that matches the derived timetrace best. The
+    cross-correlation is computed for all shifts at once with FFTs.
+
+    @param numpy.ndarray conv_deriv: 1D array, the convolved and derived timetrace
+    @param numpy.ndarray rising_ind: expected indices of the rising edges
+    @param numpy.ndarray falling_ind: expected indices of the falling edges
+    @param int resolution: number of bins combined for the correlation (the shift is only
+                           determined to this resolution)
+
+    @return int: shift in bins to add to the expected edges
+    """
+    resolution = max(int(resolution), 1)
+    size = conv_deriv.size // resolution
+    if size < 1:
+        return 0
+    binned = conv_deriv[:size * resolution].reshape(size, resolution).sum(axis=1)
+    pattern = np.zeros(size, dtype=float)
+    np.add.at(pattern, np.clip(rising_ind // resolution, 0, size - 1), 1.0)
+    np.add.at(pattern, np.clip(falling_ind // resolution, 0, size - 1), -1.0)
+    # zero padding avoids the wrap around, otherwise shifts by a multiple of the pulse period
+    # would match a periodic pattern equally well
+    correlation = np.fft.irfft(np.fft.rfft(binned, n=2 * size)
+                               * np.conj(np.fft.rfft(pattern, n=2 * size)), n=2 * size)
+    shift = int(np.argmax(correlation))
+    if shift >= size:
+        shift -= 2 * size
+    return shift * resolution
+
+
+def _laser_edges_drifted(count_data, rising_ind, falling_ind, tolerance):
+    """ Checks whether the laser edges have moved away from the given positions. Only windows
+    around the given edges are smoothed and derived, not the whole timetrace.
+
+    @param numpy.ndarray count_data: 1D array, the raw timetrace data
+    @param numpy.ndarray rising_ind: cached indices of the rising edges
+    @param numpy.ndarray falling_ind: cached indices of the falling edges
+    @param int tolerance: max. median deviation of the edges in bins
+
+    @return bool: True if the edges have to be detected again
+    """
+    # margin for the gaussian filter (standard deviation of 10 bins) and the search window
+    margin = 40
+    search_width = int(tolerance) + 1
+    half_width = margin + search_width
+    edges = np.concatenate((rising_ind, falling_ind))
+    windows = np.clip(edges[:, np.newaxis] + np.arange(-half_width, half_width + 1), 0,
+                      count_data.size - 1)
+    conv_deriv = np.gradient(
+        ndimage.gaussian_filter1d(count_data[windows].astype(float), 10, axis=1), axis=1)
+    if not conv_deriv.any():
+        return False
+    search = conv_deriv[:, margin:margin + 2 * search_width + 1]
+    deviation = np.empty(edges.size, dtype=int)
+    deviation[:rising_ind.size] = np.argmax(search[:rising_ind.size], axis=1)
+    deviation[rising_ind.size:] = np.argmin(search[rising_ind.size:], axis=1)
+    deviation -= search_width
+    return np.median(np.abs(deviation)) > tolerance
+
+
+def _create_laser_edge_cache(size, rising_ind, falling_ind):
+    """ Precomputes the indices to slice all laser pulses out of a timetrace at once.
+
+    @param int size: number of bins in the timetrace
+    @param numpy.ndarray rising_ind: sorted indices of the rising edges
+    @param numpy.ndarray falling_ind: sorted indices of the falling edges
+
+    @return dict: the edges, the laser lengths, the index array for the gather and the mask of
+                  the bins beyond the end of the timetrace
+    """
+    # find the maximum laser length to use as size for the laser array
+    laser_length = max(int(np.max(falling_ind - rising_ind)), 1)
+    cache = dict()
+    cache['size'] = size
+    cache['rising'] = rising_ind
+    cache['falling'] = falling_ind
+    cache['laser_lengths'] = np.minimum(laser_length, size - rising_ind)
+    cache['gather_indices'], cache['padding_mask'] = _laser_gather_indices(size, rising_ind,
+                                                                           laser_length)
+    return cache
+
+
+def _laser_gather_indices(size, rising_ind, laser_length, laser_lengths=None):
+    """ Index array to slice all laser pulses out of a timetrace with a single gather.
+
+    @param int size: number of bins in the timetrace
+    @param numpy.ndarray rising_ind: indices of the rising edges
+    @param int laser_length: number of bins in the laser array
+    @param numpy.ndarray laser_lengths: optional, number of bins to take for each laser pulse.
+                                        The rest of each row is zero padding.
+
+    @return numpy.ndarray, numpy.ndarray: the (clipped) timetrace indices for each bin of the
+                                          laser array and the mask of the bins to set to zero
+                                          (None if there are none)
+    """
+    gather_indices = rising_ind[:, np.newaxis] + np.arange(laser_length)
+    padding_mask = gather_indices >= size
+    if laser_lengths is not None:
+        padding_mask |= np.arange(laser_length) >= laser_lengths[:, np.newaxis]
+    gather_indices[gather_indices >= size] = size - 1
+    if not padding_mask.any():
+        padding_mask = None
+    return gather_indices, padding_mask
+
+
+def _gather_laser_pulses(self, count_data, gather_indices, padding_mask):
+    """ Gathers the laser pulses out of the timetrace into a buffer that is kept as long as the
+    shape of the laser array and the data type do not change.
+
+    @param numpy.ndarray count_data: 1D array, the raw timetrace data
+    @param numpy.ndarray gather_indices: 2D array with the timetrace index of each laser bin
+    @param numpy.ndarray padding_mask: 2D bool array of the laser bins to set to zero or None
+
+    @return numpy.ndarray: read-only view of the laser array. It is overwritten by the next
+                           extraction with the same shape.
+    """
+    count_data = _as_int_counts(count_data)
+    buffer = self._laser_buffer
+    if (buffer is None or buffer.shape != gather_indices.shape
+            or buffer.dtype != count_data.dtype):
+        buffer = np.empty(gather_indices.shape, dtype=count_data.dtype)
+        self._laser_buffer = buffer
+    np.take(count_data, gather_indices, out=buffer, mode='clip')
+    if padding_mask is not None:
+        buffer[padding_mask] = 0
+    return _read_only_view(buffer)
+
+
+def _as_int_counts(count_data):
+    """ Converts count data to int, unless it already has an integer type.
+
+    @param numpy.ndarray count_data: the raw data
+
+    @return numpy.ndarray: count_data itself or an int copy of it
+    """
+    if count_data.dtype.kind in 'iu':
+        return count_data
+    return count_data.astype(int)
+
+
+def _read_only_view(array):
+    """ Returns a view of the array that can not be written to.
+
+    @param numpy.ndarray array: the array to view
+
+    @return numpy.ndarray: read-only view sharing the memory of array
+    """
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
 def ungated_threshold(self, count_data):
     """
     Detects the laser pulses in the ungated timetrace data and extracts them.
@@ -269,14 +598,19 @@ def ungated_threshold(self, count_data):
                          ''.format(len(consecutive_indices), self.number_of_lasers))
         return return_dict
 
-    # determine max length of laser pulse and initialize laser array
-    max_laser_length = max([index_array.size for index_array in consecutive_indices])
-    return_dict['laser_counts_arr'] = np.zeros([self.number_of_lasers, max_laser_length], dtype=int)
-    # fill laser array with slices of raw data array. Also populate the rising/falling index arrays
+    # populate the rising/falling index arrays
     for i, index_group in enumerate(consecutive_indices):
         return_dict['laser_indices_rising'][i] = index_group[0]
         return_dict['laser_indices_falling'][i] = index_group[-1]
-        return_dict['laser_counts_arr'][i, :index_group.size] = count_data[index_group]
+    # number of bins of each laser pulse taken from the timetrace (the rest is zero padding)
+    return_dict['laser_lengths'] = (return_dict['laser_indices_falling']
+                                    - return_dict['laser_indices_rising'] + 1)
+    # slice the laser pulses out of the raw data array, padded to the max. laser length
+    gather_indices, padding_mask = _laser_gather_indices(
+        count_data.size, return_dict['laser_indices_rising'],
+        int(np.max(return_dict['laser_lengths'])), return_dict['laser_lengths'])
+    return_dict['laser_counts_arr'] = self._gather_laser_pulses(count_data, gather_indices,
+                                                                padding_mask)
 
     return return_dict
 
@@ -2,78 +2,137 @@ import numpy as np
 
 
 def analyse_mean_norm(self, laser_data):
-    """
+    """ Computes the mean signal of each laser pulse normalized to the mean of the reference
+    window. The whole 2D laser array is processed at once.
+
+    @param numpy.ndarray laser_data: 2D array containing the extracted laser counts,
+                                     dimensions: 0: laser number, 1: time bin
 
-    @param laser_data:
-    @return:
+    @return numpy.ndarray, numpy.ndarray: the normalized signal and the measuring error
+                                          (gaussian error propagation of the shot noise)
     """
-    num_of_lasers = laser_data.shape[0]
-
-    # Initialize the signal and normalization mean data arrays
-    reference_mean = np.zeros(num_of_lasers, dtype=float)
-    signal_mean = np.zeros(num_of_lasers, dtype=float)
-    signal_area = np.zeros(num_of_lasers, dtype=float)
-    reference_area = np.zeros(num_of_lasers, dtype=float)
-    measuring_error = np.zeros(num_of_lasers, dtype=float)
-    # initialize data arrays
-    signal_data = np.empty(num_of_lasers, dtype=float)
-
-    # loop over all laser pulses and analyze them
-    for ii in range(num_of_lasers):
-        # calculate the mean of the data in the normalization window
-        norm_tmp_data = laser_data[ii][self.norm_start_bin:self.norm_end_bin]
-        if np.sum(norm_tmp_data) < 1:
-            reference_mean[ii] = 0.0
-        else:
-            reference_mean[ii] = norm_tmp_data.mean()
-        # calculate the mean of the data in the signal window
-        signal_tmp_data = laser_data[ii][self.signal_start_bin:self.signal_end_bin]
-        if np.sum(signal_tmp_data) < 1:
-            signal_mean[ii] = 0.0
-        else:
-            signal_mean[ii] = signal_tmp_data.mean() - reference_mean[ii]
-        # update the signal plot y-data
-        if reference_mean[ii] == 0.0:
-            signal_data[ii] = 0.0
-        else:
-            signal_data[ii] = 1. + (signal_mean[ii] / reference_mean[ii])
-
-    # Compute the measuring error
-    for jj in range(num_of_lasers):
-        signal_area[jj] = laser_data[jj][self.signal_start_bin:self.signal_end_bin].sum()
-        reference_area[jj] = laser_data[jj][self.norm_start_bin:self.norm_end_bin].sum()
-        if reference_area[jj] == 0.:
-            measuring_error[jj] = 0.
-        elif signal_area[jj] == 0.:
-            measuring_error[jj] = 0.
-        else:
-            # with respect to gaußian error 'evolution'
-            measuring_error[jj] = signal_data[jj] * np.sqrt(
-                1 / signal_area[jj] + 1 / reference_area[jj])
-    return signal_data, measuring_error
+    return sums_mean_norm(self, _laser_window_sums(self, laser_data))
 
 
 def analyse_mean(self, laser_data):
+    """ Computes the mean signal of each laser pulse in the signal window. The whole 2D laser
+    array is processed at once.
+
+    @param numpy.ndarray laser_data: 2D array containing the extracted laser counts,
+                                     dimensions: 0: laser number, 1: time bin
+
+    @return numpy.ndarray, numpy.ndarray: the mean signal and the measuring error
+                                          (shot noise of the signal window)
+    """
+    return sums_mean(self, _laser_window_sums(self, laser_data))
+
+
+def sums_mean_norm(self, window_sums):
+    """ Same as analyse_mean_norm but based on precomputed window sums of all laser pulses.
+    Used by the incremental analysis of PulsedMeasurementLogic.
+
+    @param dict window_sums: per-laser counts in the signal and normalization windows and the
+                             window widths in bins (keys: 'signal_sum', 'signal_width',
+                             'norm_sum', 'norm_width')
+
+    @return numpy.ndarray, numpy.ndarray: the normalized signal and the measuring error
     """
+    return _mean_norm_from_sums(window_sums['signal_sum'], window_sums['signal_width'],
+                                window_sums['norm_sum'], window_sums['norm_width'])
 
-    @param laser_data:
-    @return:
+
+def sums_mean(self, window_sums):
+    """ Same as analyse_mean but based on precomputed window sums of all laser pulses.
+    Used by the incremental analysis of PulsedMeasurementLogic.
+
+    @param dict window_sums: per-laser counts in the signal window and the window width in bins
+                             (keys: 'signal_sum', 'signal_width')
+
+    @return numpy.ndarray, numpy.ndarray: the mean signal and the measuring error
+    """
+    return _mean_from_sums(window_sums['signal_sum'], window_sums['signal_width'],
+                           self.signal_end_bin - self.signal_start_bin)
+
+
+def _laser_window_sums(self, laser_data):
+    """ Sums up the counts of all laser pulses within the signal and normalization windows.
+
+    @param numpy.ndarray laser_data: 2D array containing the extracted laser counts
+
+    @return dict: float arrays with the window sums for each laser pulse and the actual number
+                  of bins in each window (keys: 'signal_sum', 'signal_width', 'norm_sum',
+                  'norm_width')
     """
-    num_of_lasers = laser_data.shape[0]
-
-    # Initialize the signal and normalization mean data arrays
-    signal_mean = np.zeros(num_of_lasers, dtype=float)
-    measuring_error = np.zeros(num_of_lasers, dtype=float)
-
-    # loop over all laser pulses and analyze them
-    for ii in range(num_of_lasers):
-        # calculate the mean of the data in the signal window
-        signal_tmp_data = laser_data[ii][self.signal_start_bin:self.signal_end_bin]
-        if np.sum(signal_tmp_data) < 1:
-            signal_mean[ii] = 0.0
-            measuring_error[ii] = 0.
-        else:
-            signal_mean[ii] = signal_tmp_data.mean()
-            measuring_error[ii] = np.sqrt(signal_tmp_data.sum())/(self.signal_end_bin-self.signal_start_bin)
-
-    return signal_mean, measuring_error
\ No newline at end of file
+    window_sums = dict()
+    window_sums['signal_sum'], window_sums['signal_width'] = _window_sums(
+        laser_data, self.signal_start_bin, self.signal_end_bin)
+    window_sums['norm_sum'], window_sums['norm_width'] = _window_sums(
+        laser_data, self.norm_start_bin, self.norm_end_bin)
+    return window_sums
+
+
+def _window_sums(laser_data, start_bin, end_bin):
+    """ Sums up the counts of all laser pulses within the window [start_bin, end_bin).
+
+    @param numpy.ndarray laser_data: 2D array containing the extracted laser counts
+    @param int start_bin: first bin of the window (python slicing rules apply)
+    @param int end_bin: bin after the last bin of the window (python slicing rules apply)
+
+    @return numpy.ndarray, int: float array with the window sum for each laser pulse and the
+                                actual number of bins in the window
+    """
+    window = laser_data[:, start_bin:end_bin]
+    return np.sum(window, axis=1).astype(float), window.shape[1]
+
+
+def _mean_norm_from_sums(signal_sum, signal_width, norm_sum, norm_width):
+    """ Normalized mean signal and its gaussian error computed from the window sums of all laser
+    pulses.
+
+    Windows with less than one count in total are treated as empty (mean of zero) just like in
+    the former per-laser implementation.
+
+    @param numpy.ndarray signal_sum: counts in the signal window for each laser pulse
+    @param int signal_width: number of bins in the signal window
+    @param numpy.ndarray norm_sum: counts in the normalization window for each laser pulse
+    @param int norm_width: number of bins in the normalization window
+
+    @return numpy.ndarray, numpy.ndarray: the normalized signal and the measuring error
+    """
+    reference_mean = np.zeros(signal_sum.size, dtype=float)
+    signal_mean = np.zeros(signal_sum.size, dtype=float)
+    signal_data = np.zeros(signal_sum.size, dtype=float)
+    measuring_error = np.zeros(signal_sum.size, dtype=float)
+
+    norm_valid = norm_sum >= 1
+    reference_mean[norm_valid] = norm_sum[norm_valid] / norm_width
+    signal_valid = signal_sum >= 1
+    signal_mean[signal_valid] = (signal_sum[signal_valid] / signal_width
+                                 - reference_mean[signal_valid])
+
+    has_reference = reference_mean != 0.0
+    signal_data[has_reference] = 1. + signal_mean[has_reference] / reference_mean[has_reference]
+
+    # with respect to gaußian error 'evolution'
+    has_counts = (signal_sum != 0.) & (norm_sum != 0.)
+    measuring_error[has_counts] = signal_data[has_counts] * np.sqrt(
+        1 / signal_sum[has_counts] + 1 / norm_sum[has_counts])
+    return signal_data, measuring_error
+
+
+def _mean_from_sums(signal_sum, signal_width, nominal_width):
+    """ Mean signal and its shot noise error computed from the window sums of all laser pulses.
+
+    @param numpy.ndarray signal_sum: counts in the signal window for each laser pulse
+    @param int signal_width: number of bins in the signal window
+    @param int nominal_width: requested width of the signal window used for the error
+
+    @return numpy.ndarray, numpy.ndarray: the mean signal and the measuring error
+    """
+    signal_mean = np.zeros(signal_sum.size, dtype=float)
+    measuring_error = np.zeros(signal_sum.size, dtype=float)
+
+    signal_valid = signal_sum >= 1
+    signal_mean[signal_valid] = signal_sum[signal_valid] / signal_width
+    measuring_error[signal_valid] = np.sqrt(signal_sum[signal_valid]) / nominal_width
+    return signal_mean, measuring_error
@@ -72,6 +72,8 @@ class PulsedMasterLogic(GenericLogic):
     sigManuallyPullData = QtCore.Signal()
     sigRequestMeasurementInitValues = QtCore.Signal()
     sigExtractionSettingsChanged = QtCore.Signal(dict)
+    sigIncrementalAnalysisChanged = QtCore.Signal(bool)
+    sigExpectedLaserEdgesChanged = QtCore.Signal(object, object)
 
     # sequence_generator_logic signals
     sigSavePulseBlock = QtCore.Signal(str, object)
@@ -122,6 +124,7 @@ class PulsedMasterLogic(GenericLogic):
     sigAnalysisMethodsUpdated = QtCore.Signal(dict)
     sigExtractionSettingsUpdated = QtCore.Signal(dict)
     sigExtractionMethodsUpdated = QtCore.Signal(dict)
+    sigIncrementalAnalysisUpdated = QtCore.Signal(bool)
 
     def __init__(self, config, **kwargs):
         """ Create PulsedMasterLogic object with connectors.
@@ -141,6 +144,8 @@ class PulsedMasterLogic(GenericLogic):
                                                      QtCore.Qt.QueuedConnection)
         self.sigMeasurementSequenceSettingsChanged.connect(
             self._measurement_logic.set_pulse_sequence_properties, QtCore.Qt.QueuedConnection)
+        self.sigExpectedLaserEdgesChanged.connect(
+            self._measurement_logic.set_expected_laser_edges, QtCore.Qt.QueuedConnection)
         self.sigFastCounterSettingsChanged.connect(
             self._measurement_logic.set_fast_counter_settings, QtCore.Qt.QueuedConnection)
         self.sigExtMicrowaveSettingsChanged.connect(self._measurement_logic.set_microwave_params,
@@ -181,6 +186,8 @@ class PulsedMasterLogic(GenericLogic):
                                            QtCore.Qt.QueuedConnection)
         self.sigExtractionSettingsChanged.connect(self._measurement_logic.extraction_settings_changed,
                                                   QtCore.Qt.QueuedConnection)
+        self.sigIncrementalAnalysisChanged.connect(self._measurement_logic.set_incremental_analysis,
+                                                   QtCore.Qt.QueuedConnection)
 
         # Signals controlling the sequence_generator_logic
         self.sigRequestGeneratorInitValues.connect(self._generator_logic.request_init_values,
@@ -250,6 +257,8 @@ class PulsedMasterLogic(GenericLogic):
                                                                      QtCore.Qt.QueuedConnection)
         self._measurement_logic.sigExtractionMethodsUpdated.connect(self.extraction_methods_updated,
                                                                     QtCore.Qt.QueuedConnection)
+        self._measurement_logic.sigIncrementalAnalysisUpdated.connect(
+            self.incremental_analysis_updated, QtCore.Qt.QueuedConnection)
 
         # connect signals coming from the sequence_generator_logic
         self._generator_logic.sigBlockDictUpdated.connect(self.saved_pulse_blocks_updated,
@@ -297,6 +306,7 @@ class PulsedMasterLogic(GenericLogic):
         # Signals controlling the pulsed_measurement_logic
         self.sigRequestMeasurementInitValues.disconnect()
         self.sigMeasurementSequenceSettingsChanged.disconnect()
+        self.sigExpectedLaserEdgesChanged.disconnect()
         self.sigFastCounterSettingsChanged.disconnect()
         self.sigExtMicrowaveSettingsChanged.disconnect()
         self.sigExtMicrowaveStartStop.disconnect()
@@ -318,6 +328,7 @@ class PulsedMasterLogic(GenericLogic):
         self.sigDirectWriteSequence.disconnect()
         self.sigLaserToShowChanged.disconnect()
         self.sigExtractionSettingsChanged.disconnect()
+        self.sigIncrementalAnalysisChanged.disconnect()
         # Signals controlling the sequence_generator_logic
         self.sigRequestGeneratorInitValues.disconnect()
         self.sigSavePulseBlock.disconnect()
@@ -354,6 +365,7 @@ class PulsedMasterLogic(GenericLogic):
         self._measurement_logic.sigAnalysisMethodsUpdated.disconnect()
         self._measurement_logic.sigExtractionSettingsUpdated.disconnect()
         self._measurement_logic.sigExtractionMethodsUpdated.disconnect()
+        self._measurement_logic.sigIncrementalAnalysisUpdated.disconnect()
         # Signals coming from the sequence_generator_logic
         self._generator_logic.sigBlockDictUpdated.disconnect()
         self._generator_logic.sigEnsembleDictUpdated.disconnect()
@@ -771,6 +783,8 @@ class PulsedMasterLogic(GenericLogic):
         """
         if load_dict is None:
             load_dict = dict()
+        # times of the laser edges within the sequence, unknown unless invoked from the asset
+        laser_edges_s = (None, None)
         # invoke measurement parameters from asset object
         if self.invoke_settings:
             # get asset object
@@ -808,6 +822,8 @@ class PulsedMasterLogic(GenericLogic):
                                                                asset_params['sequence_length'],
                                                                asset_params['laser_ignore_list'],
                                                                asset_params['is_alternating'])
+                    laser_edges_s = asset_params['laser_edges_s']
+        self.sigExpectedLaserEdgesChanged.emit(*laser_edges_s)
         # Load asset into channel
         self.status_dict['loading_busy'] = True
         self.sigLoadAsset.emit(asset_name, load_dict)
@@ -895,6 +911,24 @@ class PulsedMasterLogic(GenericLogic):
         self.sigExtractionSettingsUpdated.emit(extraction_settings)
         return
 
+    def incremental_analysis_changed(self, enabled):
+        """ Switch the incremental analysis of the measurement logic on or off.
+
+        @param bool enabled: True to analyse only the counts added since the last analysis
+        @return:
+        """
+        self.sigIncrementalAnalysisChanged.emit(bool(enabled))
+        return
+
+    def incremental_analysis_updated(self, enabled):
+        """
+
+        @param bool enabled:
+        @return:
+        """
+        self.sigIncrementalAnalysisUpdated.emit(enabled)
+        return
+
     def extraction_methods_updated(self, methods_dict):
         """
 
@@ -1247,6 +1281,42 @@ class PulsedMasterLogic(GenericLogic):
     #######################################################################
     ###             Helper  methods                                     ###
     #######################################################################
+    def _get_expected_laser_edges(self, asset_obj, activation_config, laser_chnl):
+        """ Determine the times of the laser edges within a sampled PulseBlockEnsemble.
+
+        @param asset_obj: PulseBlockEnsemble object
+        @param list activation_config: the activation config the ensemble was sampled with
+        @param str laser_chnl: name of the laser channel
+
+        @return numpy.ndarray, numpy.ndarray: the times of the rising and falling laser edges in
+                                              seconds. (None, None) if the ensemble has not been
+                                              sampled or the laser channel is not digital.
+        """
+        if (asset_obj.digital_rising_bins is None or asset_obj.length_elements_bins is None
+                or not asset_obj.sample_rate):
+            return None, None
+        d_channels = [ch for ch in activation_config if 'd_ch' in ch]
+        if laser_chnl not in d_channels:
+            return None, None
+        chnl_index = d_channels.index(laser_chnl)
+
+        # laser state of each element including all repetitions
+        laser_high = np.array([element.digital_high[chnl_index]
+                               for block, reps in asset_obj.block_list
+                               for rep_no in range(reps + 1)
+                               for element in block.element_list], dtype=bool)
+        if laser_high.size != len(asset_obj.length_elements_bins):
+            return None, None
+        # the laser is switched off at the end of each high element followed by a low element
+        # (or by the end of the sequence)
+        element_end_bins = np.cumsum(asset_obj.length_elements_bins)
+        falling = laser_high & ~np.append(laser_high[1:], False)
+        falling_bins = element_end_bins[falling]
+        rising_bins = np.asarray(asset_obj.digital_rising_bins[chnl_index])
+        if rising_bins.size != falling_bins.size:
+            return None, None
+        return rising_bins / asset_obj.sample_rate, falling_bins / asset_obj.sample_rate
+
     def _get_asset_parameters(self, asset_obj):
         """
 
@@ -1345,6 +1415,8 @@ class PulsedMasterLogic(GenericLogic):
             num_of_lasers += (tmp_lasers_num * (reps + 1))
         return_params['num_of_lasers'] = num_of_lasers
         return_params['max_laser_length'] = max_laser_length
+        return_params['laser_edges_s'] = self._get_expected_laser_edges(
+            asset_obj, return_params['activation_config'], laser_chnl)
 
         # Get laser ignore list
         if asset_obj.laser_ignore_list is None:
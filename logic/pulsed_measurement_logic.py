@@ -49,6 +49,11 @@ class PulsedMeasurementLogic(GenericLogic):
     microwave = Connector(interface='MWInterface')
     pulsegenerator = Connector(interface='PulserInterface')
 
+    # config options
+    # max. deviation of the laser positions in two consecutive extractions to start the
+    # incremental analysis
+    _incremental_edge_tolerance = ConfigOption('incremental_edge_tolerance_bins', 10)
+
     # status vars
     fast_counter_record_length = StatusVar(default=3.e-6)
     sequence_length_s = StatusVar(default=100e-6)
@@ -64,6 +69,7 @@ class PulsedMeasurementLogic(GenericLogic):
     alternating = StatusVar(default=False)
     show_raw_data = StatusVar(default=False)
     show_laser_index = StatusVar(default=0)
+    incremental_analysis = StatusVar(default=False)
 
     # fourier transform status var:
     zeropad = StatusVar(default=0)
@@ -94,6 +100,7 @@ class PulsedMeasurementLogic(GenericLogic):
     sigAnalysisSettingsUpdated = QtCore.Signal(dict)
     sigAnalysisMethodsUpdated = QtCore.Signal(dict)
     sigExtractionSettingsUpdated = QtCore.Signal(dict)
+    sigIncrementalAnalysisUpdated = QtCore.Signal(bool)
     sigExtractionMethodsUpdated = QtCore.Signal(dict)
 
     def __init__(self, config, **kwargs):
@@ -116,6 +123,8 @@ class PulsedMeasurementLogic(GenericLogic):
         self.sequence_length_s = 100e-6
         self.loaded_asset_name = ''
         self.alternating = False
+        # expected (rising, falling) times of the laser edges within the sequence in seconds
+        self._expected_laser_edges_s = None
 
         # Pulse generator parameters
         self.current_channel_config_name = ''
@@ -157,6 +166,10 @@ class PulsedMeasurementLogic(GenericLogic):
         self.saved_raw_data = OrderedDict()  # temporary saved raw data
         self.recalled_raw_data = None  # the currently recalled raw data to add
 
+        # incremental analysis: cached laser positions and running window sums
+        self._incremental_state = None
+        self._previous_laser_segments = None
+
         # for fit:
         self.fc = None  # Fit container
         self.signal_plot_x_fit = np.arange(10, dtype=float)
@@ -262,6 +275,7 @@ class PulsedMeasurementLogic(GenericLogic):
         self.sigExtractionMethodsUpdated.emit(self._pulse_extraction_logic.extraction_methods)
         self.sigAnalysisSettingsUpdated.emit(self._pulse_analysis_logic.analysis_settings)
         self.sigExtractionSettingsUpdated.emit(self._pulse_extraction_logic.extraction_settings)
+        self.sigIncrementalAnalysisUpdated.emit(self.incremental_analysis)
         self.sigLoadedAssetUpdated.emit(self.loaded_asset_name)
         self.sigUploadedAssetsUpdated.emit(self._pulse_generator_device.get_uploaded_asset_names())
         self.sigSignalDataUpdated.emit(self.signal_plot_x, self.signal_plot_y, self.signal_plot_y2,
@@ -317,6 +331,8 @@ class PulsedMeasurementLogic(GenericLogic):
 
         # Make sure the analysis logic takes the correct binning into account
         self._pulse_analysis_logic.fast_counter_binwidth = bin_width_s
+        self._update_expected_laser_edges()
+        self._reset_incremental_analysis()
 
         # emit update signal for master (GUI or other logic module)
         self.sigFastCounterSettingsUpdated.emit(self.fast_counter_binwidth,
@@ -354,6 +370,7 @@ class PulsedMeasurementLogic(GenericLogic):
         self.sequence_length_s = sequence_length_s
         self.laser_ignore_list = laser_ignore_list
         self.alternating = is_alternating
+        self._reset_incremental_analysis()
         if self.fast_counter_gated:
             self.set_fast_counter_settings(self.fast_counter_binwidth,
                                            self.fast_counter_record_length)
@@ -364,6 +381,37 @@ class PulsedMeasurementLogic(GenericLogic):
         return self.controlled_vals, self.number_of_lasers, self.sequence_length_s, \
                self.laser_ignore_list, self.alternating
 
+    def set_expected_laser_edges(self, rising_edges_s, falling_edges_s):
+        """ Set the times of the laser edges within the pulse sequence as known from the loaded
+        PulseBlockEnsemble. They are passed to the pulse extraction in fast counter bins.
+
+        @param numpy.ndarray rising_edges_s: times of the rising laser edges in seconds.
+                                             None if the laser edges are unknown.
+        @param numpy.ndarray falling_edges_s: times of the falling laser edges in seconds
+        """
+        with self.threadlock:
+            if rising_edges_s is None or falling_edges_s is None:
+                self._expected_laser_edges_s = None
+            else:
+                self._expected_laser_edges_s = (np.asarray(rising_edges_s, dtype=float),
+                                                np.asarray(falling_edges_s, dtype=float))
+            self._update_expected_laser_edges()
+            self._reset_incremental_analysis()
+        return
+
+    def _update_expected_laser_edges(self):
+        """ Convert the expected laser edges to fast counter bins and pass them to the pulse
+        extraction logic. Gated fast counters do not need them.
+        """
+        if self._expected_laser_edges_s is None or self.fast_counter_gated:
+            self._pulse_extraction_logic.set_expected_laser_edges(None, None)
+        else:
+            rising_edges_s, falling_edges_s = self._expected_laser_edges_s
+            self._pulse_extraction_logic.set_expected_laser_edges(
+                np.rint(rising_edges_s / self.fast_counter_binwidth).astype(int),
+                np.rint(falling_edges_s / self.fast_counter_binwidth).astype(int))
+        return
+
     def get_fastcounter_constraints(self):
         """ Request the constrains from the hardware, in order to pass them
             to the GUI if necessary.
@@ -679,6 +727,7 @@ class PulsedMeasurementLogic(GenericLogic):
                 self.fc.clear_result()
                 # initialize plots
                 self._initialize_plots()
+                self._reset_incremental_analysis()
 
                 # recall stashed raw data
                 if stashed_raw_data_tag is None:
@@ -743,18 +792,28 @@ class PulsedMeasurementLogic(GenericLogic):
                 else:
                     self.raw_data = fc_data
 
-                # extract laser pulses from raw data
-                return_dict = self._pulse_extraction_logic.extract_laser_pulses(self.raw_data,
-                                                                                self.fast_counter_gated)
-                self.laser_data = return_dict['laser_counts_arr']
-
-                # analyze pulses and get data points for signal plot. Also check if extraction
-                # worked (non-zero array returned).
-                if np.sum(self.laser_data) < 1:
-                    tmp_signal = np.zeros(self.laser_data.shape[0])
-                    tmp_error = np.zeros(self.laser_data.shape[0])
+                if self._incremental_state is not None and self._update_incremental_analysis():
+                    # only the new counts since the last tick have been added to the laser data
+                    # and the window sums of the analysis
+                    tmp_signal, tmp_error = self._pulse_analysis_logic.analyze_window_sums(
+                        self._incremental_state['window_sums'])
                 else:
-                    tmp_signal, tmp_error = self._pulse_analysis_logic.analyze_data(self.laser_data)
+                    self._incremental_state = None
+                    # extract laser pulses from raw data
+                    return_dict = self._pulse_extraction_logic.extract_laser_pulses(
+                        self.raw_data, self.fast_counter_gated)
+                    self.laser_data = return_dict['laser_counts_arr']
+
+                    # analyze pulses and get data points for signal plot. Also check if
+                    # extraction worked (non-zero array returned).
+                    if np.sum(self.laser_data) < 1:
+                        tmp_signal = np.zeros(self.laser_data.shape[0])
+                        tmp_error = np.zeros(self.laser_data.shape[0])
+                    else:
+                        tmp_signal, tmp_error = self._pulse_analysis_logic.analyze_data(
+                            self.laser_data)
+                        if self.incremental_analysis:
+                            self._init_incremental_analysis(return_dict)
                 # exclude laser pulses to ignore
                 if len(self.laser_ignore_list) > 0:
                     ignore_indices = self.laser_ignore_list
@@ -815,7 +874,8 @@ class PulsedMeasurementLogic(GenericLogic):
                 self.laser_plot_y = self.raw_data
         else:
             if laser_index > 0:
-                self.laser_plot_y = self.laser_data[laser_index - 1]
+                # copy the row, the laser data is overwritten by the next extraction
+                self.laser_plot_y = self.laser_data[laser_index - 1].copy()
             else:
                 self.laser_plot_y = np.sum(self.laser_data, 0)
 
@@ -924,6 +984,7 @@ class PulsedMeasurementLogic(GenericLogic):
         with self.threadlock:
             for parameter in analysis_settings:
                 self._pulse_analysis_logic.analysis_settings[parameter] = analysis_settings[parameter]
+            self._reset_incremental_analysis()
 
             # forward to the GUI the exact timing
             if 'signal_start_s' in analysis_settings:
@@ -947,9 +1008,139 @@ class PulsedMeasurementLogic(GenericLogic):
         with self.threadlock:
             for parameter in extraction_settings:
                 self._pulse_extraction_logic.extraction_settings[parameter] = extraction_settings[parameter]
+            self._reset_incremental_analysis()
             self.sigExtractionSettingsUpdated.emit(extraction_settings)
         return extraction_settings
 
+    def set_incremental_analysis(self, enabled):
+        """ Switch the incremental pulsed analysis on or off.
+
+        @param bool enabled: In incremental mode the laser pulses are only extracted from the full
+                             timetrace until their positions are stable. Afterwards only the counts
+                             added since the last analysis are processed, so the time per analysis
+                             does not grow with the accumulated raw data.
+
+        @return bool: the incremental analysis flag actually set
+        """
+        with self.threadlock:
+            self.incremental_analysis = bool(enabled)
+            self._reset_incremental_analysis()
+        self.sigIncrementalAnalysisUpdated.emit(self.incremental_analysis)
+        return self.incremental_analysis
+
+    def _reset_incremental_analysis(self):
+        """ Discard the cached laser positions and window sums. The next analysis will extract
+        the laser pulses from the full timetrace again.
+        """
+        self._incremental_state = None
+        self._previous_laser_segments = None
+        self._pulse_extraction_logic.clear_laser_edge_cache()
+        return
+
+    def _init_incremental_analysis(self, extraction_dict):
+        """ Cache the laser positions of a successful full extraction together with the current
+        raw data and the window sums of the analysis.
+
+        The laser positions are only trusted if two consecutive full extractions agree within the
+        configured incremental_edge_tolerance_bins. Otherwise nothing is cached and the next
+        analysis is a full one again.
+
+        @param dict extraction_dict: the dictionary returned by the pulse extraction
+        """
+        if not self._pulse_analysis_logic.has_window_sum_method():
+            return
+        laser_length = self.laser_data.shape[1]
+        rising_ind = np.asarray(extraction_dict.get('laser_indices_rising'), dtype=int)
+        if self.raw_data.ndim == 2:
+            # gated: the same time bins are cut out of each gate
+            segments = (rising_ind.reshape(1), np.array([laser_length]))
+        elif 'laser_lengths' in extraction_dict:
+            segments = (rising_ind, np.asarray(extraction_dict['laser_lengths'], dtype=int))
+        else:
+            return
+
+        previous_segments = self._previous_laser_segments
+        self._previous_laser_segments = segments
+        if previous_segments is None or previous_segments[0].shape != segments[0].shape:
+            return
+        if (np.max(np.abs(previous_segments[0] - segments[0])) > self._incremental_edge_tolerance
+                or np.max(np.abs(previous_segments[1] - segments[1]))
+                > self._incremental_edge_tolerance):
+            return
+
+        starts, lengths = segments
+        state = dict()
+        state['starts'] = starts
+        state['lengths'] = lengths
+        state['bounds'] = dict()
+        state['window_sums'] = dict()
+        window_bins = self._pulse_analysis_logic.get_window_bins()
+        for window in ('signal', 'norm'):
+            # resolve the window like a slice of the laser array would do
+            start_bin, end_bin, dummy = slice(*window_bins[window]).indices(laser_length)
+            end_bin = max(start_bin, end_bin)
+            state['bounds'][window] = (starts + np.minimum(start_bin, lengths),
+                                       starts + np.minimum(end_bin, lengths))
+            state['window_sums'][window + '_width'] = end_bin - start_bin
+        for window, window_sum in self._get_segment_window_sums(self.raw_data, state).items():
+            state['window_sums'][window + '_sum'] = window_sum
+
+        if self.raw_data.ndim == 1:
+            # the extraction returns a read-only laser array, the counts are added to a copy
+            self.laser_data = self.laser_data.copy()
+            bin_offsets = np.arange(laser_length)
+            state['laser_mask'] = bin_offsets[np.newaxis, :] < lengths[:, np.newaxis]
+            state['laser_index'] = (starts[:, np.newaxis] + bin_offsets)[state['laser_mask']]
+        state['previous_raw_data'] = self.raw_data.copy()
+        self._incremental_state = state
+        return
+
+    def _update_incremental_analysis(self):
+        """ Add the counts acquired since the last analysis to the laser data and to the running
+        window sums.
+
+        @return bool: True if the update succeeded, False if a full extraction is needed since the
+                      raw data has changed shape or lost counts (e.g. the fast counter restarted)
+        """
+        state = self._incremental_state
+        if self.raw_data.shape != state['previous_raw_data'].shape:
+            return False
+        delta_data = self.raw_data - state['previous_raw_data']
+        if np.any(delta_data < 0):
+            return False
+
+        for window, window_sum in self._get_segment_window_sums(delta_data, state).items():
+            state['window_sums'][window + '_sum'] += window_sum
+
+        if delta_data.ndim == 2:
+            # the gated laser data is just a view into the raw data
+            start = int(state['starts'][0])
+            self.laser_data = self.raw_data[:, start:start + int(state['lengths'][0])]
+        else:
+            self.laser_data[state['laser_mask']] += delta_data[state['laser_index']].astype(
+                self.laser_data.dtype)
+        state['previous_raw_data'] = self.raw_data.copy()
+        return True
+
+    def _get_segment_window_sums(self, raw_data, state):
+        """ Sum up the raw data within the analysis windows of each cached laser pulse.
+
+        @param numpy.ndarray raw_data: 1D (ungated) or 2D (gated) raw data or raw data difference
+        @param dict state: the incremental analysis state holding the window bounds
+
+        @return dict: float array of per-laser counts for the keys 'signal' and 'norm'
+        """
+        window_sums = dict()
+        if raw_data.ndim == 2:
+            for window, (lower, upper) in state['bounds'].items():
+                window_sums[window] = np.sum(raw_data[:, int(lower[0]):int(upper[0])],
+                                             axis=1).astype(float)
+        else:
+            cumulative = np.concatenate(([0], np.cumsum(raw_data)))
+            for window, (lower, upper) in state['bounds'].items():
+                window_sums[window] = (cumulative[upper] - cumulative[lower]).astype(float)
+        return window_sums
+
     def _initialize_plots(self):
         """
         Initializing the signal, error and laser plot data.
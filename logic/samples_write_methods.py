@@ -42,16 +42,31 @@ class SamplesWriteMethods():
         self._write_to_file['seqx'] = self._write_seqx
         self._write_to_file['fpga'] = self._write_fpga
         self._write_to_file['pstream'] = self._write_pstream
+
+        # File formats which can be written directly from the PulseBlockElements of an ensemble
+        # without sampling it first:
+        self._compile_to_file = OrderedDict()
+        self._compile_to_file['pstream'] = self._compile_pstream
+        self._pstream_chunks = []
+
+        # memory-maps of the waveform files during chunkwise writing: {channel: (samples, markers)}
+        self._waveform_maps = dict()
+        self._waveform_write_offset = 0
         return
 
     def _write_wfmx(self, name, analog_samples, digital_samples, total_number_of_samples,
                     is_first_chunk, is_last_chunk):
         """
-        Appends a sampled chunk of a whole waveform to a wfmx-file. Create the file
+        Writes a sampled chunk of a whole waveform to a wfmx-file. Create the file
         if it is the first chunk.
         If both flags (is_first_chunk, is_last_chunk) are set to TRUE it means
         that the whole ensemble is written as a whole in one big chunk.
 
+        A wfmx-file consists of the xml header, all analog samples (float32) and all marker
+        bytes. With the first chunk the files are created in their final size and the analog and
+        marker regions are memory-mapped. Each chunk is then written in place at its sample
+        offset, so no temporary files and no second pass over the data are needed.
+
         @param name: string, represents the name of the sampled ensemble
         @param analog_samples: float32 numpy ndarray, contains the
                                        samples for the analog channels that
@@ -72,138 +87,76 @@ class SamplesWriteMethods():
         # record the name of the created files
         created_files = []
 
-        # The overhead of the write process in bytes.
-        # Making this value bigger will result in a faster write process
-        # but consumes more memory
-        write_overhead_bytes = 1024*1024*256 # 256 MB
-        # The overhead of the write process in number of samples
-        write_overhead_samples = write_overhead_bytes//4
-
         # analyze the activation_config and extract analogue and digital channel numbers
         ana_chnl_numbers = [int(chnl.split('ch')[-1]) for chnl in self.activation_config if
                             'a_ch' in chnl]
         digi_chnl_numbers = [int(chnl.split('ch')[-1]) for chnl in self.activation_config if
                             'd_ch' in chnl]
+        total_number_of_samples = int(total_number_of_samples)
 
-        # if it is the first chunk, create the .WFMX file with header.
+        # if it is the first chunk, create the .WFMX files with header in their final size.
         if is_first_chunk:
-            # create header
-            self._create_xml_file(total_number_of_samples, self.temp_dir)
-            # read back the header xml-file and delete it afterwards
-            temp_file = os.path.join(self.temp_dir, 'header.xml')
-            with open(temp_file, 'r') as header:
-                header_lines = header.readlines()
-            os.remove(temp_file)
-
-            # create wfmx-file for each analog channel
+            self._close_waveform_maps()
+            header = self._create_wfmx_header(total_number_of_samples)
             for channel in ana_chnl_numbers:
                 filename = name + '_ch' + str(channel) + '.wfmx'
                 created_files.append(filename)
-
                 filepath = os.path.join(self.waveform_dir, filename)
 
+                # The marker bytes follow after all analog samples (only if markers are active)
+                has_markers = ((channel * 2) - 1 in digi_chnl_numbers
+                               or channel * 2 in digi_chnl_numbers)
+                file_size = len(header) + total_number_of_samples * (5 if has_markers else 4)
                 with open(filepath, 'wb') as wfmxfile:
-                    # write header
-                    for line in header_lines:
-                        wfmxfile.write(bytes(line, 'UTF-8'))
+                    wfmxfile.write(header)
+                    wfmxfile.truncate(file_size)
+
+                if total_number_of_samples == 0:
+                    continue
+                analog_map = np.memmap(filepath, dtype='<f4', mode='r+', offset=len(header),
+                                       shape=(total_number_of_samples,))
+                if has_markers:
+                    marker_map = np.memmap(filepath, dtype='uint8', mode='r+',
+                                           offset=len(header) + 4 * total_number_of_samples,
+                                           shape=(total_number_of_samples,))
+                else:
+                    marker_map = None
+                self._waveform_maps[channel] = (analog_map, marker_map)
+            self._waveform_write_offset = 0
 
-        # append analog samples to the .WFMX files of each channel. Write
-        # digital samples in temporary files.
+        # write analog samples and marker bytes of this chunk at their position in the files
+        start_ind = self._waveform_write_offset
+        stop_ind = start_ind + analog_samples.shape[1]
         for i, channel in enumerate(ana_chnl_numbers):
-            # append analog samples chunk to .WFMX file
-            filepath = os.path.join(self.waveform_dir, name + '_ch' + str(channel) + '.wfmx')
-            with open(filepath, 'ab') as wfmxfile:
-                # append analog samples in binary format. One sample is 4
-                # bytes (np.float32). Write in chunks if array is very big to
-                # avoid large temporary copys in memory
-                number_of_full_chunks = int(analog_samples.shape[1]//write_overhead_samples)
-                for start_ind in np.arange(0, number_of_full_chunks * write_overhead_samples,
-                                           write_overhead_samples):
-                    stop_ind = start_ind+write_overhead_samples
-                    wfmxfile.write(analog_samples[i][start_ind:stop_ind])
-                # write rest
-                rest_start_ind = number_of_full_chunks*write_overhead_samples
-                wfmxfile.write(analog_samples[i][rest_start_ind:])
-
-            # create the byte values corresponding to the marker states
-            # (\x01 for marker 1, \x02 for marker 2, \x03 for both)
-            # and write them into a temporary file
-            filepath = os.path.join(self.temp_dir, name + '_ch' + str(channel) + '_digi' + '.tmp')
-            with open(filepath, 'ab') as tmpfile:
-                if (channel*2)-1 not in digi_chnl_numbers and channel*2 not in digi_chnl_numbers:
-                    # no digital channels to write for this analog channel
-                    pass
-                elif (channel*2)-1 in digi_chnl_numbers and channel*2 not in digi_chnl_numbers:
-                    # Only marker one is active for this channel
-                    digi_chnl_index = digi_chnl_numbers.index((channel * 2) - 1)
-                    for start_ind in np.arange(0, number_of_full_chunks * write_overhead_bytes,
-                                               write_overhead_bytes):
-                        stop_ind = start_ind + write_overhead_bytes
-                        # append digital samples in binary format. One sample
-                        # is 1 byte (np.uint8).
-                        tmpfile.write(digital_samples[digi_chnl_index][start_ind:stop_ind])
-                    # write rest of digital samples
-                    rest_start_ind = number_of_full_chunks * write_overhead_bytes
-                    tmpfile.write(digital_samples[digi_chnl_index][rest_start_ind:])
-                elif (channel*2)-1 not in digi_chnl_numbers and channel*2 in digi_chnl_numbers:
-                    # Only marker two is active for this channel
-                    digi_chnl_index = digi_chnl_numbers.index(channel * 2)
-                    for start_ind in np.arange(0, number_of_full_chunks * write_overhead_bytes,
-                                               write_overhead_bytes):
-                        stop_ind = start_ind + write_overhead_bytes
-                        # append digital samples in binary format. One sample
-                        # is 1 byte (np.uint8).
-                        tmpfile.write(np.left_shift(
-                            digital_samples[digi_chnl_index][start_ind:stop_ind].astype('uint8'),
-                            1))
-                    # write rest of digital samples
-                    rest_start_ind = number_of_full_chunks * write_overhead_bytes
-                    tmpfile.write(np.left_shift(
-                        digital_samples[digi_chnl_index][rest_start_ind:].astype('uint8'), 1))
-                else:
-                    # Both markers are active for this channel
-                    digi_chnl_index = digi_chnl_numbers.index(channel * 2)
-                    for start_ind in np.arange(0, number_of_full_chunks * write_overhead_bytes,
-                                               write_overhead_bytes):
-                        stop_ind = start_ind + write_overhead_bytes
-                        # append digital samples in binary format. One sample
-                        # is 1 byte (np.uint8).
-                        tmpfile.write(np.add(np.left_shift(
-                            digital_samples[digi_chnl_index][start_ind:stop_ind].astype('uint8'),
-                            1), digital_samples[digi_chnl_index - 1][start_ind:stop_ind]))
-                    # write rest of digital samples
-                    rest_start_ind = number_of_full_chunks * write_overhead_bytes
-                    tmpfile.write(np.add(np.left_shift(
-                        digital_samples[digi_chnl_index][rest_start_ind:].astype('uint8'), 1),
-                                         digital_samples[digi_chnl_index - 1][rest_start_ind:]))
-
-        # append the digital sample tmp file to the .WFMX file and delete the
-        # .tmp files if it was the last chunk to write.
+            if channel not in self._waveform_maps:
+                continue
+            analog_map, marker_map = self._waveform_maps[channel]
+            analog_map[start_ind:stop_ind] = analog_samples[i]
+            if marker_map is not None:
+                marker_map[start_ind:stop_ind] = _marker_bytes(digital_samples, channel,
+                                                               digi_chnl_numbers)
+        self._waveform_write_offset = stop_ind
+
         if is_last_chunk:
-            for channel in ana_chnl_numbers:
-                tmp_filepath = os.path.join(self.temp_dir, name + '_ch' + str(channel) + '_digi' + '.tmp')
-                wfmx_filepath = os.path.join(self.waveform_dir, name + '_ch' + str(channel) + '.wfmx')
-                with open(wfmx_filepath, 'ab') as wfmxfile:
-                    with open(tmp_filepath, 'rb') as tmpfile:
-                        # read and write files in max. write_overhead_bytes chunks to reduce
-                        # memory usage
-                        while True:
-                            tmp_data = tmpfile.read(write_overhead_bytes)
-                            if not tmp_data:
-                                break
-                            wfmxfile.write(tmp_data)
-                # delete tmp file
-                os.remove(tmp_filepath)
+            if stop_ind != total_number_of_samples:
+                self.log.error('Number of samples written to wfmx-file ({0}) does not match the '
+                               'total number of samples ({1}).'.format(stop_ind,
+                                                                       total_number_of_samples))
+            self._close_waveform_maps()
         return created_files
 
     def _write_wfm(self, name, analog_samples, digital_samples, total_number_of_samples,
                     is_first_chunk, is_last_chunk):
         """
-        Appends a sampled chunk of a whole waveform to a wfm-file. Create the file
+        Writes a sampled chunk of a whole waveform to a wfm-file. Create the file
         if it is the first chunk.
         If both flags (is_first_chunk, is_last_chunk) are set to TRUE it means
         that the whole ensemble is written as a whole in one big chunk.
 
+        With the first chunk the files are created in their final size including header and
+        footer and the sample region is memory-mapped. Each chunk is then written in place at its
+        sample offset.
+
         @param name: string, represents the name of the sampled ensemble
         @param analog_samples: float32 numpy ndarray, contains the
                                        samples for the analog channels that
@@ -229,6 +182,7 @@ class SamplesWriteMethods():
                             'a_ch' in chnl]
         digi_chnl_numbers = [int(chnl.split('ch')[-1]) for chnl in self.activation_config if
                              'd_ch' in chnl]
+        total_number_of_samples = int(total_number_of_samples)
 
         # IMPORTANT: These numbers build the header in the wfm file. Needed
         # by the device program to understand wfm file. If it is wrong,
@@ -242,58 +196,61 @@ class SamplesWriteMethods():
         # waveform file.
         # After this number a 14bit binary representation of the channel
         # and the marker are followed.
-        for channel_index, channel_number in enumerate(ana_chnl_numbers):
-            filename = name + '_ch' + str(channel_number) + '.wfm'
-            created_files.append(filename)
-            filepath = os.path.join(self.waveform_dir, filename)
+        # The footer encodes the sample rate, which was used for that file.
+        if is_first_chunk:
+            self._close_waveform_maps()
+            num_bytes = str(int(total_number_of_samples * 5))
+            num_digits = str(len(num_bytes))
+            header = str.encode('MAGIC 1000\r\n#' + num_digits + num_bytes)
+            footer = str.encode('CLOCK {0:16.10E}\r\n'.format(self.sample_rate))
+            for channel_number in ana_chnl_numbers:
+                filename = name + '_ch' + str(channel_number) + '.wfm'
+                created_files.append(filename)
+                filepath = os.path.join(self.waveform_dir, filename)
 
-            if is_first_chunk:
+                # One sample is a structure of 4 byte (numpy float32) for the analog sample and
+                # one byte (numpy uint8) for the markers.
                 with open(filepath, 'wb') as wfm_file:
-                    # write the first line, which is the header file, if first chunk is passed:
-                    num_bytes = str(int(total_number_of_samples * 5))
-                    num_digits = str(len(num_bytes))
-                    header = str.encode('MAGIC 1000\r\n#' + num_digits + num_bytes)
                     wfm_file.write(header)
-
-            # now write the samples chunk in binary representation:
-            # First we create a structured numpy array representing one byte (numpy uint8)
-            # for the markers and 4 byte (numpy float32) for the analog samples.
-            write_array = np.empty(digital_samples.shape[1], dtype='float32, uint8')
-
-            # now we determine which markers are active for this channel and write them to
-            # write_array.
-            if (channel_number * 2) - 1 in digi_chnl_numbers and (channel_number * 2) in digi_chnl_numbers:
-                # both markers active for this channel
-                digi_index = digi_chnl_numbers.index(channel_number * 2)
-                write_array['f1'] = np.add(
-                    np.left_shift(digital_samples[digi_index][:].astype('uint8'), 1),
-                    digital_samples[digi_index - 1][:].astype('uint8'))
-            elif (channel_number * 2) - 1 in digi_chnl_numbers and (channel_number * 2) not in digi_chnl_numbers:
-                # only marker 1 active for this channel
-                digi_index = digi_chnl_numbers.index((channel_number * 2) - 1)
-                write_array['f1'] = digital_samples[digi_index][:].astype('uint8')
-            elif (channel_number * 2) - 1 not in digi_chnl_numbers and (channel_number * 2) in digi_chnl_numbers:
-                # only marker 2 active for this channel
-                digi_index = digi_chnl_numbers.index(channel_number * 2)
-                write_array['f1'] = np.left_shift(
-                    digital_samples[digi_index][:].astype('uint8'), 1)
-            else:
-                # no markers active for this channel
-                write_array['f1'] = np.zeros(digital_samples.shape[1], dtype='uint8')
-            # Write analog samples into the write_array
-            write_array['f0'] = analog_samples[channel_index][:]
-
-            # Write write_array to file
-            with open(filepath, 'ab') as wfm_file:
-                wfm_file.write(write_array)
-
-                # append footer if it's the last chunk to write
-                if is_last_chunk:
-                    # the footer encodes the sample rate, which was used for that file:
-                    footer = str.encode('CLOCK {0:16.10E}\r\n'.format(self.sample_rate))
+                    wfm_file.seek(len(header) + 5 * total_number_of_samples)
                     wfm_file.write(footer)
+
+                if total_number_of_samples == 0:
+                    continue
+                sample_map = np.memmap(filepath, dtype='<f4, uint8', mode='r+',
+                                       offset=len(header), shape=(total_number_of_samples,))
+                self._waveform_maps[channel_number] = (sample_map, None)
+            self._waveform_write_offset = 0
+        else:
+            created_files = [name + '_ch' + str(channel_number) + '.wfm'
+                             for channel_number in ana_chnl_numbers]
+
+        # write the samples chunk at its position in the files
+        start_ind = self._waveform_write_offset
+        stop_ind = start_ind + digital_samples.shape[1]
+        for channel_index, channel_number in enumerate(ana_chnl_numbers):
+            if channel_number not in self._waveform_maps:
+                continue
+            sample_map = self._waveform_maps[channel_number][0]
+            marker_bytes = _marker_bytes(digital_samples, channel_number, digi_chnl_numbers)
+            sample_map['f1'][start_ind:stop_ind] = 0 if marker_bytes is None else marker_bytes
+            sample_map['f0'][start_ind:stop_ind] = analog_samples[channel_index]
+        self._waveform_write_offset = stop_ind
+
+        if is_last_chunk:
+            self._close_waveform_maps()
         return created_files
 
+    def _close_waveform_maps(self):
+        """ Flushes and closes the memory-maps of the waveform files written chunkwise. """
+        for maps in self._waveform_maps.values():
+            for file_map in maps:
+                if file_map is not None:
+                    file_map.flush()
+        self._waveform_maps = dict()
+        self._waveform_write_offset = 0
+        return
+
     def _write_fpga(self, name, analog_samples, digital_samples, total_number_of_samples,
                     is_first_chunk, is_last_chunk):
         """
@@ -360,7 +317,7 @@ class SamplesWriteMethods():
     def _write_pstream(self, name, analog_samples, digital_samples, total_number_of_samples,
                     is_first_chunk, is_last_chunk):
         """
-        Appends a sampled chunk of a whole waveform to a fpga-file. Create the file
+        Appends a sampled chunk of a whole waveform to a pstream-file. Create the file
         if it is the first chunk.
         If both flags (is_first_chunk, is_last_chunk) are set to TRUE it means
         that the whole ensemble is written as a whole in one big chunk.
@@ -390,13 +347,12 @@ class SamplesWriteMethods():
         will be compressed to three Pulse elements with duration 2, 2, 1 and with the correct
         respective bitmasks for the active channels. 
         
-        This function traverses the digital_samples array to identify where the active digital
-        channels are modified and compresses it down to a sequence of pulse elements each with 
-        a bitmask and a length. The file is then written to disk. 
-        
-        TODO: This is inefficient, as the original PulseElement representation inside Qudi is
-        first decompressed into a sample stream, then recompressed into the PulseStreamer 
-        representation. Work is required to enable the bypass of the interim stage. 
+        This function compresses the digital_samples array into a sequence of pulse elements
+        each with a bitmask and a length. The pulses of all chunks are collected and written to
+        disk with the last chunk (see _save_pstream_file for the file format).
+
+        Normally this method is bypassed: SequenceGeneratorLogic compiles PulseBlockEnsembles
+        directly into pulses with _compile_pstream without creating the sample arrays.
 
         @param name: string, represents the name of the sampled ensemble
         @param analog_samples: float32 numpy ndarray, contains the
@@ -415,39 +371,71 @@ class SamplesWriteMethods():
         @return list: the list contains the string names of the created files for the passed
                       presampled arrays
         """
-        import dill
-
         # record the name of the created files
         created_files = []
 
         channel_number = digital_samples.shape[0]
-        digital_samples = np.transpose(digital_samples)
-
-        if channel_number != 8:
-            self.log.error('Pulse streamer needs 8 digital channels. {0} is not allowed!'
+        if channel_number > 8:
+            self.log.error('Pulse streamer has only 8 digital channels. {0} is not allowed!'
                            ''.format(channel_number))
             return -1
 
-        # fetch locations where digital channel states change, and eliminate duplicates
-        new_channel_indices = np.where(digital_samples[:-1,:] != digital_samples[1:,:])[0]
-        new_channel_indices = np.unique(new_channel_indices)
+        # bitmask of the digital channel states for each sample
+        dig_chnl_names = [chnl for chnl in self.activation_config if 'd_ch' in chnl]
+        masks = _channel_bitmasks(digital_samples.T, dig_chnl_names)
+        if is_first_chunk:
+            self._pstream_chunks = []
+        self._pstream_chunks.append(_run_length_pulses(masks, np.ones(masks.size, dtype=np.int64)))
+
+        if is_last_chunk:
+            chunks = self._pstream_chunks
+            self._pstream_chunks = []
+            # merge pulses across chunk borders
+            pulses = np.concatenate(chunks)
+            pulses = _run_length_pulses(pulses['digi'], pulses['ticks'])
+
+            filename = name + '.pstream'
+            created_files.append(filename)
+            _save_pstream_file(os.path.join(self.waveform_dir, filename), pulses)
 
-        # add in indices for the start and end of the sequence to simplify iteration
-        new_channel_indices = np.insert(new_channel_indices, 0, [-1])
-        new_channel_indices = np.insert(new_channel_indices, new_channel_indices.size, [digital_samples.shape[0]-1])
+        return created_files
 
-        pulses = []
-        for new_channel_index in range(1, new_channel_indices.size):
-            pulse = [new_channel_indices[new_channel_index] - new_channel_indices[new_channel_index - 1], _convert_to_bitmask(digital_samples[new_channel_indices[new_channel_index - 1] + 1,:])]
-            pulses.append(pulse)
+    def _compile_pstream(self, name, element_plan, dig_chnl_names):
+        """
+        Writes a pstream-file directly from the unrolled elements of a PulseBlockEnsemble,
+        without sampling the ensemble first.
+
+        Each element becomes a pulse of its length in bins (1 bin = 1 ns for the PulseStreamer)
+        with the bitmask of its digital_high states. Adjacent pulses with identical bitmask are
+        merged. Memory usage and run time scale with the number of elements instead of the
+        number of samples. The result is identical to sampling the ensemble and calling
+        _write_pstream.
+
+        @param name: string, represents the name of the ensemble
+        @param list element_plan: tuples (block_element, start_bin, length_bins, time_offset_bin)
+                                  for each element in chronological order (see
+                                  SequenceGeneratorLogic._get_element_sampling_plan)
+        @param list dig_chnl_names: names of the active digital channels, e.g. ['d_ch1', 'd_ch2']
+
+        @return list: the list contains the string names of the created files
+        """
+        created_files = []
+        if len(dig_chnl_names) > 8:
+            self.log.error('Pulse streamer has only 8 digital channels. {0} is not allowed!'
+                           ''.format(len(dig_chnl_names)))
+            return -1
+
+        digital_high = np.zeros((len(element_plan), len(dig_chnl_names)), dtype=bool)
+        lengths = np.zeros(len(element_plan), dtype=np.int64)
+        for index, (block_element, start_bin, length_bins, time_offset_bin) in enumerate(
+                element_plan):
+            digital_high[index] = block_element.digital_high
+            lengths[index] = length_bins
+        pulses = _run_length_pulses(_channel_bitmasks(digital_high, dig_chnl_names), lengths)
 
-        # append samples to file
         filename = name + '.pstream'
         created_files.append(filename)
-
-        filepath = os.path.join(self.waveform_dir, filename)
-        dill.dump(pulses, open(filepath, 'wb'))
-
+        _save_pstream_file(os.path.join(self.waveform_dir, filename), pulses)
         return created_files
 
     def _write_seq(self, name, sequence_param):
@@ -544,10 +532,13 @@ class SamplesWriteMethods():
         """
         pass
 
-    def _create_xml_file(self, number_of_samples, temp_dir=''):
+    def _create_wfmx_header(self, number_of_samples):
         """
-        This function creates an xml file containing the header for the wfmx-file format using
-        etree.
+        This function creates the xml header for the wfmx-file format using etree.
+
+        @param int number_of_samples: number of samples in the waveform
+
+        @return bytes: the header as written to the beginning of the wfmx-file
         """
         root = ET.Element('DataFile', offset='xxxxxxxxx', version="0.1")
         DataSetsCollection = ET.SubElement(root, 'DataSetsCollection',
@@ -585,66 +576,103 @@ class SamplesWriteMethods():
                                           name='Basic Waveform')
         Setup = ET.SubElement(root, 'Setup')
 
-        filepath = os.path.join(temp_dir, 'header.xml')
-
-        ##### This command creates the first version of the file
+        ##### This command creates the first version of the header
         tree = ET.ElementTree(root)
-        tree.write(filepath, pretty_print=True, xml_declaration=True)
+        text = ET.tostring(tree, pretty_print=True, xml_declaration=True)
 
         # Calculates the length of the header:
-        # 40 is subtracted since the first line of the above created file has a length of 39 and is
-        # not included later and the last endline (\n) is also not neccessary.
-        # The for loop is needed to give a nine digit length: xxxxxxxxx
-        length_of_header = ''
-        size = str(os.path.getsize(filepath) - 40)
-
-        for ii in range(9 - len(size)):
-            length_of_header += '0'
-        length_of_header += size
-
-        # The header length is written into the file
-        # The first line is not included since it is redundant
-        # Also the last endline (\n) is excluded
-        text = open(filepath, "U").read()
-        text = text.replace("xxxxxxxxx", length_of_header)
-        text = bytes(text, 'UTF-8')
-        f = open(filepath, "wb")
-        f.write(text[39:-1])
-        f.close()
-
-def _convert_to_bitmask(active_channels):
-    """ Convert a list of channels into a bitmask.
-    @param numpy.array active_channels: the list of active channels like
-                        e.g. [0,4,7]. Note that the channels start from 0.
-    @return int: The channel-list is converted into a bitmask (an sequence
-                 of 1 and 0). The returned integer corresponds to such a
-                 bitmask.
-    Note that you can get a binary representation of an integer in python
-    if you use the command bin(<integer-value>). All higher unneeded digits
-    will be dropped, i.e. 0b00100 is turned into 0b100. Examples are
-        bin(0) =    0b0
-        bin(1) =    0b1
-        bin(8) = 0b1000
-    Each bit value (read from right to left) corresponds to the fact that a
-    channel is on or off. I.e. if you have
-        0b001011
-    then it would mean that only channel 0, 1 and 3 are switched to on, the
-    others are off.
-    Helper method for write_pulse_form.
+        # The first line (xml declaration) is not included later and the last endline (\n) is
+        # also not neccessary.
+        # The header length is given with nine digits: xxxxxxxxx
+        text = text[text.index(b'\n') + 1:-1]
+        length_of_header = '{0:09d}'.format(len(text)).encode('UTF-8')
+
+        # The header length is written into the header
+        return text.replace(b'xxxxxxxxx', length_of_header)
+
+
+# Pulses as stored in a pstream-file: duration in ns and digital channel bitmask
+PSTREAM_DTYPE = np.dtype([('ticks', '<u4'), ('digi', 'u1')])
+# Max. duration of a single pulse
+PSTREAM_MAX_TICKS = 2**32 - 1
+
+
+def _marker_bytes(digital_samples, channel, digi_chnl_numbers):
+    """ Create the byte values corresponding to the marker states of an AWG channel
+    (1 for marker 1, 2 for marker 2, 3 for both). Marker 1 of analog channel n is the digital
+    channel 2n-1, marker 2 the digital channel 2n.
+
+    @param numpy.ndarray digital_samples: bool array [digital channel, sample]
+    @param int channel: number of the analog channel
+    @param list digi_chnl_numbers: numbers of the digital channels in digital_samples
+
+    @return numpy.ndarray: uint8 marker byte for each sample or None if no marker is active
+    """
+    marker_bytes = None
+    for bit, marker_channel in enumerate(((channel * 2) - 1, channel * 2)):
+        if marker_channel not in digi_chnl_numbers:
+            continue
+        marker = np.left_shift(
+            digital_samples[digi_chnl_numbers.index(marker_channel)].astype('uint8'), bit)
+        marker_bytes = marker if marker_bytes is None else marker_bytes + marker
+    return marker_bytes
+
+
+def _channel_bitmasks(digital_high, dig_chnl_names):
+    """ Convert the states of the digital channels into PulseStreamer bitmasks.
+
+    @param numpy.ndarray digital_high: bool array [time, digital channel]
+    @param list dig_chnl_names: names of the digital channels belonging to the columns of
+                                digital_high. The bit position is given by the channel number,
+                                i.e. 'd_ch1' is bit 0.
+
+    @return numpy.ndarray: uint8 bitmask for each row of digital_high
+    """
+    bits = np.array([1 << (int(chnl.split('ch')[-1]) - 1) for chnl in dig_chnl_names],
+                    dtype=np.uint8)
+    masks = np.zeros(digital_high.shape[0], dtype=np.uint8)
+    for column, bit in enumerate(bits):
+        masks[digital_high[:, column]] |= bit
+    return masks
+
+
+def _run_length_pulses(masks, lengths):
+    """ Merge consecutive pulses with identical bitmask. Pulses of zero length are dropped and
+    pulses longer than PSTREAM_MAX_TICKS are split.
+
+    @param numpy.ndarray masks: bitmask of each pulse
+    @param numpy.ndarray lengths: length of each pulse in bins
+
+    @return numpy.ndarray: structured array of dtype PSTREAM_DTYPE
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    non_empty = lengths > 0
+    masks = np.asarray(masks)[non_empty]
+    lengths = lengths[non_empty]
+    if masks.size == 0:
+        return np.zeros(0, dtype=PSTREAM_DTYPE)
+
+    run_starts = np.flatnonzero(np.concatenate(([True], masks[1:] != masks[:-1])))
+    run_lengths = np.add.reduceat(lengths, run_starts)
+    run_masks = masks[run_starts]
+
+    # split runs that do not fit into the ticks field
+    parts = (run_lengths + PSTREAM_MAX_TICKS - 1) // PSTREAM_MAX_TICKS
+    pulses = np.zeros(np.sum(parts), dtype=PSTREAM_DTYPE)
+    pulses['digi'] = np.repeat(run_masks, parts)
+    ticks = np.full(pulses.size, PSTREAM_MAX_TICKS, dtype=np.int64)
+    last_parts = np.cumsum(parts) - 1
+    ticks[last_parts] = run_lengths - (parts - 1) * PSTREAM_MAX_TICKS
+    pulses['ticks'] = ticks
+    return pulses
+
+
+def _save_pstream_file(filepath, pulses):
+    """ Write pulses to a pstream-file. The file is in numpy .npy format containing a structured
+    array of dtype PSTREAM_DTYPE (5 bytes per pulse) and can be read with numpy.load.
+
+    @param str filepath: full path of the file to write
+    @param numpy.ndarray pulses: structured array of dtype PSTREAM_DTYPE
     """
-    bits = 0  # that corresponds to: 0b0
-    active_channels = np.where(active_channels == True)
-    for channel in active_channels[0]:
-        # go through each list element and create the digital word out of
-        # 0 and 1 that represents the channel configuration. In order to do
-        # that a bitwise shift to the left (<< operator) is performed and
-        # the current channel configuration is compared with a bitwise OR
-        # to check whether the bit was already set. E.g.:
-        #   0b1001 | 0b0110: compare elementwise:
-        #           1 | 0 => 1
-        #           0 | 1 => 1
-        #           0 | 1 => 1
-        #           1 | 1 => 1
-        #                   => 0b1111
-        bits = bits | (1 << channel)
-    return bits
+    with open(filepath, 'wb') as pstream_file:
+        np.save(pstream_file, np.asarray(pulses, dtype=PSTREAM_DTYPE), allow_pickle=False)
@@ -44,6 +44,10 @@ class SamplingFunctions():
         self._math_func['DoubleSinGauss']   = self._doublesingauss
         self._math_func['TripleSinGauss']   = self._triplesingauss
 
+        # Functions which do not depend on the time (constant output). These are evaluated only
+        # once per element during sampling.
+        self._time_independent_functions = {'Idle', 'DC'}
+
         # Definition of constraints for the parameters
         # --------------------------------------------
         # Mathematical parameters may be subjected to certain constraints
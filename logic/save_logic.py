@@ -19,25 +19,38 @@ Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
 top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
 """
 
+from concurrent.futures import Future
 from cycler import cycler
+import copy
 import datetime
-import inspect
+import json
 import logging
 import matplotlib.pyplot as plt
 import numpy as np
 import os
+import queue
 import sys
+import threading
 import time
+import zipfile
 
 from collections import OrderedDict
 from core.module import ConfigOption
 from core.util import units
 from core.util.mutex import Mutex
 from logic.generic_logic import GenericLogic
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.backends.backend_pdf import PdfPages
 from PIL import Image
 from PIL import PngImagePlugin
 
+# h5py is optional, the binary data is saved as npz without it
+try:
+    import h5py
+    has_h5py = True
+except ImportError:
+    has_h5py = False
+
 
 class DailyLogHandler(logging.FileHandler):
     """
@@ -127,6 +140,13 @@ class SaveLogic(GenericLogic):
     _unix_data_dir = ConfigOption('unix_data_directory', 'Data')
     log_into_daily_directory = ConfigOption('log_into_daily_directory', False, missing='warn')
 
+    # number of threads writing data in the background and max. number of waiting save jobs
+    _number_of_save_workers = ConfigOption('save_workers', 2)
+    _save_queue_size = ConfigOption('save_queue_size', 32)
+
+    # file extensions of the generated filenames for each filetype
+    _file_extensions = {'text': '.dat', 'hdf5': '.h5', 'npz': '.npz'}
+
     # Matplotlib style definition for saving plots
     mpl_qd_style = {
         'axes.prop_cycle': cycler(
@@ -187,6 +207,12 @@ class SaveLogic(GenericLogic):
 
         self._daily_loghandler = None
 
+        # background saving (see save_data_async)
+        self._save_queue = queue.Queue(maxsize=max(self._save_queue_size, 1))
+        self._save_workers = list()
+        self._save_statistics_lock = threading.Lock()
+        self._reset_save_statistics()
+
     def on_activate(self):
         """ Definition, configuration and initialisation of the SaveLogic.
         """
@@ -201,8 +227,12 @@ class SaveLogic(GenericLogic):
             logging.getLogger().addHandler(self._daily_loghandler)
         else:
             self._daily_loghandler = None
+        self._reset_save_statistics()
+        self._start_save_workers()
 
     def on_deactivate(self):
+        # write everything still in the save queue
+        self._stop_save_workers()
         if self._daily_loghandler is not None:
             # removes the log handler logging into the daily directory
             logging.getLogger().removeHandler(self._daily_loghandler)
@@ -223,7 +253,8 @@ class SaveLogic(GenericLogic):
         self._daily_loghandler.setLevel(level)
 
     def save_data(self, data, filepath=None, parameters=None, filename=None, filelabel=None,
-                  timestamp=None, filetype='text', fmt='%.15e', delimiter='\t', plotfig=None):
+                  timestamp=None, filetype='text', fmt='%.15e', delimiter='\t', plotfig=None,
+                  module_name=None):
         """
         General save routine for data.
 
@@ -269,7 +300,11 @@ class SaveLogic(GenericLogic):
                                    filename and a timestamp, because then the timestamp will be
                                    ignored.
         @param string filetype: optional, the file format the data should be saved in. Valid inputs
-                                are 'text', 'xml' and 'npz'. Default is 'text'.
+                                are 'text', 'hdf5' and 'npz'. Default is 'text'.
+                                The binary formats store each data item as a separate array
+                                (named by its key) and the parameters as attributes. 'hdf5'
+                                falls back to 'npz' if h5py is not installed. The files can
+                                be extended with append_data and read with load_data.
         @param string or list of strings fmt: optional, format specifier for saved data. See python
                                               documentation for
                                               "Format Specification Mini-Language". If you want for
@@ -284,6 +319,11 @@ class SaveLogic(GenericLogic):
                                               behaviour or failure to save right away.
         @param string delimiter: optional, insert here the delimiter, like '\n' for new line, '\t'
                                  for tab, ',' for a comma ect.
+        @param matplotlib.figure.Figure plotfig: optional, a figure which is saved as pdf and png
+                                                 next to the data file and closed afterwards.
+        @param string module_name: optional, the name of the calling module used for the header,
+                                   the filelabel and the default filepath. It is determined from
+                                   the call stack if not passed.
 
         1D data
         =======
@@ -319,6 +359,10 @@ class SaveLogic(GenericLogic):
         if timestamp is None:
             timestamp = datetime.datetime.now()
 
+        if filetype == 'hdf5' and not has_h5py:
+            self.log.warning('h5py is not installed. Saving data as npz file instead of hdf5.')
+            filetype = 'npz'
+
         # Try to cast data array into numpy.ndarray if it is not already one
         # Also collect information on arrays in the process and do sanity checks
         found_1d = False
@@ -370,16 +414,8 @@ class SaveLogic(GenericLogic):
             return -1
 
         # try to trace back the functioncall to the class which was calling it.
-        try:
-            frm = inspect.stack()[1]
-            # this will get the object, which called the save_data function.
-            mod = inspect.getmodule(frm[0])
-            # that will extract the name of the class.
-            module_name = mod.__name__.split('.')[-1]
-        except:
-            # Sometimes it is not possible to get the object which called the save_data function
-            # (such as when calling this from the console).
-            module_name = 'UNSPECIFIED'
+        if module_name is None:
+            module_name = self._get_caller_module_name()
 
         # determine proper file path
         if filepath is None:
@@ -397,89 +433,92 @@ class SaveLogic(GenericLogic):
 
         # determine proper unique filename to save if none has been passed
         if filename is None:
-            filename = timestamp.strftime('%Y%m%d-%H%M-%S' + '_' + filelabel + '.dat')
-
-        # Check format specifier.
-        if not isinstance(fmt, str) and len(fmt) != len(data):
-            self.log.error('Length of list of format specifiers and number of data items differs. '
-                           'Saving not possible. Please pass exactly as many format specifiers as '
-                           'data arrays.')
-            return -1
-
-        # Reshape data if multiple 1D arrays have been passed to this method.
-        # If a 2D array has been passed, reformat the specifier
-        if len(data) != 1:
-            identifier_str = ''
-            if multiple_dtypes:
-                field_dtypes = list(zip(['f{0:d}'.format(i) for i in range(len(arr_dtype))],
-                                        arr_dtype))
-                new_array = np.empty(max_line_num, dtype=field_dtypes)
-                for i, keyname in enumerate(data):
-                    identifier_str += keyname + delimiter
-                    field = 'f{0:d}'.format(i)
-                    length = data[keyname].size
-                    new_array[field][:length] = data[keyname]
-                    if length < max_line_num:
-                        if isinstance(data[keyname][0], str):
-                            new_array[field][length:] = 'nan'
-                        else:
-                            new_array[field][length:] = np.nan
-            else:
-                new_array = np.empty([max_line_num, max_row_num], arr_dtype[0])
-                for i, keyname in enumerate(data):
-                    identifier_str += keyname + delimiter
-                    length = data[keyname].size
-                    new_array[:length, i] = data[keyname]
-                    if length < max_line_num:
-                        if isinstance(data[keyname][0], str):
-                            new_array[length:, i] = 'nan'
-                        else:
-                            new_array[length:, i] = np.nan
-            # discard old data array and use new one
-            data = {identifier_str: new_array}
-        elif found_2d:
-            keyname = list(data.keys())[0]
-            identifier_str = keyname.replace(', ', delimiter).replace(',', delimiter)
-            data[identifier_str] = data.pop(keyname)
+            filename = timestamp.strftime('%Y%m%d-%H%M-%S' + '_' + filelabel
+                                          + self._file_extensions.get(filetype, '.dat'))
+
+        if filetype in ('hdf5', 'npz'):
+            filename = self._save_data_binary(data=data, filepath=filepath, filename=filename,
+                                              parameters=parameters, module_name=module_name,
+                                              timestamp=timestamp, filetype=filetype)
+            if filename is None:
+                return -1
         else:
-            identifier_str = list(data)[0]
+            # Check format specifier.
+            if not isinstance(fmt, str) and len(fmt) != len(data):
+                self.log.error('Length of list of format specifiers and number of data items differs. '
+                               'Saving not possible. Please pass exactly as many format specifiers as '
+                               'data arrays.')
+                return -1
 
-        # Create header string for the file
-        header = 'Saved Data from the class {0} on {1}.\n' \
-                 ''.format(module_name, timestamp.strftime('%d.%m.%Y at %Hh%Mm%Ss'))
-        header += '\nParameters:\n===========\n\n'
-        # Include the active POI name (if not empty) as a parameter in the header
-        if self.active_poi_name != '':
-            header += 'Measured at POI: {0}\n'.format(self.active_poi_name)
-        # add the parameters if specified:
-        if parameters is not None:
-            # check whether the format for the parameters have a dict type:
-            if isinstance(parameters, dict):
-                for entry, param in parameters.items():
-                    if isinstance(param, float):
-                        header += '{0}: {1:.16e}\n'.format(entry, param)
-                    else:
-                        header += '{0}: {1}\n'.format(entry, param)
-            # make a hardcore string conversion and try to save the parameters directly:
+            # Reshape data if multiple 1D arrays have been passed to this method.
+            # If a 2D array has been passed, reformat the specifier
+            if len(data) != 1:
+                identifier_str = ''
+                if multiple_dtypes:
+                    field_dtypes = list(zip(['f{0:d}'.format(i) for i in range(len(arr_dtype))],
+                                            arr_dtype))
+                    new_array = np.empty(max_line_num, dtype=field_dtypes)
+                    for i, keyname in enumerate(data):
+                        identifier_str += keyname + delimiter
+                        field = 'f{0:d}'.format(i)
+                        length = data[keyname].size
+                        new_array[field][:length] = data[keyname]
+                        if length < max_line_num:
+                            if isinstance(data[keyname][0], str):
+                                new_array[field][length:] = 'nan'
+                            else:
+                                new_array[field][length:] = np.nan
+                else:
+                    new_array = np.empty([max_line_num, max_row_num], arr_dtype[0])
+                    for i, keyname in enumerate(data):
+                        identifier_str += keyname + delimiter
+                        length = data[keyname].size
+                        new_array[:length, i] = data[keyname]
+                        if length < max_line_num:
+                            if isinstance(data[keyname][0], str):
+                                new_array[length:, i] = 'nan'
+                            else:
+                                new_array[length:, i] = np.nan
+                # discard old data array and use new one
+                data = {identifier_str: new_array}
+            elif found_2d:
+                keyname = list(data.keys())[0]
+                identifier_str = keyname.replace(', ', delimiter).replace(',', delimiter)
+                data[identifier_str] = data.pop(keyname)
             else:
-                self.log.error('The parameters are not passed as a dictionary! The SaveLogic will '
-                               'try to save the parameters nevertheless.')
-                header += 'not specified parameters: {0}\n'.format(parameters)
-        header += '\nData:\n=====\n'
-        header += list(data)[0]
-
-        # write data to file
-        # FIXME: Implement other file formats
-        if filetype == 'text':
-            self.save_array_as_text(data=data[identifier_str], filename=filename, filepath=filepath,
-                                    fmt=fmt, header=header, delimiter=delimiter, comments='#',
-                                    append=False)
-        else:
-            self.log.error('Only saving of data as textfile is implemented. Filetype "{0}" is not '
-                           'supported yet. Saving as textfile.'.format(filetype))
-            self.save_array_as_text(data=data[identifier_str], filename=filename, filepath=filepath,
-                                    fmt=fmt, header=header, delimiter=delimiter, comments='#',
-                                    append=False)
+                identifier_str = list(data)[0]
+
+            # Create header string for the file
+            header = 'Saved Data from the class {0} on {1}.\n' \
+                     ''.format(module_name, timestamp.strftime('%d.%m.%Y at %Hh%Mm%Ss'))
+            header += '\nParameters:\n===========\n\n'
+            # Include the active POI name (if not empty) as a parameter in the header
+            if self.active_poi_name != '':
+                header += 'Measured at POI: {0}\n'.format(self.active_poi_name)
+            # add the parameters if specified:
+            if parameters is not None:
+                # check whether the format for the parameters have a dict type:
+                if isinstance(parameters, dict):
+                    for entry, param in parameters.items():
+                        if isinstance(param, float):
+                            header += '{0}: {1:.16e}\n'.format(entry, param)
+                        else:
+                            header += '{0}: {1}\n'.format(entry, param)
+                # make a hardcore string conversion and try to save the parameters directly:
+                else:
+                    self.log.error('The parameters are not passed as a dictionary! The SaveLogic will '
+                                   'try to save the parameters nevertheless.')
+                    header += 'not specified parameters: {0}\n'.format(parameters)
+            header += '\nData:\n=====\n'
+            header += list(data)[0]
+
+            # write data to file
+            if filetype != 'text':
+                self.log.error('Filetype "{0}" is not supported. Valid filetypes are "text", '
+                               '"hdf5" and "npz". Saving as textfile.'.format(filetype))
+            self.save_array_as_text(data=data[identifier_str], filename=filename,
+                                    filepath=filepath, fmt=fmt, header=header,
+                                    delimiter=delimiter, comments='#', append=False)
 
         #--------------------------------------------------------------------------------------------
         # Save thumbnail figure of plot
@@ -499,7 +538,7 @@ class SaveLogic(GenericLogic):
                 metadata['ModDate'] = time
 
             # determine the PDF-Filename
-            fig_fname_vector = os.path.join(filepath, filename)[:-4] + '_fig.pdf'
+            fig_fname_vector = os.path.splitext(os.path.join(filepath, filename))[0] + '_fig.pdf'
 
             # Create the PdfPages object to which we will save the pages:
             # The with statement makes sure that the PdfPages object is closed properly at
@@ -513,7 +552,7 @@ class SaveLogic(GenericLogic):
                     pdf_metadata[x] = metadata[x]
 
             # determine the PNG-Filename and save the plain PNG
-            fig_fname_image = os.path.join(filepath, filename)[:-4] + '_fig.png'
+            fig_fname_image = os.path.splitext(os.path.join(filepath, filename))[0] + '_fig.png'
             plotfig.savefig(fig_fname_image, bbox_inches='tight', pad_inches=0.05)
 
             # Use Pillow (an fork for PIL) to attach metadata to the PNG
@@ -540,6 +579,167 @@ class SaveLogic(GenericLogic):
             self.log.debug('Time needed to save data: {0:.2f}s'.format(time.time()-start_time))
             #----------------------------------------------------------------------------------
 
+    def save_data_async(self, data, filepath=None, parameters=None, filename=None, filelabel=None,
+                        timestamp=None, filetype='text', fmt='%.15e', delimiter='\t',
+                        plotfig=None):
+        """
+        Same as save_data, but the file is written in the background by the save workers.
+
+        A snapshot of data and parameters is taken, so the caller can continue to modify its
+        arrays right away. The calling module and the timestamp are determined at the time of the
+        call. If a plotfig is passed it is detached from pyplot and rendered by the save worker
+        as well, so it must not be used by the caller afterwards.
+        If the save queue is full this call blocks until a slot is free. If the SaveLogic is not
+        activated the data is saved right away.
+
+        @return concurrent.futures.Future: future of the save job. Its result is the return value
+                                           of save_data (None on success, -1 on failure).
+        """
+        if timestamp is None:
+            timestamp = datetime.datetime.now()
+        kwargs = dict(filepath=filepath, filename=filename, filelabel=filelabel,
+                      timestamp=timestamp, filetype=filetype, fmt=fmt, delimiter=delimiter,
+                      module_name=self._get_caller_module_name())
+
+        # immutable snapshot of the data
+        kwargs['data'] = OrderedDict((keyname, np.array(item, copy=True))
+                                     for keyname, item in data.items())
+        try:
+            kwargs['parameters'] = copy.deepcopy(parameters)
+        except Exception:
+            kwargs['parameters'] = copy.copy(parameters)
+        if plotfig is not None:
+            # remove the figure from pyplot (GUI backend) and render it with Agg in the worker
+            plt.close(plotfig)
+            FigureCanvasAgg(plotfig)
+            kwargs['plotfig'] = plotfig
+
+        future = Future()
+        if not self._save_workers:
+            self._run_save_job(future, time.time(), kwargs)
+            return future
+        self._save_queue.put((future, time.time(), kwargs))
+        with self._save_statistics_lock:
+            self._save_statistics['queued'] += 1
+            self._save_statistics['max_queue_depth'] = max(
+                self._save_statistics['max_queue_depth'], self._save_queue.qsize())
+        return future
+
+    def flush(self, timeout=None):
+        """
+        Waits until all data handed over to save_data_async is written.
+
+        @param float timeout: optional, max. time to wait in seconds. Waits forever if None.
+
+        @return bool: True if all save jobs are done, False if the timeout has passed
+        """
+        with self._save_queue.all_tasks_done:
+            return self._save_queue.all_tasks_done.wait_for(
+                lambda: self._save_queue.unfinished_tasks == 0, timeout)
+
+    def get_save_statistics(self):
+        """
+        Returns the metrics of the background save workers.
+
+        @return dict: current and max. number of save jobs waiting in the queue, number of queued,
+                      completed and failed jobs, last, mean and max. latency from the
+                      save_data_async call to the finished file and last, mean and max. time
+                      needed to write a file (all times in seconds).
+        """
+        with self._save_statistics_lock:
+            statistics = dict(self._save_statistics)
+        statistics['queue_depth'] = self._save_queue.qsize()
+        finished = statistics['completed'] + statistics['failed']
+        statistics['mean_latency'] = statistics.pop('total_latency') / max(finished, 1)
+        statistics['mean_write_time'] = statistics.pop('total_write_time') / max(finished, 1)
+        return statistics
+
+    def _reset_save_statistics(self):
+        with self._save_statistics_lock:
+            self._save_statistics = {'queued': 0, 'completed': 0, 'failed': 0,
+                                     'max_queue_depth': 0, 'last_latency': 0.0,
+                                     'max_latency': 0.0, 'total_latency': 0.0,
+                                     'last_write_time': 0.0, 'max_write_time': 0.0,
+                                     'total_write_time': 0.0}
+
+    def _start_save_workers(self):
+        """ Starts the threads writing the data handed over to save_data_async. """
+        self._save_workers = list()
+        for index in range(max(self._number_of_save_workers, 1)):
+            worker = threading.Thread(target=self._save_worker_loop,
+                                      name='SaveLogicWorker{0:d}'.format(index), daemon=True)
+            worker.start()
+            self._save_workers.append(worker)
+
+    def _stop_save_workers(self):
+        """ Writes all queued data and stops the save worker threads. """
+        workers = self._save_workers
+        # new save jobs are written synchronously from now on
+        self._save_workers = list()
+        for worker in workers:
+            self._save_queue.put(None)
+        for worker in workers:
+            worker.join()
+
+    def _save_worker_loop(self):
+        """ Writes save jobs from the queue until a None is received. """
+        while True:
+            job = self._save_queue.get()
+            try:
+                if job is None:
+                    break
+                self._run_save_job(*job)
+            finally:
+                self._save_queue.task_done()
+
+    def _run_save_job(self, future, submit_time, kwargs):
+        """ Calls save_data with the arguments of a save job and sets the result of its future.
+
+        @param concurrent.futures.Future future: the future of the save job
+        @param float submit_time: the time the job was created (time.time())
+        @param dict kwargs: the keyword arguments for save_data
+        """
+        if not future.set_running_or_notify_cancel():
+            return
+        start_time = time.time()
+        try:
+            result = self.save_data(**kwargs)
+        except Exception as e:
+            self.log.exception('Saving data in the background failed.')
+            result = -1
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+        end_time = time.time()
+        with self._save_statistics_lock:
+            statistics = self._save_statistics
+            statistics['failed' if result == -1 else 'completed'] += 1
+            statistics['last_latency'] = end_time - submit_time
+            statistics['max_latency'] = max(statistics['max_latency'], end_time - submit_time)
+            statistics['total_latency'] += end_time - submit_time
+            statistics['last_write_time'] = end_time - start_time
+            statistics['max_write_time'] = max(statistics['max_write_time'],
+                                               end_time - start_time)
+            statistics['total_write_time'] += end_time - start_time
+
+    def _get_caller_module_name(self, depth=2):
+        """
+        Get the name of the module the calling method belongs to.
+
+        @param int depth: number of frames to go back in the call stack (2: caller of the method
+                          calling this one)
+
+        @return str: the name of the module without package, 'UNSPECIFIED' if it can not be
+                     determined (e.g. when called from the console)
+        """
+        try:
+            # cheap lookup of the global namespace instead of inspecting the whole stack
+            module_name = sys._getframe(depth).f_globals['__name__']
+            return module_name.split('.')[-1]
+        except Exception:
+            return 'UNSPECIFIED'
+
     def save_array_as_text(self, data, filename, filepath='', fmt='%.15e', header='',
                            delimiter='\t', comments='#', append=False):
         """
@@ -557,6 +757,151 @@ class SaveLogic(GenericLogic):
                            comments=comments)
         return
 
+    def _save_data_binary(self, data, filepath, filename, parameters, module_name, timestamp,
+                          filetype):
+        """
+        Saves the data items as separate arrays in a hdf5 or npz file. The header information and
+        the parameters are saved as attributes.
+
+        @param dict data: data items as numpy.ndarrays (see save_data)
+        @param str filepath: the directory to save the file in
+        @param str filename: the name of the file
+        @param dict parameters: the parameters to save with the data
+        @param str module_name: the name of the calling module
+        @param datetime timestamp: the timestamp of the data
+        @param str filetype: 'hdf5' or 'npz'
+
+        @return str: the name of the saved file, None if saving failed
+        """
+        attributes = OrderedDict()
+        attributes['module'] = module_name
+        attributes['timestamp'] = timestamp.strftime('%Y-%m-%dT%H:%M:%S.%f')
+        if self.active_poi_name != '':
+            attributes['Measured at POI'] = self.active_poi_name
+        if isinstance(parameters, dict):
+            attributes.update(parameters)
+        elif parameters is not None:
+            self.log.error('The parameters are not passed as a dictionary! The SaveLogic will '
+                           'try to save the parameters nevertheless.')
+            attributes['not specified parameters'] = str(parameters)
+
+        try:
+            if filetype == 'hdf5':
+                with h5py.File(os.path.join(filepath, filename), 'w') as h5file:
+                    for entry, param in attributes.items():
+                        _set_hdf5_attribute(h5file.attrs, entry, param)
+                    for keyname, array in data.items():
+                        _create_hdf5_dataset(h5file, keyname, array)
+            else:
+                arrays = OrderedDict()
+                arrays[NPZ_ATTRIBUTES_KEY] = np.array(json.dumps(attributes, default=str))
+                arrays.update(data)
+                with open(os.path.join(filepath, filename), 'wb') as npzfile:
+                    np.savez(npzfile, **arrays)
+        except Exception:
+            self.log.exception('Saving data as {0} file "{1}" failed.'.format(filetype, filename))
+            return None
+        return filename
+
+    def append_data(self, data, filepath, filename):
+        """
+        Appends new rows to the data items of a file created by save_data. The file type is
+        determined by the file extension. This way long running traces can be saved in chunks
+        while they are measured and saving can be resumed at any time.
+
+        hdf5: the datasets are resized along the first axis and the rows are written at the end.
+              Data items not yet in the file are created.
+        npz:  the rows are added as additional arrays '<key>::<chunk number>' to the zip archive.
+              Use load_data to read back the concatenated arrays.
+        text: the data items are written as columns at the end of the file (without header).
+
+        @param dict data: the rows to append. Keys and number of columns (2D arrays) must match
+                          the data items of the file.
+        @param str filepath: the directory of the file
+        @param str filename: the name of the file
+
+        @return int: error code (0: OK, -1: error)
+        """
+        path = os.path.join(filepath, filename)
+        if not os.path.isfile(path):
+            self.log.error('Unable to append data. File "{0}" does not exist.'.format(path))
+            return -1
+        extension = os.path.splitext(filename)[1].lower()
+        if extension in ('.h5', '.hdf5') and not has_h5py:
+            self.log.error('Unable to append data to hdf5 file. h5py is not installed.')
+            return -1
+        try:
+            data = OrderedDict((key, np.asarray(value)) for key, value in data.items())
+            if extension in ('.h5', '.hdf5'):
+                with h5py.File(path, 'a') as h5file:
+                    for keyname, array in data.items():
+                        dataset_name = _hdf5_dataset_name(keyname)
+                        if dataset_name not in h5file:
+                            _create_hdf5_dataset(h5file, keyname, array)
+                            continue
+                        dataset = h5file[dataset_name]
+                        array = _hdf5_compatible(array).reshape((-1, ) + dataset.shape[1:])
+                        old_length = dataset.shape[0]
+                        dataset.resize(old_length + array.shape[0], axis=0)
+                        dataset[old_length:] = array
+            elif extension == '.npz':
+                with zipfile.ZipFile(path, mode='a', allowZip64=True) as npzfile:
+                    names = npzfile.namelist()
+                    for keyname, array in data.items():
+                        chunk = 0
+                        while '{0}::{1:d}.npy'.format(keyname, chunk + 1) in names:
+                            chunk += 1
+                        member = '{0}::{1:d}.npy'.format(keyname, chunk + 1)
+                        if keyname + '.npy' not in names:
+                            member = keyname + '.npy'
+                        with npzfile.open(member, 'w', force_zip64=True) as npyfile:
+                            np.lib.format.write_array(npyfile, array, allow_pickle=False)
+            else:
+                self.save_array_as_text(data=np.column_stack(list(data.values())),
+                                        filename=filename, filepath=filepath, append=True)
+        except Exception:
+            self.log.exception('Appending data to file "{0}" failed.'.format(path))
+            return -1
+        return 0
+
+    def load_data(self, filepath, filename):
+        """
+        Reads a hdf5 or npz file created by save_data (and append_data).
+
+        @param str filepath: the directory of the file
+        @param str filename: the name of the file
+
+        @return (OrderedDict, dict): the data items as numpy.ndarrays and the saved attributes
+                                     (module, timestamp and parameters)
+        """
+        path = os.path.join(filepath, filename)
+        data = OrderedDict()
+        if os.path.splitext(filename)[1].lower() in ('.h5', '.hdf5'):
+            if not has_h5py:
+                self.log.error('Unable to load hdf5 file. h5py is not installed.')
+                return data, dict()
+            with h5py.File(path, 'r') as h5file:
+                attributes = dict(h5file.attrs)
+                datasets = sorted(h5file.values(), key=lambda dataset: dataset.attrs.get('index', 0))
+                for dataset in datasets:
+                    data[dataset.attrs.get('name', dataset.name.lstrip('/'))] = dataset[()]
+            return data, attributes
+
+        chunks = OrderedDict()
+        with np.load(path, allow_pickle=False) as npzfile:
+            attributes = json.loads(str(npzfile[NPZ_ATTRIBUTES_KEY]))
+            for member in npzfile.files:
+                if member == NPZ_ATTRIBUTES_KEY:
+                    continue
+                keyname, _, chunk = member.rpartition('::')
+                if not keyname or not chunk.isdigit():
+                    keyname, chunk = member, 0
+                chunks.setdefault(keyname, []).append((int(chunk), npzfile[member]))
+        for keyname, arrays in chunks.items():
+            arrays = [array for chunk, array in sorted(arrays, key=lambda item: item[0])]
+            data[keyname] = arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
+        return data, attributes
+
     def get_daily_directory(self):
         """
         Creates the daily directory.
@@ -624,3 +969,43 @@ class SaveLogic(GenericLogic):
         if not os.path.exists(dir_path):
             os.makedirs(dir_path)
         return dir_path
+
+
+# name of the array holding the header attributes (json) in npz files
+NPZ_ATTRIBUTES_KEY = '__attributes__'
+
+
+def _hdf5_dataset_name(keyname):
+    """ Dataset name for a data key. '/' would create a group in hdf5. """
+    return keyname.replace('/', '|')
+
+
+def _hdf5_compatible(array):
+    """ hdf5 has no unicode string type, strings are stored as UTF-8 bytes. """
+    if array.dtype.kind == 'U':
+        return np.char.encode(array, 'UTF-8')
+    return array
+
+
+def _create_hdf5_dataset(h5file, keyname, array):
+    """ Create a dataset which can be extended along the first axis. The data key is saved as
+    attribute 'name' and the position in the data dict as attribute 'index' of the dataset.
+    """
+    index = len(h5file)
+    array = _hdf5_compatible(np.asarray(array))
+    if array.ndim == 0:
+        dataset = h5file.create_dataset(_hdf5_dataset_name(keyname), data=array)
+    else:
+        dataset = h5file.create_dataset(_hdf5_dataset_name(keyname), data=array, chunks=True,
+                                        maxshape=(None, ) + array.shape[1:])
+    dataset.attrs['name'] = keyname
+    dataset.attrs['index'] = index
+    return dataset
+
+
+def _set_hdf5_attribute(attrs, name, value):
+    """ Save a parameter as hdf5 attribute. Values hdf5 can not handle are saved as string. """
+    try:
+        attrs[name] = value
+    except (TypeError, ValueError):
+        attrs[name] = str(value)
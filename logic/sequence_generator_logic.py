@@ -26,11 +26,13 @@ import numpy as np
 import os
 import pickle
 import sys
+import threading
 import time
 
+from concurrent.futures import ThreadPoolExecutor
 from qtpy import QtCore
 from collections import OrderedDict
-from core.module import StatusVar
+from core.module import ConfigOption, StatusVar
 from core.util.modules import get_home_dir
 from core.util.modules import get_main_dir
 
@@ -75,6 +77,13 @@ class SequenceGeneratorLogic(GenericLogic, SamplingFunctions, SamplesWriteMethod
     sample_rate = StatusVar('sample_rate', 25e9)
     waveform_format = StatusVar('waveform_format', 'wfmx')
 
+    # number of threads to sample an ensemble with (0: number of CPUs, 1: serial sampling)
+    _sampling_threads = ConfigOption('sampling_threads', 0)
+    # an ensemble is only split into chunks of at least this number of samples
+    _min_samples_per_chunk = ConfigOption('min_samples_per_chunk', 2**20)
+    # max. memory in bytes for samples of repeated elements without rotating frame
+    _sample_cache_max_bytes = ConfigOption('sample_cache_bytes', 256 * 2**20)
+
     # define signals
     sigBlockDictUpdated = QtCore.Signal(dict)
     sigEnsembleDictUpdated = QtCore.Signal(dict)
@@ -169,6 +178,10 @@ class SequenceGeneratorLogic(GenericLogic, SamplingFunctions, SamplesWriteMethod
         # a dictionary with all predefined generator methods and measurement sequence names
         self.generate_methods = None
 
+        # LRU cache for the samples of repeated elements (see _sample_element)
+        self._sample_cache_lock = threading.Lock()
+        self.clear_sample_cache()
+
     def on_activate(self):
         """ Initialisation performed during activation of the module.
         """
@@ -186,6 +199,7 @@ class SequenceGeneratorLogic(GenericLogic, SamplingFunctions, SamplesWriteMethod
     def on_deactivate(self):
         """ Deinitialisation performed during deactivation of the module.
         """
+        self.clear_sample_cache()
         return
 
     def _attach_predefined_methods(self):
@@ -748,6 +762,180 @@ class SequenceGeneratorLogic(GenericLogic, SamplingFunctions, SamplesWriteMethod
 
         return number_of_samples, total_elements, elements_length_bins, digital_rising_bins
 
+    def _get_element_sampling_plan(self, ensemble, length_elements_bins, offset_bin=0):
+        """ Unrolls all blocks and repetitions of a PulseBlockEnsemble and determines where each
+        PulseBlockElement is placed in the sample arrays.
+
+        @param ensemble: A PulseBlockEnsemble object (see logic.pulse_objects.py)
+        @param numpy.ndarray length_elements_bins: element lengths in bins as returned by
+                                                   _analyze_block_ensemble
+        @param int offset_bin: time bin offset of the first element (rotating frame)
+
+        @return list, int: list of tuples (block_element, start_bin, length_bins, time_offset_bin)
+                           in chronological order and the time bin offset after the last element.
+                           start_bin is the index of the first sample of the element in the
+                           sample arrays, time_offset_bin the bin the time array of the element
+                           starts with.
+        """
+        element_plan = list()
+        start_bin = 0
+        element_count = 0
+        for block, reps in ensemble.block_list:
+            for rep_no in range(reps+1):
+                for block_element in block.element_list:
+                    element_length_bins = int(length_elements_bins[element_count])
+                    element_plan.append((block_element, start_bin, element_length_bins,
+                                         offset_bin))
+                    element_count += 1
+                    start_bin += element_length_bins
+                    # if the rotating frame should be preserved (default) increment the offset
+                    # counter for the time array.
+                    if ensemble.rotating_frame:
+                        offset_bin += element_length_bins
+        return element_plan, offset_bin
+
+    def _sample_element(self, block_element, length_bins, time_offset_bin, analog_samples,
+                        digital_samples, ana_chnl_names, rotating_frame=True):
+        """ Samples a single PulseBlockElement into the given (slices of the) sample arrays.
+
+        Functions that do not depend on time (see SamplingFunctions._time_independent_functions)
+        are evaluated for a single sample which is broadcast over the element. Without rotating
+        frame all repetitions of an element are identical, so the samples are taken from the
+        sample cache if possible.
+
+        @param block_element: the PulseBlockElement object to sample
+        @param int length_bins: length of the element in bins
+        @param int time_offset_bin: time bin the element starts with (rotating frame)
+        @param numpy.ndarray analog_samples: float32 array [analog channels, element length] to fill
+        @param numpy.ndarray digital_samples: bool array [digital channels, element length] to fill
+        @param list ana_chnl_names: names of the active analog channels
+        @param bool rotating_frame: the time offset changes from element to element
+        """
+        for i, state in enumerate(block_element.digital_high):
+            digital_samples[i] = state
+        if length_bins == 0:
+            return
+
+        time_arr = None
+        for i, func_name in enumerate(block_element.pulse_function):
+            parameters = block_element.parameters[i]
+            amplitude = self.amplitude_dict[ana_chnl_names[i]]
+            if func_name in self._time_independent_functions:
+                analog_samples[i] = np.float32(
+                    self._math_func[func_name](np.zeros(1), parameters) / amplitude)
+                continue
+
+            if not rotating_frame:
+                key = (func_name, tuple(sorted(parameters.items())), length_bins,
+                       time_offset_bin, self.sample_rate, amplitude)
+                samples = self._get_cached_samples(key)
+                if samples is not None:
+                    analog_samples[i] = samples
+                    continue
+
+            if time_arr is None:
+                # create floating point time array for the current element inside rotating frame
+                time_arr = (time_offset_bin + np.arange(length_bins, dtype='float64')) / self.sample_rate
+            analog_samples[i] = np.float32(self._math_func[func_name](time_arr, parameters)
+                                           / amplitude)
+            if not rotating_frame:
+                self._add_cached_samples(key, analog_samples[i])
+        return
+
+    def _get_cached_samples(self, key):
+        """ Looks up the samples of a single analog channel of an element in the sample cache.
+
+        @param tuple key: (function name, parameters, length in bins, time offset in bins,
+                          sample rate, channel amplitude)
+
+        @return numpy.ndarray: the cached float32 samples or None if not cached
+        """
+        with self._sample_cache_lock:
+            samples = self._sample_cache.get(key)
+            if samples is None:
+                self.sample_cache_misses += 1
+            else:
+                self._sample_cache.move_to_end(key)
+                self.sample_cache_hits += 1
+        return samples
+
+    def _add_cached_samples(self, key, samples):
+        """ Stores a copy of the samples in the sample cache. The least recently used entries are
+        dropped if the cache exceeds the config option "sample_cache_bytes".
+
+        @param tuple key: key as passed to _get_cached_samples
+        @param numpy.ndarray samples: float32 samples of a single analog channel
+        """
+        if samples.nbytes > self._sample_cache_max_bytes:
+            return
+        samples = samples.copy()
+        samples.flags.writeable = False
+        with self._sample_cache_lock:
+            if key in self._sample_cache:
+                return
+            self._sample_cache[key] = samples
+            self._sample_cache_bytes += samples.nbytes
+            while self._sample_cache_bytes > self._sample_cache_max_bytes:
+                _, dropped = self._sample_cache.popitem(last=False)
+                self._sample_cache_bytes -= dropped.nbytes
+        return
+
+    def clear_sample_cache(self):
+        """ Removes all samples from the sample cache and resets the hit/miss counters. """
+        with self._sample_cache_lock:
+            self._sample_cache = OrderedDict()
+            self._sample_cache_bytes = 0
+            self.sample_cache_hits = 0
+            self.sample_cache_misses = 0
+        return
+
+    def _sample_elements(self, element_plan, analog_samples, digital_samples, ana_chnl_names,
+                         rotating_frame=True):
+        """ Fills the preallocated sample arrays of a whole PulseBlockEnsemble.
+
+        The elements are split into contiguous chunks of similar sample count which write into
+        disjoint slices of the sample arrays. If more than one sampling thread is configured the
+        chunks are sampled in a thread pool (the numpy math releases the GIL). Each element is
+        sampled exactly like in the serial case, so the result is bit-identical.
+
+        @param list element_plan: element placement as returned by _get_element_sampling_plan
+        @param numpy.ndarray analog_samples: float32 array [analog channels, samples] to fill
+        @param numpy.ndarray digital_samples: bool array [digital channels, samples] to fill
+        @param list ana_chnl_names: names of the active analog channels
+        @param bool rotating_frame: the ensemble is sampled in the rotating frame
+        """
+        def sample_chunk(chunk):
+            for block_element, start_bin, length_bins, time_offset_bin in chunk:
+                end_bin = start_bin + length_bins
+                self._sample_element(block_element, length_bins, time_offset_bin,
+                                     analog_samples[:, start_bin:end_bin],
+                                     digital_samples[:, start_bin:end_bin], ana_chnl_names,
+                                     rotating_frame)
+            return
+
+        number_of_samples = max(analog_samples.shape[1], digital_samples.shape[1])
+        threads = self._sampling_threads if self._sampling_threads > 0 else os.cpu_count()
+        threads = min(threads, number_of_samples // self._min_samples_per_chunk)
+        if threads < 2 or len(element_plan) < 2:
+            sample_chunk(element_plan)
+            return
+
+        # Split the elements into several chunks per thread to balance the load
+        chunk_samples = max(number_of_samples // (4 * threads), self._min_samples_per_chunk)
+        chunks = [[]]
+        chunk_start = 0
+        for element in element_plan:
+            if element[1] - chunk_start >= chunk_samples and chunks[-1]:
+                chunks.append([])
+                chunk_start = element[1]
+            chunks[-1].append(element)
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            # raise the first exception of any chunk
+            for future in [executor.submit(sample_chunk, chunk) for chunk in chunks]:
+                future.result()
+        return
+
     def sample_pulse_block_ensemble(self, ensemble_name, write_to_file=True, offset_bin=0,
                                     name_tag=None):
         """ General sampling of a PulseBlockEnsemble object, which serves as the construction plan.
@@ -789,6 +977,10 @@ class SequenceGeneratorLogic(GenericLogic, SamplingFunctions, SamplesWriteMethod
         errors. Only in the last step when a single PulseBlockElement object is sampled  these
         integer bin values are translated into a floating point time.
 
+        If the ensemble is sampled as a whole, the placement of all elements in the sample arrays
+        is determined beforehand and the elements are sampled in parallel chunks (see config
+        option "sampling_threads"). The result is identical to sampling element by element.
+
         The chunkwise write mode is used to save memory usage at the expense of time. Here for each
         PulseBlockElement the write_to_file method in the HW module is called to avoid large
         arrays inside the memory. In other words: The whole sample arrays are never created at any
@@ -870,72 +1062,59 @@ class SequenceGeneratorLogic(GenericLogic, SamplingFunctions, SamplesWriteMethod
         ensemble.amplitude_dict = self.amplitude_dict
         self.save_ensemble(ensemble_name, ensemble)
 
-        # The time bin offset for each element to be sampled to preserve rotating frame.
+        # Start index in the sample arrays and time bin offset (rotating frame) of each element
+        element_plan, offset_bin = self._get_element_sampling_plan(ensemble, length_elements_bins,
+                                                                   offset_bin)
+
+        if write_to_file and self.waveform_format in self._compile_to_file:
+            # The file format only depends on the elements themselves, so the samples are never
+            # created.
+            created_files = self._compile_to_file[self.waveform_format](filename, element_plan,
+                                                                        dig_chnl_names)
+            if created_files == -1:
+                self.log.error('Compiling PulseBlockEnsemble "{0}" to a {1} file failed.'
+                               ''.format(ensemble_name, self.waveform_format))
+                if not sequence_sampling_in_progress:
+                    self.module_state.unlock()
+                return np.array([]), np.array([]), -1
+            self.log.info('Time needed for compiling PulseBlockEnsemble to file: {0} sec'
+                          ''.format(int(np.rint(time.time() - start_time))))
+            if not sequence_sampling_in_progress:
+                self.module_state.unlock()
+            self.sigSampleEnsembleComplete.emit(filename, np.array([]), np.array([]))
+            return np.array([]), np.array([]), offset_bin
+
         if chunkwise and write_to_file:
-            # Flags and counter for chunkwise writing
+            # Flags for chunkwise writing
             is_first_chunk = True
             is_last_chunk = False
+            for element_count, (block_element, start_bin, element_length_bins,
+                                time_offset_bin) in enumerate(element_plan, 1):
+                # determine it the current element is the last one to be sampled.
+                # Toggle the is_last_chunk flag accordingly.
+                if element_count == number_of_elements:
+                    is_last_chunk = True
+
+                # allocate temporary sample arrays to contain the current element
+                analog_samples = np.empty([ana_channels, element_length_bins], dtype='float32')
+                digital_samples = np.empty([dig_channels, element_length_bins], dtype=bool)
+                self._sample_element(block_element, element_length_bins, time_offset_bin,
+                                     analog_samples, digital_samples, ana_chnl_names,
+                                     ensemble.rotating_frame)
+                # write temporary sample array to file
+                self._write_to_file[self.waveform_format](filename, analog_samples,
+                                                          digital_samples,
+                                                          number_of_samples, is_first_chunk,
+                                                          is_last_chunk)
+                # set flag to FALSE after first write
+                is_first_chunk = False
         else:
-            # Allocate huge sample arrays if chunkwise writing is disabled.
+            # Allocate huge sample arrays if chunkwise writing is disabled and fill them
+            # (in parallel if enabled)
             analog_samples = np.empty([ana_channels, number_of_samples], dtype='float32')
             digital_samples = np.empty([dig_channels, number_of_samples], dtype=bool)
-            # Starting index for the sample array entrys
-            entry_ind = 0
-
-        element_count = 0
-        # Iterate over all blocks within the PulseBlockEnsemble object
-        for block, reps in ensemble.block_list:
-            # Iterate over all repertitions of the current block
-            for rep_no in range(reps+1):
-                # Iterate over the Block_Elements inside the current block
-                for elem_ind, block_element in enumerate(block.element_list):
-                    parameters = block_element.parameters
-                    digital_high = block_element.digital_high
-                    pulse_function = block_element.pulse_function
-                    element_length_bins = length_elements_bins[element_count]
-                    element_count += 1
-
-                    # create floating point time array for the current element inside rotating frame
-                    time_arr = (offset_bin + np.arange(element_length_bins, dtype='float64')) / self.sample_rate
-
-                    if chunkwise and write_to_file:
-                        # determine it the current element is the last one to be sampled.
-                        # Toggle the is_last_chunk flag accordingly.
-                        if element_count == number_of_elements:
-                            is_last_chunk = True
-
-                        # allocate temporary sample arrays to contain the current element
-                        analog_samples = np.empty([ana_channels, element_length_bins], dtype='float32')
-                        digital_samples = np.empty([dig_channels, element_length_bins], dtype=bool)
-
-                        # actually fill the allocated sample arrays with values.
-                        for i, state in enumerate(digital_high):
-                            digital_samples[i] = np.full(element_length_bins, state, dtype=bool)
-                        for i, func_name in enumerate(pulse_function):
-                            analog_samples[i] = np.float32(self._math_func[func_name](time_arr, parameters[i])/self.amplitude_dict[ana_chnl_names[i]])
-                        # write temporary sample array to file
-                        self._write_to_file[self.waveform_format](filename, analog_samples,
-                                                                  digital_samples,
-                                                                  number_of_samples, is_first_chunk,
-                                                                  is_last_chunk)
-                        # set flag to FALSE after first write
-                        is_first_chunk = False
-                    else:
-                        # if the ensemble should be sampled as a whole (chunkwise = False) fill the
-                        # entries in the huge sample arrays
-                        for i, state in enumerate(digital_high):
-                            digital_samples[i, entry_ind:entry_ind+element_length_bins] = np.full(element_length_bins, state, dtype=bool)
-                        for i, func_name in enumerate(pulse_function):
-                            analog_samples[i, entry_ind:entry_ind+element_length_bins] = np.float32(self._math_func[func_name](time_arr, parameters[i])/self.amplitude_dict[ana_chnl_names[i]])
-
-                        # increment the index offset of the overall sample array for the next
-                        # element
-                        entry_ind += element_length_bins
-
-                    # if the rotating frame should be preserved (default) increment the offset
-                    # counter for the time array.
-                    if ensemble.rotating_frame:
-                        offset_bin += element_length_bins
+            self._sample_elements(element_plan, analog_samples, digital_samples, ana_chnl_names,
+                                  ensemble.rotating_frame)
 
         if not write_to_file:
             # return a status message with the time needed for sampling the entire ensemble as a
@@ -361,7 +361,7 @@ class WavemeterLoggerLogic(GenericLogic):
         # TODO: Does this depend on things, or do we loop fast enough to get every wavelength value?
         wavelength_recentness = np.min([5, len(self._wavelength_data)])
 
-        recent_counts = np.array(self._counter_logic._data_to_save[-count_recentness:])
+        recent_counts = self._counter_logic.get_latest_saved_data(count_recentness)
         recent_wavelengths = np.array(self._wavelength_data[-wavelength_recentness:])
 
         # The latest counts are those recorded during the recent_wavelength_window
@@ -410,7 +410,7 @@ class WavemeterLoggerLogic(GenericLogic):
         # Note: The histogram may be recalculated (bins changed, etc) from the stitched data.
         # There is no need to recompute the interpolation for the stitched data.
         if complete_histogram:
-            count_window = len(self._counter_logic._data_to_save)
+            count_window = self._counter_logic.get_saved_data_length()
             self._data_index = 0
             self.log.info('Recalcutating Laser Scanning Histogram for: '
                           '{0:d} counts and {1:d} wavelength.'.format(
@@ -419,14 +419,14 @@ class WavemeterLoggerLogic(GenericLogic):
                           )
                           )
         else:
-            count_window = min(100, len(self._counter_logic._data_to_save))
+            count_window = min(100, self._counter_logic.get_saved_data_length())
 
         if count_window < 2:
             time.sleep(self._logic_update_timing * 1e-3)
             self.sig_update_histogram_next.emit(False)
             return
 
-        temp = np.array(self._counter_logic._data_to_save[-count_window:])
+        temp = self._counter_logic.get_latest_saved_data(count_window)
 
         # only do something if there is wavelength data to work with
         if len(self._wavelength_data) > 0:
@@ -536,7 +536,7 @@ class WavemeterLoggerLogic(GenericLogic):
 
         # prepare the data in a dict or in an OrderedDict:
         data = OrderedDict()
-        data['Time (s),Signal (counts/s)'] = self._counter_logic._data_to_save
+        data['Time (s),Signal (counts/s)'] = self._counter_logic.get_saved_data()
 
         # write the parameters:
         parameters = OrderedDict()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the laser pulse extraction of ungated timetraces in logic/pulse_extraction_methods.
+
+Synthetic timetraces are extracted with the iterative "conv_deriv" method and with the vectorized
+"cached_conv_deriv" method, with and without the expected laser edges of the pulse sequence.
+The edges found by the new method have to match the true edges of the timetrace. The time of a full edge detection and of an extraction from
+cached edges is compared to the old method. Run it from the qudi main directory:
+
+python tools/pulse_extraction_benchmark.py
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import logging
+import os
+import sys
+import timeit
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from logic.pulse_extraction_methods import basic_extraction_methods
+
+
+class ExtractionStandIn:
+    """ Stand-in for PulseExtractionLogic with the extraction methods bound to it. """
+    ungated_conv_deriv = basic_extraction_methods.ungated_conv_deriv
+    ungated_cached_conv_deriv = basic_extraction_methods.ungated_cached_conv_deriv
+    _detect_laser_edges = basic_extraction_methods._detect_laser_edges
+    _gather_laser_pulses = basic_extraction_methods._gather_laser_pulses
+    _convolve_derive = basic_extraction_methods._convolve_derive
+
+    def __init__(self, number_of_lasers, expected_laser_edges=None):
+        self.log = logging.getLogger('extraction')
+        self.extraction_settings = {'conv_std_dev': 10.0}
+        self.number_of_lasers = number_of_lasers
+        self.expected_laser_edges = expected_laser_edges
+        self._edge_drift_tolerance = 5
+        self._laser_edge_cache = None
+        self.laser_edge_detections = 0
+        self._laser_buffer = None
+
+
+def make_timetrace(number_of_lasers, laser_length=300, gap_length=700, delay=37, counts=20.,
+                   seed=0):
+    """ Poissonian ungated timetrace with rectangular laser pulses of slightly varying height.
+    Returns the timetrace and the laser edges of the sequence (without delay).
+    """
+    rng = np.random.RandomState(seed)
+    period = laser_length + gap_length
+    rising = np.arange(number_of_lasers) * period + gap_length // 2
+    falling = rising + laser_length
+    rate = np.full(number_of_lasers * period, 0.5)
+    for start, height in zip(rising + delay, rng.uniform(0.8, 1.2, number_of_lasers)):
+        rate[start:start + laser_length] += counts * height
+    return rng.poisson(rate), rising, falling
+
+
+def edge_deviation(result, rising, falling):
+    """ Max. deviation of the extracted edges from the true edges of the timetrace in bins. """
+    return max(np.max(np.abs(result['laser_indices_rising'] - rising)),
+               np.max(np.abs(result['laser_indices_falling'] - falling)))
+
+
+def check_laser_array(name, result, count_data):
+    """ Compare the gathered laser array to slices of the timetrace. """
+    laser_length = result['laser_counts_arr'].shape[1]
+    for laser, start in zip(result['laser_counts_arr'], result['laser_indices_rising']):
+        reference = np.zeros(laser_length, dtype=int)
+        reference[:count_data[start:start + laser_length].size] = count_data[
+            start:start + laser_length]
+        if not np.array_equal(laser, reference):
+            raise AssertionError('Laser array of "{0}" differs from the timetrace.'.format(name))
+
+
+def compare(number_of_lasers, delay=37, repeat=3):
+    count_data, rising, falling = make_timetrace(number_of_lasers, delay=delay)
+    old = ExtractionStandIn(number_of_lasers)
+    old_deviation = edge_deviation(old.ungated_conv_deriv(count_data), rising + delay,
+                                   falling + delay)
+    old_time = min(timeit.repeat(lambda: old.ungated_conv_deriv(count_data), number=1,
+                                 repeat=repeat))
+
+    for name, expected in (('threshold', None), ('expected', (rising, falling))):
+        new = ExtractionStandIn(number_of_lasers, expected)
+        result = new.ungated_cached_conv_deriv(count_data)
+        deviation = edge_deviation(result, rising + delay, falling + delay)
+        if deviation > 3:
+            raise AssertionError('Edges of "{0}" deviate by {1:d} bins from the true edges.'
+                                 ''.format(name, deviation))
+        check_laser_array(name, result, count_data)
+
+        def detect():
+            new._laser_edge_cache = None
+            return new.ungated_cached_conv_deriv(count_data)
+        detect_time = min(timeit.repeat(detect, number=1, repeat=repeat))
+        # the following extractions reuse the cached edges
+        new.ungated_cached_conv_deriv(count_data)
+        detections = new.laser_edge_detections
+        cached_time = min(timeit.repeat(lambda: new.ungated_cached_conv_deriv(count_data),
+                                        number=1, repeat=repeat))
+        if new.laser_edge_detections != detections:
+            raise AssertionError('Cached edges of "{0}" were detected again.'.format(name))
+        print('lasers={0:<5d} {1:<9} conv_deriv: {2:9.2f} ms   detection: {3:8.2f} ms   '
+              'cached: {4:7.2f} ms   speedup: {5:6.1f}x / {6:7.1f}x   max. edge deviation '
+              '(old/new): {7:d} / {8:d} bins'
+              ''.format(number_of_lasers, name, old_time * 1e3, detect_time * 1e3,
+                        cached_time * 1e3, old_time / detect_time, old_time / cached_time,
+                        old_deviation, deviation))
+
+    # drift of the whole pattern has to trigger a new detection
+    shifted = np.roll(count_data, 50)
+    new.ungated_cached_conv_deriv(shifted)
+    if new.laser_edge_detections == detections:
+        raise AssertionError('Drift of the laser pulses was not detected.')
+
+
+if __name__ == '__main__':
+    for number_of_lasers in (50, 200, 1000):
+        compare(number_of_lasers)
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the sampling of PulseBlockEnsembles in logic/sequence_generator_logic.py.
+
+A synthetic Rabi-like ensemble is sampled with the former element-by-element loop, with the
+serial sampling engine and with the chunk-parallel sampling engine. All results must be
+bit-identical, also in the rotating frame. Without rotating frame repeated elements are taken from
+the sample cache. Run it from the qudi main directory:
+
+python tools/pulse_sampling_benchmark.py
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import os
+import sys
+import threading
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from logic.pulse_objects import PulseBlockElement, PulseBlock, PulseBlockEnsemble
+from logic.sampling_functions import SamplingFunctions
+from logic.sequence_generator_logic import SequenceGeneratorLogic
+
+
+class SamplingStandIn(SamplingFunctions):
+    """ Stand-in for SequenceGeneratorLogic providing only what the sampling engine needs. """
+    _analyze_block_ensemble = SequenceGeneratorLogic._analyze_block_ensemble
+    _get_element_sampling_plan = SequenceGeneratorLogic._get_element_sampling_plan
+    _sample_element = SequenceGeneratorLogic._sample_element
+    _sample_elements = SequenceGeneratorLogic._sample_elements
+    _get_cached_samples = SequenceGeneratorLogic._get_cached_samples
+    _add_cached_samples = SequenceGeneratorLogic._add_cached_samples
+    clear_sample_cache = SequenceGeneratorLogic.clear_sample_cache
+    _min_samples_per_chunk = 2**20
+    _sample_cache_max_bytes = 256 * 2**20
+
+    def __init__(self, sample_rate, sampling_threads):
+        SamplingFunctions.__init__(self)
+        self.sample_rate = sample_rate
+        self.amplitude_dict = {'a_ch1': 0.5, 'a_ch2': 0.5}
+        self._sampling_threads = sampling_threads
+        self._sample_cache_lock = threading.Lock()
+        self.clear_sample_cache()
+
+
+def loop_sample(self, ensemble, ana_chnl_names, offset_bin=0):
+    """ Former element-by-element sampling of sample_pulse_block_ensemble (write to RAM). """
+    number_of_samples, number_of_elements, length_elements_bins, digital_rising_bins = \
+        self._analyze_block_ensemble(ensemble)
+    analog_samples = np.empty([ensemble.analog_channels, number_of_samples], dtype='float32')
+    digital_samples = np.empty([ensemble.digital_channels, number_of_samples], dtype=bool)
+    entry_ind = 0
+    element_count = 0
+    for block, reps in ensemble.block_list:
+        for rep_no in range(reps+1):
+            for elem_ind, block_element in enumerate(block.element_list):
+                parameters = block_element.parameters
+                element_length_bins = length_elements_bins[element_count]
+                element_count += 1
+                time_arr = (offset_bin + np.arange(element_length_bins, dtype='float64')) / self.sample_rate
+                for i, state in enumerate(block_element.digital_high):
+                    digital_samples[i, entry_ind:entry_ind+element_length_bins] = np.full(element_length_bins, state, dtype=bool)
+                for i, func_name in enumerate(block_element.pulse_function):
+                    analog_samples[i, entry_ind:entry_ind+element_length_bins] = np.float32(self._math_func[func_name](time_arr, parameters[i])/self.amplitude_dict[ana_chnl_names[i]])
+                entry_ind += element_length_bins
+                if ensemble.rotating_frame:
+                    offset_bin += element_length_bins
+    return analog_samples, digital_samples, offset_bin
+
+
+def engine_sample(self, ensemble, ana_chnl_names, offset_bin=0):
+    """ Sampling as done by sample_pulse_block_ensemble now (write to RAM). """
+    number_of_samples, number_of_elements, length_elements_bins, digital_rising_bins = \
+        self._analyze_block_ensemble(ensemble)
+    element_plan, offset_bin = self._get_element_sampling_plan(ensemble, length_elements_bins,
+                                                               offset_bin)
+    analog_samples = np.empty([ensemble.analog_channels, number_of_samples], dtype='float32')
+    digital_samples = np.empty([ensemble.digital_channels, number_of_samples], dtype=bool)
+    self._sample_elements(element_plan, analog_samples, digital_samples, ana_chnl_names,
+                          ensemble.rotating_frame)
+    return analog_samples, digital_samples, offset_bin
+
+
+def make_rabi_ensemble(number_of_taus, sample_rate, rotating_frame=True):
+    """ Rabi ensemble with increasing microwave pulses, laser pulses and waiting times. """
+    mw_params = [{'frequency1': 100e6, 'amplitude1': 0.25, 'phase1': 0.0},
+                 {'frequency1': 100e6, 'amplitude1': 0.25, 'phase1': 90.0}]
+    idle_params = [{}, {}]
+    mw_element = PulseBlockElement(10e-9, 10e-9, ['Sin', 'Cos'], [False, False], mw_params)
+    laser_element = PulseBlockElement(3e-6, 0, ['Idle', 'Idle'], [True, False], idle_params)
+    wait_element = PulseBlockElement(1.5e-6, 0, ['Idle', 'Idle'], [False, False], idle_params)
+    gauss_element = PulseBlockElement(200e-9, 0, ['SinGauss', 'CosGauss'], [False, True],
+                                      mw_params)
+    block = PulseBlock('rabi', [mw_element, laser_element, wait_element])
+    gauss_block = PulseBlock('gauss', [gauss_element, laser_element, wait_element])
+    return PulseBlockEnsemble('rabi', [(block, number_of_taus - 1), (gauss_block, 9)],
+                              rotating_frame=rotating_frame)
+
+
+def make_repeated_ensemble(repetitions, sample_rate, rotating_frame=False):
+    """ Ensemble with many repetitions of the same block of microwave pulses. """
+    mw_params = [{'frequency1': 100e6, 'amplitude1': 0.25, 'phase1': 0.0},
+                 {'frequency1': 100e6, 'amplitude1': 0.25, 'phase1': 90.0}]
+    dc_params = [{'amplitude1': 0.1}, {'amplitude1': 0.2}]
+    pi_element = PulseBlockElement(100e-9, 0, ['Sin', 'Cos'], [False, False], mw_params)
+    tau_element = PulseBlockElement(500e-9, 0, ['DC', 'DC'], [False, True], dc_params)
+    block = PulseBlock('xy', [pi_element, tau_element, pi_element, tau_element])
+    return PulseBlockEnsemble('xy', [(block, repetitions - 1)], rotating_frame=rotating_frame)
+
+
+def compare(ensemble, sample_rate, offset_bin=0):
+    ana_chnl_names = ['a_ch1', 'a_ch2']
+    times = dict()
+    results = dict()
+    for name, func, threads in (('loop', loop_sample, 1), ('serial', engine_sample, 1),
+                                ('parallel', engine_sample, 0)):
+        sampler = SamplingStandIn(sample_rate, threads)
+        start = time.perf_counter()
+        results[name] = func(sampler, ensemble, ana_chnl_names, offset_bin)
+        times[name] = time.perf_counter() - start
+    ref_analog, ref_digital, ref_offset = results['loop']
+    cache_hits = sampler.sample_cache_hits
+    for name in ('serial', 'parallel'):
+        analog, digital, offset = results[name]
+        if not (np.array_equal(ref_analog.view(np.uint32), analog.view(np.uint32))
+                and np.array_equal(ref_digital, digital) and ref_offset == offset):
+            raise AssertionError('Samples of the {0} sampling differ from the loop.'.format(name))
+    print('{0:<5} rotating_frame={1:<5} offset={2:<6d} samples={3:<11d} loop: {4:7.3f} s   '
+          'serial: {5:7.3f} s   parallel ({6:d} CPUs): {7:7.3f} s   speedup: {8:5.1f}x   '
+          'cache hits: {9:d}'.format(ensemble.name, str(ensemble.rotating_frame), offset_bin,
+                                     ref_analog.shape[1], times['loop'], times['serial'],
+                                     os.cpu_count(), times['parallel'],
+                                     times['loop'] / times['parallel'], cache_hits))
+
+
+if __name__ == '__main__':
+    sample_rate = 12e9
+    compare(make_rabi_ensemble(100, sample_rate), sample_rate)
+    compare(make_rabi_ensemble(100, sample_rate), sample_rate, offset_bin=12345)
+    compare(make_rabi_ensemble(100, sample_rate, rotating_frame=False), sample_rate)
+    compare(make_rabi_ensemble(400, sample_rate), sample_rate)
+    compare(make_repeated_ensemble(500, sample_rate), sample_rate)
+    compare(make_repeated_ensemble(500, sample_rate, rotating_frame=True), sample_rate)
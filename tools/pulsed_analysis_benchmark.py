@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark for the pulsed analysis methods in logic/pulsed_analysis_methods.
+
+Compares the vectorized analysis kernels against the former per-laser python loops on synthetic
+laser data and checks that both give the same output. Run it from the qudi main directory:
+
+python tools/pulsed_analysis_benchmark.py
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import os
+import sys
+import timeit
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from logic.pulsed_analysis_methods import basic_analysis_methods
+
+
+class AnalysisSettings:
+    """ Stand-in for PulseAnalysisLogic holding the analysis windows in bins. """
+    signal_start_bin = 5
+    signal_end_bin = 205
+    norm_start_bin = 500
+    norm_end_bin = 700
+
+
+def loop_mean_norm(self, laser_data):
+    """ Former per-laser implementation of analyse_mean_norm. """
+    num_of_lasers = laser_data.shape[0]
+    reference_mean = np.zeros(num_of_lasers, dtype=float)
+    signal_mean = np.zeros(num_of_lasers, dtype=float)
+    signal_area = np.zeros(num_of_lasers, dtype=float)
+    reference_area = np.zeros(num_of_lasers, dtype=float)
+    measuring_error = np.zeros(num_of_lasers, dtype=float)
+    signal_data = np.empty(num_of_lasers, dtype=float)
+    for ii in range(num_of_lasers):
+        norm_tmp_data = laser_data[ii][self.norm_start_bin:self.norm_end_bin]
+        if np.sum(norm_tmp_data) < 1:
+            reference_mean[ii] = 0.0
+        else:
+            reference_mean[ii] = norm_tmp_data.mean()
+        signal_tmp_data = laser_data[ii][self.signal_start_bin:self.signal_end_bin]
+        if np.sum(signal_tmp_data) < 1:
+            signal_mean[ii] = 0.0
+        else:
+            signal_mean[ii] = signal_tmp_data.mean() - reference_mean[ii]
+        if reference_mean[ii] == 0.0:
+            signal_data[ii] = 0.0
+        else:
+            signal_data[ii] = 1. + (signal_mean[ii] / reference_mean[ii])
+    for jj in range(num_of_lasers):
+        signal_area[jj] = laser_data[jj][self.signal_start_bin:self.signal_end_bin].sum()
+        reference_area[jj] = laser_data[jj][self.norm_start_bin:self.norm_end_bin].sum()
+        if reference_area[jj] == 0.:
+            measuring_error[jj] = 0.
+        elif signal_area[jj] == 0.:
+            measuring_error[jj] = 0.
+        else:
+            measuring_error[jj] = signal_data[jj] * np.sqrt(
+                1 / signal_area[jj] + 1 / reference_area[jj])
+    return signal_data, measuring_error
+
+
+def loop_mean(self, laser_data):
+    """ Former per-laser implementation of analyse_mean. """
+    num_of_lasers = laser_data.shape[0]
+    signal_mean = np.zeros(num_of_lasers, dtype=float)
+    measuring_error = np.zeros(num_of_lasers, dtype=float)
+    for ii in range(num_of_lasers):
+        signal_tmp_data = laser_data[ii][self.signal_start_bin:self.signal_end_bin]
+        if np.sum(signal_tmp_data) < 1:
+            signal_mean[ii] = 0.0
+            measuring_error[ii] = 0.
+        else:
+            signal_mean[ii] = signal_tmp_data.mean()
+            measuring_error[ii] = (np.sqrt(signal_tmp_data.sum())
+                                   / (self.signal_end_bin - self.signal_start_bin))
+    return signal_mean, measuring_error
+
+
+def make_laser_data(num_of_lasers, num_of_bins, seed=0):
+    """ Poissonian laser pulses with a few empty pulses to exercise the zero-count branches. """
+    rng = np.random.RandomState(seed)
+    laser_data = rng.poisson(3.0, size=(num_of_lasers, num_of_bins))
+    laser_data[::17] = 0
+    laser_data[1::23, 500:700] = 0
+    return laser_data
+
+
+def compare(name, reference_func, vectorized_func, laser_data, repeat=3):
+    settings = AnalysisSettings()
+    ref_signal, ref_error = reference_func(settings, laser_data)
+    new_signal, new_error = vectorized_func(settings, laser_data)
+    if not (np.allclose(ref_signal, new_signal, rtol=1e-12, atol=0)
+            and np.allclose(ref_error, new_error, rtol=1e-12, atol=0)):
+        raise AssertionError('Output of vectorized "{0}" differs from the loop.'.format(name))
+
+    loop_time = min(timeit.repeat(lambda: reference_func(settings, laser_data),
+                                  number=1, repeat=repeat))
+    vec_time = min(timeit.repeat(lambda: vectorized_func(settings, laser_data),
+                                 number=1, repeat=repeat))
+    print('{0:<10} lasers={1:<6d} loop: {2:9.3f} ms   vectorized: {3:9.3f} ms   '
+          'speedup: {4:7.1f}x'.format(name, laser_data.shape[0], loop_time * 1e3,
+                                      vec_time * 1e3, loop_time / vec_time))
+
+
+if __name__ == '__main__':
+    for num_of_lasers in (50, 1000, 5000):
+        data = make_laser_data(num_of_lasers, 3000)
+        compare('mean_norm', loop_mean_norm, basic_analysis_methods.analyse_mean_norm, data)
+        compare('mean', loop_mean, basic_analysis_methods.analyse_mean, data)
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the PicoHarp300 TTTR decoder in hardware/picoquant/tttr_decoder.py.
+
+Synthetic FIFO records are fed to the histogrammer in chunks of the FIFO read size. The result is
+checked against a record-by-record reference decoder and the decoding rate is compared to the
+maximum FIFO readout rate. Finally the threaded background readout of
+hardware/picoquant/tttr_acquisition.py is run against a simulated FIFO. Run it from the qudi main
+directory:
+
+python tools/tttr_decoder_benchmark.py
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from hardware.picoquant import tttr_decoder
+from hardware.picoquant.tttr_acquisition import TTTRAcquisition
+
+# PH_ReadFiFo returns at most TTREADMAX records per call
+TTREADMAX = 131072
+# max. sustained count rate of the PicoHarp300 in TTTR mode
+MAX_FIFO_RATE = 5e6
+
+
+def reference_t3_histogram(records, number_of_bins, bin_factor, number_of_gates=0):
+    """ Record-by-record T3 histogram following the PicoQuant demo code. """
+    if number_of_gates > 0:
+        histogram = np.zeros((number_of_gates, number_of_bins), dtype=np.int64)
+    else:
+        histogram = np.zeros(number_of_bins, dtype=np.int64)
+    overflow_time = 0
+    marker_sync = 0
+    for record in records:
+        record = int(record)
+        channel = record >> 28
+        dtime = (record >> 16) & 0x0FFF
+        nsync = record & 0xFFFF
+        if channel == 15:
+            if dtime == 0:
+                overflow_time += tttr_decoder.T3_WRAPAROUND
+            else:
+                marker_sync = overflow_time + nsync
+            continue
+        time_bin = dtime // bin_factor
+        if time_bin >= number_of_bins:
+            continue
+        if number_of_gates > 0:
+            gate = (overflow_time + nsync - marker_sync) % number_of_gates
+            histogram[gate, time_bin] += 1
+        else:
+            histogram[time_bin] += 1
+    return histogram
+
+
+def reference_t2_histogram(records, number_of_bins, bin_factor, sync_channel=0):
+    """ Record-by-record T2 histogram of the delays to the last sync event. """
+    histogram = np.zeros(number_of_bins, dtype=np.int64)
+    overflow_time = 0
+    last_sync = None
+    for record in records:
+        record = int(record)
+        channel = record >> 28
+        time_tag = record & 0x0FFFFFFF
+        if channel == 15:
+            if time_tag & 0xF == 0:
+                overflow_time += tttr_decoder.T2_WRAPAROUND
+            continue
+        if channel == sync_channel:
+            last_sync = overflow_time + time_tag
+        elif last_sync is not None:
+            time_bin = (overflow_time + time_tag - last_sync) // bin_factor
+            if time_bin < number_of_bins:
+                histogram[time_bin] += 1
+    return histogram
+
+
+def process_in_chunks(histogrammer, records):
+    start = time.perf_counter()
+    for index in range(0, records.size, TTREADMAX):
+        histogrammer.process(records[index:index + TTREADMAX])
+    return time.perf_counter() - start
+
+
+def check(name, histogrammer, records, reference):
+    elapsed = process_in_chunks(histogrammer, records)
+    if not np.array_equal(histogrammer.get_histogram(), reference):
+        raise AssertionError('Histogram of "{0}" differs from the reference decoder.'.format(name))
+    rate = records.size / elapsed
+    print('{0:<12} records={1:<9d} photons={2:<9d} overflows={3:<5d} {4:8.1f} Mrecords/s '
+          '({5:5.1f}x max. FIFO rate)'.format(name, records.size, histogrammer.photon_count,
+                                              histogrammer.overflow_count, rate / 1e6,
+                                              rate / MAX_FIFO_RATE))
+
+
+class SimulatedFifo:
+    """ Serves pregenerated records like PH_ReadFiFo, limited to a given record rate. A read
+    waits until the buffer can be filled or the 80 ms timeout of the device has passed.
+    """
+
+    def __init__(self, records, record_rate, timeout=0.08):
+        self.records = records
+        self.record_rate = record_rate
+        self.timeout = timeout
+        self.position = 0
+        self.start_time = None
+
+    def available(self):
+        # records that have arrived in the FIFO so far and were not read yet
+        arrived = int((time.perf_counter() - self.start_time) * self.record_rate)
+        return max(min(arrived, self.records.size) - self.position, 0)
+
+    def read(self, buffer):
+        if self.start_time is None:
+            self.start_time = time.perf_counter()
+        deadline = time.perf_counter() + self.timeout
+        while (self.available() < buffer.size and time.perf_counter() < deadline
+               and self.position + self.available() < self.records.size):
+            time.sleep(0.001)
+        number_of_records = min(self.available(), buffer.size)
+        buffer[:number_of_records] = self.records[self.position:self.position + number_of_records]
+        self.position += number_of_records
+        return number_of_records
+
+
+def check_acquisition(records, reference, record_rate):
+    histogrammer = tttr_decoder.TTTRHistogrammer(tttr_decoder.MODE_T3, 4e-12, 16e-12, 1000)
+    fifo = SimulatedFifo(records, record_rate)
+    acquisition = TTTRAcquisition(fifo.read, histogrammer, TTREADMAX)
+    acquisition.start()
+    polls = 0
+    while fifo.position < records.size:
+        # poll like the pulsed measurement logic does
+        acquisition.get_histogram()
+        polls += 1
+        time.sleep(0.05)
+    acquisition.stop()
+    statistics = acquisition.get_statistics()
+    if statistics['records_lost'] == 0 and not np.array_equal(acquisition.get_histogram(),
+                                                              reference):
+        raise AssertionError('Histogram of the threaded acquisition differs from the reference.')
+    print('acquisition  records={0:<9d} lost={1:<7d} max. buffers in use={2:<3d} polls={3:d} '
+          '(simulated FIFO rate {4:.1f} Mrecords/s)'.format(statistics['records_read'],
+                                                          statistics['records_lost'],
+                                                          statistics['max_buffers_in_use'],
+                                                          polls, record_rate / 1e6))
+
+
+if __name__ == '__main__':
+    records = tttr_decoder.generate_t3_records(2000000, photons_per_sync=0.5, seed=1)
+    reference = reference_t3_histogram(records, 1000, 4)
+    histogrammer = tttr_decoder.TTTRHistogrammer(tttr_decoder.MODE_T3, 4e-12, 16e-12, 1000)
+    check('T3 ungated', histogrammer, records, reference)
+    check_acquisition(records, reference, MAX_FIFO_RATE)
+
+    records = tttr_decoder.generate_t3_records(2000000, photons_per_sync=0.5, marker_period=100,
+                                               seed=2)
+    reference = reference_t3_histogram(records, 1000, 4, number_of_gates=100)
+    histogrammer = tttr_decoder.TTTRHistogrammer(tttr_decoder.MODE_T3, 4e-12, 16e-12, 1000,
+                                                 number_of_gates=100)
+    check('T3 gated', histogrammer, records, reference)
+
+    records = tttr_decoder.generate_t2_records(500000, photons_per_sync=0.5, seed=3)
+    reference = reference_t2_histogram(records, 1000, 250)
+    histogrammer = tttr_decoder.TTTRHistogrammer(tttr_decoder.MODE_T2, 4e-12, 1e-9, 1000)
+    check('T2 ungated', histogrammer, records, reference)